@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT, QUEUE_DEPTH, WORKERS_BUSY, observe_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """La petición no entra al pool: cola llena (429) o espera agotada (503)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class WorkloadPool:
+    """
+    Cupo de peticiones concurrentes de una clase de carga, con cola acotada.
+
+    Hasta ``concurrency`` peticiones se ejecutan a la vez; las siguientes
+    esperan en orden de llegada. Con ``queue_size`` peticiones esperando, las
+    nuevas se rechazan al instante con 429; las que esperan más de
+    ``queue_timeout_s`` se rechazan con 503. Ambos rechazos llevan un
+    Retry-After estimado a partir de la duración media de las peticiones.
+
+    Vive en el event loop del servidor (no es thread-safe).
+
+    Args:
+        name: Nombre del pool en las métricas
+        concurrency: Peticiones en ejecución simultánea
+        queue_size: Peticiones en espera como máximo
+        queue_timeout_s: Espera máxima en la cola
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout_s: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout_s = queue_timeout_s
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._mean_service_s = 1.0
+        for reason in ("queue_full", "timeout"):
+            ADMISSION_REJECTED.labels(pool=name, reason=reason)
+        self._update_gauges()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se libere lugar para una petición nueva."""
+        return max(1, math.ceil((self.waiting + 1) * self._mean_service_s / self.concurrency))
+
+    def _update_gauges(self):
+        QUEUE_DEPTH.labels(queue=f"admission_{self.name}").set(len(self._waiters))
+        WORKERS_BUSY.labels(pool=f"admission_{self.name}").set(self._active)
+        observe_threadpool()
+
+    def _reject(self, status_code: int, reason: str, detail: str) -> AdmissionRejected:
+        ADMISSION_REJECTED.labels(pool=self.name, reason=reason).inc()
+        logger.warning(f"Admisión '{self.name}': {detail}")
+        return AdmissionRejected(status_code, detail, self.retry_after())
+
+    async def acquire(self) -> float:
+        """
+        Espera un lugar en el pool.
+
+        Returns:
+            Segundos esperados en la cola
+
+        Raises:
+            AdmissionRejected: Si la cola está llena o la espera se agota
+        """
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            self._update_gauges()
+            ADMISSION_WAIT.labels(pool=self.name).observe(0.0)
+            return 0.0
+        if len(self._waiters) >= self.queue_size:
+            raise self._reject(429, "queue_full", "Servidor ocupado: demasiadas peticiones en espera")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._update_gauges()
+        start = time.monotonic()
+        try:
+            # asyncio.wait no cancela el future: si se asignó justo al vencer, se usa igual
+            await asyncio.wait({future}, timeout=self.queue_timeout_s)
+        except asyncio.CancelledError:
+            if future.done():
+                self.release()  # el cliente se fue después de recibir el lugar: cederlo
+            else:
+                future.cancel()
+                self._waiters.remove(future)
+                self._update_gauges()
+            raise
+        finally:
+            waited = time.monotonic() - start
+            ADMISSION_WAIT.labels(pool=self.name).observe(waited)
+
+        if not future.done():
+            future.cancel()
+            self._waiters.remove(future)
+            self._update_gauges()
+            raise self._reject(503, "timeout", f"Servidor ocupado: sin lugar tras {waited:.1f}s de espera")
+        return waited
+
+    def release(self, service_s: Optional[float] = None):
+        """
+        Libera el lugar de una petición terminada y se lo pasa a la primera en espera.
+
+        Args:
+            service_s: Duración de la petición, para estimar el Retry-After
+        """
+        if service_s is not None:
+            self._mean_service_s = 0.8 * self._mean_service_s + 0.2 * service_s
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)  # el lugar pasa directo a la petición en espera
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI que hace pasar cada petición por el pool de su clase de carga.
+
+    El lugar se ocupa hasta terminar de enviar la respuesta, incluidas las
+    respuestas en streaming. Las rutas sin pool pasan directo.
+
+    Args:
+        app: Aplicación ASGI
+        classify: Callable (método, ruta) -> pool, o None si la ruta no se limita
+    """
+
+    def __init__(self, app: ASGIApp, classify: Callable[[str, str], Optional[WorkloadPool]]):
+        self.app = app
+        self.classify = classify
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        pool = self.classify(scope["method"], scope["path"])
+        if pool is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await pool.acquire()
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=e.status_code,
+                content={"detail": e.detail},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool.release(time.monotonic() - start)
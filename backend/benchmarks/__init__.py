@@ -0,0 +1,10 @@
+"""
+Suite de benchmarks offline para los caminos críticos de ingesta y búsqueda.
+
+Se ejecuta sin OpenAI ni Qdrant reales: usa un servidor OpenAI falso local
+(``fake_openai``) y el modo en memoria de ``qdrant_client``.
+
+Uso:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.loadtest --scenario mixed --output load.json
+"""
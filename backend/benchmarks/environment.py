@@ -0,0 +1,63 @@
+import logging
+import os
+import tempfile
+import threading
+from types import ModuleType
+from typing import Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SerializedClient:
+    """
+    Envuelve un cliente y ejecuta sus métodos de a uno.
+
+    El modo en memoria de ``qdrant_client`` no es seguro entre hilos: una
+    búsqueda concurrente con un upsert falla con errores de numpy. Un Qdrant
+    real no necesita esto; aquí evita fallas que solo son del reemplazo local.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+def prepare_backend(openai_url: str, **env: str) -> Tuple[ModuleType, ModuleType]:
+    """
+    Configura el backend para correr contra servicios locales y lo importa.
+
+    Las variables de entorno deben fijarse antes de importar ``main`` y
+    ``vector_utils`` porque ambos leen su configuración al importarse.
+    Qdrant se reemplaza por el modo en memoria de ``qdrant_client`` (con sus
+    llamadas serializadas, ver SerializedClient) y el chunk store va a un directorio temporal, así cada ejecución empieza vacía.
+
+    Args:
+        openai_url: URL base del servidor OpenAI falso
+        **env: Variables de entorno adicionales (p. ej. MAX_PDFS="1000")
+
+    Returns:
+        Tupla (main, vector_utils)
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    os.environ["CHUNK_STORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="copiloto_bench_"), "chunks.db")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+
+    from qdrant_client import QdrantClient
+    import vector_utils
+    import main
+
+    vector_utils.set_qdrant_clients(SerializedClient(QdrantClient(location=":memory:")))
+    logger.info("Backend configurado con OpenAI falso y Qdrant en memoria")
+    return main, vector_utils
@@ -0,0 +1,318 @@
+"""
+Barrido de parámetros de recuperación: calidad contra latencia y tokens.
+
+Cada pregunta de referencia indica el PDF y las páginas donde está la
+respuesta. Para cada combinación de parámetros se mide recall@k, MRR, tokens
+del prompt y latencias de ingesta y de búsqueda, y se marcan las
+combinaciones Pareto-óptimas.
+
+Ejemplos:
+    python -m benchmarks.evaluate --synthetic --output eval.json --markdown eval.md
+    python -m benchmarks.evaluate --pdf-dir docs/ --golden golden.json --real-openai \\
+        --chunk-sizes 600,1000,1500 --overlaps 0,200 --top-ks 5,8,10
+
+Formato de --golden (lista JSON):
+    [{"question": "¿Cuál es el plazo de pago?", "pdf": "contrato.pdf", "pages": [3, 4]}]
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.environment import prepare_backend
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.run import git_revision, percentile
+from benchmarks.synthetic_pdf import generate_corpus
+
+logger = logging.getLogger("benchmarks")
+
+# Objetivos del frente de Pareto: métrica -> dirección de mejora
+OBJECTIVES = {
+    "recall_at_k": "higher",
+    "mrr": "higher",
+    "prompt_tokens": "lower",
+    "retrieval_p50_ms": "lower",
+    "ingest_s": "lower",
+}
+
+
+def _floats(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+# --- Datos ---
+def synthetic_golden(pages_by_doc: Dict[str, List[Dict[str, Any]]], per_doc: int,
+                     seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Preguntas de referencia para el corpus sintético.
+
+    Cada pregunta es un fragmento de 10 palabras de una página: con los
+    embeddings por hashing del servidor falso, el chunk que lo contiene es el
+    más parecido, así que la página de origen es la respuesta esperada.
+    """
+    rng = random.Random(seed)
+    golden = []
+    for doc, pages in pages_by_doc.items():
+        for _ in range(per_doc):
+            page = rng.choice(pages)
+            words = page["text"].split()
+            start = rng.randrange(max(1, len(words) - 10))
+            golden.append({
+                "question": " ".join(words[start:start + 10]) + "?",
+                "pdf": doc,
+                "pages": [page["page"]],
+            })
+    return golden
+
+
+def load_golden(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        golden = json.load(f)
+    for item in golden:
+        if not item.get("question") or not item.get("pdf") or not item.get("pages"):
+            raise ValueError(f"Pregunta de referencia incompleta (question, pdf, pages): {item}")
+    return golden
+
+
+# --- Métricas ---
+def rank_metrics(found: List[Tuple[str, int]], expected: set) -> Tuple[float, float]:
+    """
+    Recall@k y reciprocal rank de una búsqueda.
+
+    Args:
+        found: (pdf, página) de cada resultado, en orden
+        expected: Conjunto de (pdf, página) relevantes
+
+    Returns:
+        (recall, reciprocal_rank)
+    """
+    hits = {item for item in found if item in expected}
+    recall = len(hits) / len(expected) if expected else 0.0
+    rr = next((1.0 / rank for rank, item in enumerate(found, 1) if item in expected), 0.0)
+    return recall, rr
+
+
+def pareto_front(rows: List[Dict[str, Any]], objectives: Dict[str, str] = OBJECTIVES) -> List[Dict[str, Any]]:
+    """Marca con ``pareto=True`` las filas que ninguna otra domina en todos los objetivos."""
+    def key(row):
+        return [row[m] if d == "higher" else -row[m] for m, d in objectives.items()]
+
+    keys = [key(row) for row in rows]
+    for row, mine in zip(rows, keys):
+        row["pareto"] = not any(
+            all(o >= m for o, m in zip(other, mine)) and any(o > m for o, m in zip(other, mine))
+            for other in keys
+        )
+    return rows
+
+
+# --- Barrido ---
+def evaluate(vector_utils, pdf_utils, pages_by_doc: Dict[str, List[Dict[str, Any]]],
+             golden: List[Dict[str, Any]], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Ingesta el corpus una vez por combinación de chunking (cada una en su
+    propio tenant) y prueba sobre ella todas las combinaciones de búsqueda.
+
+    Los embeddings de las preguntas se calculan antes de medir: la latencia de
+    búsqueda incluye Qdrant, el reranking y el chunk store, no la API de embeddings,
+    cuyo costo no depende de los parámetros.
+    """
+    from rate_limiter import estimate_tokens
+
+    for item in golden:
+        vector_utils.get_embedding(item["question"])
+
+    rows = []
+    for chunk_size, overlap in itertools.product(args.chunk_sizes, args.overlaps):
+        if overlap >= chunk_size:
+            continue
+        tenant = f"eval-{chunk_size}-{overlap}"
+        chunks = [
+            chunk
+            for doc, pages in pages_by_doc.items()
+            for chunk in pdf_utils.build_chunks(pages, doc, chunk_size, overlap)
+        ]
+        location = {chunk["chunk"]: (chunk["doc"], chunk["page"]) for chunk in chunks}
+
+        logger.warning(f"Ingestando chunk_size={chunk_size} overlap={overlap} ({len(chunks)} chunks)...")
+        start = time.perf_counter()
+        failed = vector_utils.store_chunks_multi(chunks, tenant=tenant)
+        ingest_s = time.perf_counter() - start
+        if failed:
+            raise RuntimeError(f"Falló la ingesta de {list(failed)}")
+
+        for top_k, min_score in itertools.product(args.top_ks, args.min_scores):
+            latencies, recalls, rrs, results = [], [], [], []
+            for item in golden:
+                start = time.perf_counter()
+                texts = vector_utils.search_chunks(
+                    item["question"], top_k=top_k, min_score=min_score, tenant=tenant,
+                    pdf_name=item["pdf"] if args.scope == "pdf" else None
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                found = [location[t] for t in texts if t in location]
+                recall, rr = rank_metrics(found, {(item["pdf"], page) for page in item["pages"]})
+                recalls.append(recall)
+                rrs.append(rr)
+                results.append(texts)
+
+            for max_context in args.max_contexts:
+                prompt_tokens = []
+                for item, texts in zip(golden, results):
+                    messages = vector_utils.build_answer_messages(
+                        item["question"], texts, max_context_chars=max_context
+                    ) or []
+                    prompt_tokens.append(sum(estimate_tokens(m["content"]) for m in messages))
+                rows.append({
+                    "chunk_size": chunk_size,
+                    "overlap": overlap,
+                    "top_k": top_k,
+                    "min_score": min_score,
+                    "max_context": max_context,
+                    "chunks": len(chunks),
+                    "recall_at_k": round(sum(recalls) / len(recalls), 4),
+                    "mrr": round(sum(rrs) / len(rrs), 4),
+                    "prompt_tokens": round(sum(prompt_tokens) / len(prompt_tokens), 1),
+                    "retrieval_p50_ms": round(percentile(latencies, 50), 2),
+                    "retrieval_p95_ms": round(percentile(latencies, 95), 2),
+                    "ingest_s": round(ingest_s, 4),
+                })
+    return pareto_front(rows)
+
+
+def current_settings(main, pdf_utils, vector_utils, scope: str) -> Dict[str, Any]:
+    """Parámetros con los que corre el servicio (variables de entorno actuales)."""
+    return {
+        "chunk_size": pdf_utils.CHUNK_SIZE,
+        "overlap": pdf_utils.CHUNK_OVERLAP,
+        "top_k": main.RETRIEVAL_PDF_TOP_K if scope == "pdf" else main.RETRIEVAL_TOP_K,
+        "min_score": main.RETRIEVAL_PDF_MIN_SCORE if scope == "pdf" else main.RETRIEVAL_MIN_SCORE,
+        "max_context": vector_utils.MAX_CONTEXT_CHARS,
+    }
+
+
+def markdown_report(report: Dict[str, Any]) -> str:
+    """Tabla con el frente de Pareto (y la configuración actual, si está en la grilla)."""
+    columns = ["chunk_size", "overlap", "top_k", "min_score", "max_context",
+               "recall_at_k", "mrr", "prompt_tokens", "retrieval_p50_ms", "ingest_s"]
+    current = report["current_settings"]
+    lines = [
+        f"# Evaluación de recuperación ({report['meta']['timestamp']})",
+        "",
+        f"{report['meta']['questions']} preguntas, alcance `{report['meta']['scope']}`. "
+        "Filas Pareto-óptimas; ⭐ marca la configuración actual.",
+        "",
+        "| " + " | ".join(columns) + " |",
+        "|" + "---|" * len(columns),
+    ]
+    for row in report["results"]:
+        is_current = all(row[k] == v for k, v in current.items())
+        if not row["pareto"] and not is_current:
+            continue
+        cells = [str(row[c]) for c in columns]
+        if is_current:
+            cells[0] = "⭐ " + cells[0]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as workdir, FakeOpenAIServer(dimensions=args.vector_size) as fake:
+        openai_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1") if args.real_openai else fake.url
+        main, vector_utils = prepare_backend(
+            openai_url, VECTOR_SIZE=str(args.vector_size), STARTUP_WARMUP="false"
+        )
+        import pdf_utils
+        logging.getLogger().setLevel(args.log_level)
+
+        if args.synthetic:
+            paths = generate_corpus(workdir, args.docs, args.pages, args.words_per_page, seed=args.seed)
+        else:
+            paths = sorted(
+                os.path.join(args.pdf_dir, name)
+                for name in os.listdir(args.pdf_dir) if name.lower().endswith(".pdf")
+            )
+        pages_by_doc = {os.path.basename(p): pdf_utils.extract_text_from_pdf(p) for p in paths}
+        golden = (
+            synthetic_golden(pages_by_doc, args.questions_per_doc, seed=args.seed)
+            if args.synthetic else load_golden(args.golden)
+        )
+        vector_utils.create_collection_if_not_exists("pdf_chunks", args.vector_size)
+
+        rows = evaluate(vector_utils, pdf_utils, pages_by_doc, golden, args)
+        rows.sort(key=lambda r: (-r["recall_at_k"], -r["mrr"], r["prompt_tokens"]))
+        return {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "git_revision": git_revision(),
+                "documents": len(pages_by_doc),
+                "questions": len(golden),
+                "scope": args.scope,
+                "embeddings": "openai" if args.real_openai else "fake",
+                "params": vars(args),
+            },
+            "current_settings": current_settings(main, pdf_utils, vector_utils, args.scope),
+            "results": rows,
+        }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de recuperación")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", action="store_true", help="Corpus y preguntas sintéticos")
+    source.add_argument("--pdf-dir", help="Directorio con los PDFs a evaluar (requiere --golden)")
+    parser.add_argument("--golden", help="JSON con preguntas de referencia")
+    parser.add_argument("--real-openai", action="store_true",
+                        help="Usar la API de OpenAI configurada (OPENAI_API_KEY) en vez del servidor falso")
+    parser.add_argument("--docs", type=int, default=3, help="PDFs sintéticos")
+    parser.add_argument("--pages", type=int, default=10, help="Páginas por PDF sintético")
+    parser.add_argument("--words-per-page", type=int, default=300, help="Densidad de texto por página")
+    parser.add_argument("--questions-per-doc", type=int, default=10, help="Preguntas sintéticas por PDF")
+    parser.add_argument("--scope", choices=("pdf", "all"), default="pdf",
+                        help="Buscar en el PDF de la pregunta o en todos")
+    parser.add_argument("--chunk-sizes", type=_ints, default=[500, 1000, 1500])
+    parser.add_argument("--overlaps", type=_ints, default=[0, 200])
+    parser.add_argument("--top-ks", type=_ints, default=[3, 5, 8, 10])
+    parser.add_argument("--min-scores", type=_floats, default=[0.3, 0.5, 0.7])
+    parser.add_argument("--max-contexts", type=_ints, default=[4000, 8000])
+    parser.add_argument("--vector-size", type=int, default=3072, help="Dimensión de los embeddings")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla para datos reproducibles")
+    parser.add_argument("--output", help="Archivo JSON con todas las combinaciones")
+    parser.add_argument("--markdown", help="Archivo Markdown con el frente de Pareto")
+    parser.add_argument("--log-level", default="WARNING", help="Nivel de logging del backend")
+    args = parser.parse_args(argv)
+    if args.pdf_dir and not args.golden:
+        parser.error("--pdf-dir requiere --golden")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    report = run(args)
+    output = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    markdown = markdown_report(report)
+    if args.markdown:
+        with open(args.markdown, "w") as f:
+            f.write(markdown)
+    print(markdown)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
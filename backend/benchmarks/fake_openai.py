@@ -0,0 +1,427 @@
+"""
+Servidor OpenAI falso para benchmarks y pruebas de carga.
+
+Para apuntar un backend que corre aparte (OPENAI_BASE_URL=http://127.0.0.1:8089/v1):
+    python -m benchmarks.fake_openai --port 8089 --dimensions 3072 --faults faults.json
+"""
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def hashing_embedding(text: str, dimensions: int) -> List[float]:
+    """
+    Embedding determinista por feature hashing de las palabras del texto.
+
+    Textos que comparten palabras tienen similitud coseno alta, por lo que
+    la búsqueda semántica devuelve resultados con sentido sin llamar a OpenAI.
+
+    Args:
+        text: Texto de entrada
+        dimensions: Dimensión del vector
+
+    Returns:
+        Vector normalizado (norma L2 = 1)
+    """
+    vector = [0.0] * dimensions
+    for token in TOKEN_RE.findall(text.lower()):
+        h = zlib.crc32(token.encode("utf-8"))
+        vector[h % dimensions] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return [v / norm for v in vector]
+
+
+def count_tokens(text: str) -> int:
+    """Aproximación barata al número de tokens (~4 caracteres por token)."""
+    return max(1, len(text) // 4)
+
+
+# Como el cache de prefijos de OpenAI: se activa desde 1024 tokens y crece de a 128
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_INCREMENT = 128
+
+
+class LatencyModel:
+    """
+    Distribución de latencia de un endpoint.
+
+    Distribuciones: ``fixed`` (ms), ``uniform`` (low_ms, high_ms),
+    ``lognormal`` (median_ms, sigma: colas largas como las de una API real) y
+    ``exponential`` (mean_ms). ``max_ms`` recorta los valores extremos.
+    """
+
+    def __init__(self, dist: str = "fixed", ms: float = 0.0, low_ms: float = 0.0, high_ms: float = 0.0,
+                 median_ms: float = 0.0, sigma: float = 0.5, mean_ms: float = 0.0,
+                 max_ms: Optional[float] = None):
+        if dist not in ("fixed", "uniform", "lognormal", "exponential"):
+            raise ValueError(f"Distribución de latencia desconocida: {dist}")
+        self.dist = dist
+        self.ms = ms
+        self.low_ms = low_ms
+        self.high_ms = high_ms
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.mean_ms = mean_ms
+        self.max_ms = max_ms
+
+    @classmethod
+    def from_spec(cls, spec: Union[None, float, Dict[str, Any]]) -> "LatencyModel":
+        """Un número son ms fijos; un diccionario lleva ``dist`` y sus parámetros."""
+        if spec is None:
+            return cls()
+        if isinstance(spec, (int, float)):
+            return cls(ms=float(spec))
+        return cls(**spec)
+
+    def sample_s(self, rng: random.Random) -> float:
+        if self.dist == "fixed":
+            ms = self.ms
+        elif self.dist == "uniform":
+            ms = rng.uniform(self.low_ms, self.high_ms)
+        elif self.dist == "lognormal":
+            ms = self.median_ms * math.exp(rng.gauss(0.0, self.sigma)) if self.median_ms else 0.0
+        else:
+            ms = rng.expovariate(1.0 / self.mean_ms) if self.mean_ms else 0.0
+        if self.max_ms is not None:
+            ms = min(ms, self.max_ms)
+        return max(0.0, ms) / 1000
+
+
+@dataclass
+class FaultProfile:
+    """
+    Comportamiento del servidor falso: latencias, errores y ráfagas de 429.
+
+    Args:
+        embedding_latency: Latencia de /embeddings
+        chat_latency: Latencia de /chat/completions (hasta el primer evento en streaming)
+        stream_token_ms: Pausa entre eventos de una respuesta en streaming
+        error_rate: Fracción de llamadas que responden 500
+        rate_limit_rate: Fracción de llamadas que responden 429 fuera de las ráfagas
+        rate_limit_bursts: Ventanas (inicio_s, duración_s), desde que se aplica el perfil, en que todo responde 429
+        retry_after_s: Valor de la cabecera Retry-After de los 429
+        seed: Semilla para que las fallas sean reproducibles
+    """
+    embedding_latency: LatencyModel = field(default_factory=LatencyModel)
+    chat_latency: LatencyModel = field(default_factory=LatencyModel)
+    stream_token_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    rate_limit_bursts: List[Tuple[float, float]] = field(default_factory=list)
+    retry_after_s: float = 1.0
+    seed: int = 0
+
+    @classmethod
+    def from_spec(cls, spec: Optional[Dict[str, Any]]) -> "FaultProfile":
+        """Crea el perfil desde un diccionario (p. ej. la sección ``openai`` de un escenario)."""
+        spec = dict(spec or {})
+        for key in ("embedding_latency", "chat_latency"):
+            spec[key] = LatencyModel.from_spec(spec.get(key))
+        spec["rate_limit_bursts"] = [tuple(b) for b in spec.get("rate_limit_bursts", [])]
+        return cls(**spec)
+
+
+class FakeOpenAIServer:
+    """
+    Servidor HTTP local que imita los endpoints de embeddings y chat de OpenAI.
+
+    Args:
+        dimensions: Dimensión de los embeddings devueltos
+        embedding_latency_ms: Latencia artificial por llamada de embeddings
+        chat_latency_ms: Latencia artificial por llamada de chat
+        host: Interfaz donde escuchar
+        port: Puerto (0 = elegir uno libre)
+        faults: Perfil de latencias y fallas (reemplaza a las latencias fijas)
+    """
+
+    def __init__(self, dimensions: int = 3072, embedding_latency_ms: float = 0.0,
+                 chat_latency_ms: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 faults: Optional[FaultProfile] = None):
+        self.dimensions = dimensions
+        self.stats = {"embedding_calls": 0, "embedding_inputs": 0, "chat_calls": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0,
+                      "injected_errors": 0, "injected_rate_limits": 0}
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+        self.set_faults(faults or FaultProfile(
+            embedding_latency=LatencyModel(ms=embedding_latency_ms),
+            chat_latency=LatencyModel(ms=chat_latency_ms),
+        ))
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Servidor OpenAI falso escuchando en {self.url}")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    # --- Fallas ---
+    def set_faults(self, faults: FaultProfile):
+        """Cambia el perfil de fallas en caliente; las ráfagas se cuentan desde este momento."""
+        with self._lock:
+            self.faults = faults
+            self._rng = random.Random(faults.seed)
+            self._faults_since = time.monotonic()
+
+    def _sample_latency(self, model: LatencyModel) -> float:
+        with self._lock:
+            return model.sample_s(self._rng)
+
+    def injected_fault(self) -> Optional[Tuple[int, dict, Dict[str, str]]]:
+        """
+        Decide si la llamada falla según el perfil activo.
+
+        Returns:
+            (status, cuerpo, cabeceras) del error a responder, o None
+        """
+        with self._lock:
+            faults = self.faults
+            elapsed = time.monotonic() - self._faults_since
+            in_burst = any(start <= elapsed < start + duration for start, duration in faults.rate_limit_bursts)
+            roll = self._rng.random()
+        if in_burst or roll < faults.rate_limit_rate:
+            self._count("injected_rate_limits")
+            return 429, {"error": {
+                "message": "Rate limit reached (simulado)", "type": "requests", "code": "rate_limit_exceeded"
+            }}, {"retry-after": f"{faults.retry_after_s:g}"}
+        if roll < faults.rate_limit_rate + faults.error_rate:
+            self._count("injected_errors")
+            return 500, {"error": {"message": "Error interno (simulado)", "type": "server_error", "code": None}}, {}
+        return None
+
+    # --- Respuestas ---
+    def embeddings_response(self, body: dict) -> dict:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or self.dimensions
+        use_base64 = body.get("encoding_format") == "base64"
+
+        self._count("embedding_calls")
+        self._count("embedding_inputs", len(inputs))
+        delay = self._sample_latency(self.faults.embedding_latency)
+        if delay:
+            time.sleep(delay)
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = hashing_embedding(text, dimensions)
+            if use_base64:
+                vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+
+        tokens = sum(count_tokens(t) for t in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _cached_tokens(self, messages: list) -> int:
+        """
+        Tokens del prompt que un cache de prefijos ya habría visto.
+
+        Recuerda el hash de cada prefijo de mensajes; el mayor prefijo repetido
+        cuenta como cacheado si supera el mínimo, redondeado hacia abajo.
+        """
+        digest = hashlib.sha256()
+        cached = tokens = 0
+        prefixes = []
+        for message in messages:
+            content = str(message.get("content", ""))
+            digest.update(f"{message.get('role')}\x00{content}\x00".encode("utf-8"))
+            tokens += count_tokens(content)
+            key = digest.hexdigest()
+            prefixes.append(key)
+            with self._lock:
+                if key in self._seen_prefixes:
+                    cached = tokens
+        with self._lock:
+            self._seen_prefixes.update(prefixes)
+        if cached < PREFIX_CACHE_MIN_TOKENS:
+            return 0
+        return cached - cached % PREFIX_CACHE_INCREMENT
+
+    def _chat_usage(self, body: dict, content: str) -> dict:
+        messages = body.get("messages", [])
+        prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in messages)
+        cached_tokens = self._cached_tokens(messages)
+        completion_tokens = count_tokens(content)
+        self._count("prompt_tokens", prompt_tokens)
+        self._count("cached_tokens", cached_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def _chat_content(self, body: dict) -> str:
+        self._count("chat_calls")
+        delay = self._sample_latency(self.faults.chat_latency)
+        if delay:
+            time.sleep(delay)
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        return f"Respuesta simulada basada en {len(prompt)} caracteres de contexto."
+
+    def chat_response(self, body: dict) -> dict:
+        content = self._chat_content(body)
+        return {
+            "id": f"chatcmpl-fake-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-chat"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": self._chat_usage(body, content),
+        }
+
+    def chat_stream_events(self, body: dict) -> List[dict]:
+        """Fragmentos de una respuesta en streaming (una palabra por evento)."""
+        content = self._chat_content(body)
+        base = {
+            "id": f"chatcmpl-fake-{int(time.time() * 1000)}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-chat"),
+        }
+        events = [
+            {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": word},
+                                  "finish_reason": None}]}
+            for word in re.findall(r"\S+\s*", content)
+        ]
+        events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append({**base, "choices": [], "usage": self._chat_usage(body, content)})
+        return events
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_events(self, events: List[dict]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pause = server.faults.stream_token_ms / 1000
+                for i, event in enumerate([json.dumps(e) for e in events] + ["[DONE]"]):
+                    if pause and i:
+                        time.sleep(pause)
+                    data = f"data: {event}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                # Sondeo de readiness del backend (models.list)
+                if self.path.endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [
+                        {"id": model, "object": "model", "created": 0, "owned_by": "fake"}
+                        for model in ("text-embedding-3-large", "gpt-4o-mini")
+                    ]})
+                else:
+                    self._send_json(404, {"error": {"message": f"Ruta no soportada: {self.path}"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                fault = server.injected_fault() if self.path.endswith(("/embeddings", "/chat/completions")) else None
+                if fault:
+                    self._send_json(*fault)
+                elif self.path.endswith("/embeddings"):
+                    self._send_json(200, server.embeddings_response(body))
+                elif self.path.endswith("/chat/completions") and body.get("stream"):
+                    self._send_events(server.chat_stream_events(body))
+                elif self.path.endswith("/chat/completions"):
+                    self._send_json(200, server.chat_response(body))
+                else:
+                    self._send_json(404, {"error": {"message": f"Ruta no soportada: {self.path}"}})
+
+        return Handler
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Servidor OpenAI falso con latencias y fallas configurables")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dimensions", type=int, default=3072, help="Dimensión de los embeddings")
+    parser.add_argument("--faults", help="JSON con el perfil de fallas (mismo formato que la sección openai de un escenario)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    faults = None
+    if args.faults:
+        with open(args.faults) as f:
+            faults = FaultProfile.from_spec(json.load(f))
+    server = FakeOpenAIServer(dimensions=args.dimensions, host=args.host, port=args.port, faults=faults).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
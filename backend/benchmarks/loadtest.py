@@ -0,0 +1,517 @@
+"""
+Prueba de carga end-to-end: tráfico mixto contra el backend con fallas de OpenAI inyectadas.
+
+Levanta el backend con uvicorn en un subproceso (Qdrant en memoria y el
+servidor OpenAI falso) y lo carga según un escenario:
+    python -m benchmarks.loadtest --scenario mixed --output load.json --baseline previous.json
+
+Contra un backend que ya corre, iniciado con OPENAI_BASE_URL=http://127.0.0.1:8089/v1:
+    python -m benchmarks.loadtest --scenario openai_429 --target http://localhost:8000 --openai-port 8089
+
+Los escenarios son JSON (ver benchmarks/scenarios/): duración, corpus, perfil
+de fallas de OpenAI (con fases que lo cambian en caliente) y cargas de trabajo
+concurrentes en lazo cerrado.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_openai import FakeOpenAIServer, FaultProfile
+from benchmarks.run import compare_results, git_revision, percentile
+from benchmarks.synthetic_pdf import VOCABULARY, generate_corpus
+
+logger = logging.getLogger("benchmarks.loadtest")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+# Con el backend en subproceso la carga usa su propio tenant, autenticado por API key
+API_KEY = "loadtest-key"
+TENANT = "loadtest"
+
+# Contadores de /metrics del backend que se informan como diferencia entre el inicio y el fin. Son de
+# todo el backend (no se pueden atribuir a una carga): se informan con el prefijo backend_global_
+BACKEND_COUNTERS = (
+    "copiloto_openai_retries_total",
+    "copiloto_openai_rate_limited_total",
+    "copiloto_admission_rejected_total",
+    "copiloto_single_flight_total",
+)
+METRIC_LINE_RE = re.compile(r'^(\w+)(?:\{([^}]*)\})? ([0-9.eE+-]+)$')
+
+
+@dataclass
+class Sample:
+    """Resultado de una petición."""
+    workload: str
+    offset_s: float
+    latency_ms: float
+    status: int  # 0 = error de conexión o timeout
+    ttfb_ms: Optional[float] = None
+
+
+# --- Escenarios ---
+def load_scenario(name_or_path: str) -> Dict[str, Any]:
+    """Lee un escenario por ruta o por nombre (benchmarks/scenarios/<nombre>.json)."""
+    path = name_or_path if os.path.exists(name_or_path) else os.path.join(SCENARIOS_DIR, f"{name_or_path}.json")
+    if not os.path.exists(path):
+        available = sorted(f[:-5] for f in os.listdir(SCENARIOS_DIR) if f.endswith(".json"))
+        raise ValueError(f"Escenario '{name_or_path}' no encontrado (disponibles: {', '.join(available)})")
+    with open(path) as f:
+        scenario = json.load(f)
+    if not scenario.get("workloads"):
+        raise ValueError(f"El escenario '{name_or_path}' no define workloads")
+    return scenario
+
+
+# --- Backend ---
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_backend(port: int, openai_url: str):
+    """Corre el backend con Qdrant en memoria (modo interno del subproceso)."""
+    import uvicorn
+    from benchmarks.environment import prepare_backend
+
+    main, _ = prepare_backend(openai_url)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_backend(openai_url: str, env: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    """
+    Levanta el backend en un subproceso, así la carga y el servidor no comparten el GIL.
+
+    Returns:
+        Tupla (proceso, URL base del backend)
+    """
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.loadtest", "--serve-backend", "--port", str(port),
+         "--openai-url", openai_url],
+        cwd=BACKEND_DIR,
+        env={**os.environ, "OPENAI_API_KEY": "loadtest", **env},
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_ready(url, process=process)
+    return process, url
+
+
+def wait_ready(url: str, timeout_s: float = 60, process: Optional[subprocess.Popen] = None):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"El backend terminó al arrancar (código {process.returncode})")
+        try:
+            if httpx.get(f"{url}/ready", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"El backend en {url} no quedó listo en {timeout_s:.0f}s")
+
+
+def stop_backend(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def backend_counters(url: str) -> Dict[str, float]:
+    """Contadores de interés de /metrics, con sus etiquetas en la clave."""
+    counters = {}
+    for line in httpx.get(f"{url}/metrics", timeout=10).text.splitlines():
+        match = METRIC_LINE_RE.match(line)
+        if match and match.group(1) in BACKEND_COUNTERS:
+            labels = "_".join(value for value in re.findall(r'="([^"]*)"', match.group(2) or ""))
+            name = match.group(1).replace("copiloto_", "backend_global_").replace("_total", "")
+            counters[f"{name}_{labels}" if labels else name] = float(match.group(3))
+    return counters
+
+
+# --- Cargas de trabajo ---
+class WorkloadContext:
+    """Datos compartidos por los workers: documentos cargados y PDFs para ingestar."""
+
+    def __init__(self, doc_names: List[str], ingest_pdfs: List[bytes], seed: int):
+        self.doc_names = doc_names
+        self.ingest_pdfs = ingest_pdfs
+        self.seed = seed
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+
+def _question(rng: random.Random) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(8)) + "?"
+
+
+def _timed(fn: Callable[[], httpx.Response]) -> Tuple[float, int]:
+    start = time.perf_counter()
+    try:
+        status = fn().status_code
+    except httpx.HTTPError:
+        status = 0
+    return (time.perf_counter() - start) * 1000, status
+
+
+def run_chat(client: httpx.Client, spec: Dict[str, Any], ctx: WorkloadContext, rng: random.Random):
+    body = {"message": _question(rng)}
+    if ctx.doc_names and rng.random() < spec.get("pdf_ratio", 0.5):
+        body["pdf_name"] = rng.choice(ctx.doc_names)
+    latency, status = _timed(lambda: client.post("/chat", json=body))
+    yield spec["name"], latency, status, None
+
+
+def run_chat_stream(client: httpx.Client, spec: Dict[str, Any], ctx: WorkloadContext, rng: random.Random):
+    body = {"message": _question(rng), "stream": True}
+    start = time.perf_counter()
+    ttfb, status = None, 0
+    try:
+        with client.stream("POST", "/chat", json=body) as response:
+            status = response.status_code
+            for _ in response.iter_bytes():
+                if ttfb is None:
+                    ttfb = (time.perf_counter() - start) * 1000
+    except httpx.HTTPError:
+        status = 0
+    yield spec["name"], (time.perf_counter() - start) * 1000, status, ttfb
+
+
+def run_batch_qa(client: httpx.Client, spec: Dict[str, Any], ctx: WorkloadContext, rng: random.Random):
+    body = {"questions": [_question(rng) for _ in range(spec.get("questions", 5))]}
+    latency, status = _timed(lambda: client.post("/chat/batch", json=body))
+    yield spec["name"], latency, status, None
+
+
+def run_ingest(client: httpx.Client, spec: Dict[str, Any], ctx: WorkloadContext, rng: random.Random):
+    """Sube un PDF con nombre único y lo elimina, para sostener la carga sin llenar el cupo."""
+    filename = f"load_{ctx.next_id()}.pdf"
+    pdf = rng.choice(ctx.ingest_pdfs)
+    latency, status = _timed(lambda: client.post(
+        "/ingest", files={"file": (filename, pdf, "application/pdf")}
+    ))
+    yield spec["name"], latency, status, None
+    if status == 200:
+        latency, status = _timed(lambda: client.delete(f"/delete_pdf/{filename}"))
+        yield f"{spec['name']}_delete", latency, status, None
+
+
+def run_get(client: httpx.Client, spec: Dict[str, Any], ctx: WorkloadContext, rng: random.Random):
+    path = spec["path"]
+    if "{pdf}" in path:
+        path = path.replace("{pdf}", rng.choice(ctx.doc_names))
+    latency, status = _timed(lambda: client.get(path))
+    yield spec["name"], latency, status, None
+
+
+WORKLOADS = {
+    "chat": run_chat,
+    "chat_stream": run_chat_stream,
+    "batch_qa": run_batch_qa,
+    "ingest": run_ingest,
+    "get": run_get,
+}
+
+
+def _headers(api_key: Optional[str]) -> Dict[str, str]:
+    return {"X-API-Key": api_key} if api_key else {}
+
+
+def _worker(url: str, spec: Dict[str, Any], ctx: WorkloadContext, worker_id: int, start: float,
+            end: float, timeout_s: float, api_key: Optional[str], samples: List[Sample], lock: threading.Lock):
+    run_once = WORKLOADS[spec["kind"]]
+    rng = random.Random(f"{ctx.seed}-{spec['name']}-{worker_id}")
+    think_s = spec.get("think_ms", 0) / 1000
+    with httpx.Client(base_url=url, timeout=timeout_s, headers=_headers(api_key)) as client:
+        while time.perf_counter() < end:
+            begin = time.perf_counter() - start
+            results = [
+                Sample(name, begin, latency, status, ttfb)
+                for name, latency, status, ttfb in run_once(client, spec, ctx, rng)
+            ]
+            with lock:
+                samples.extend(results)
+            if think_s:
+                time.sleep(think_s)
+
+
+# --- Resultados ---
+def summarize(samples: List[Sample], duration_s: float) -> Dict[str, Any]:
+    """
+    Throughput, percentiles, errores y códigos de estado por carga de trabajo.
+
+    El throughput cuenta solo las peticiones terminadas dentro de la ventana
+    del escenario y divide por su duración: las que terminan durante el
+    vaciado (workers esperando su última respuesta) no inflan ni diluyen la tasa.
+    """
+    metrics: Dict[str, Any] = {}
+
+    def throughput(group: List[Sample]) -> float:
+        done = sum(1 for s in group if s.offset_s + s.latency_ms / 1000 <= duration_s)
+        return round(done / duration_s, 2) if duration_s else 0.0
+
+    by_workload: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_workload.setdefault(sample.workload, []).append(sample)
+
+    for name, group in sorted(by_workload.items()):
+        latencies = [s.latency_ms for s in group]
+        errors = sum(1 for s in group if not 200 <= s.status < 300)
+        metrics[f"{name}_requests"] = len(group)
+        metrics[f"{name}_throughput_rps"] = throughput(group)
+        metrics[f"{name}_error_rate"] = round(errors / len(group), 4)
+        for q in (50, 95, 99):
+            metrics[f"{name}_p{q}_ms"] = round(percentile(latencies, q), 2)
+        metrics[f"{name}_max_ms"] = round(max(latencies), 2)
+        ttfbs = [s.ttfb_ms for s in group if s.ttfb_ms is not None]
+        if ttfbs:
+            metrics[f"{name}_ttfb_p50_ms"] = round(percentile(ttfbs, 50), 2)
+            metrics[f"{name}_ttfb_p95_ms"] = round(percentile(ttfbs, 95), 2)
+        metrics[f"{name}_status_codes"] = dict(Counter(str(s.status) for s in group))
+
+    errors = sum(1 for s in samples if not 200 <= s.status < 300)
+    metrics["total_requests"] = len(samples)
+    metrics["total_throughput_rps"] = throughput(samples)
+    metrics["total_error_rate"] = round(errors / len(samples), 4) if samples else 0.0
+    return metrics
+
+
+def timeline(samples: List[Sample], wall_s: float) -> List[Dict[str, Any]]:
+    """Peticiones y errores por segundo (para ver el efecto de una ráfaga de 429)."""
+    seconds = int(wall_s) + 1
+    requests, errors = [0] * seconds, [0] * seconds
+    for sample in samples:
+        second = min(int(sample.offset_s), seconds - 1)
+        requests[second] += 1
+        if not 200 <= sample.status < 300:
+            errors[second] += 1
+    return [{"t": t, "requests": r, "errors": e} for t, (r, e) in enumerate(zip(requests, errors))]
+
+
+def metric_directions(metrics: Dict[str, Any]) -> Dict[str, str]:
+    """Dirección de mejora de las métricas comparables (latencias, throughput y reintentos)."""
+    directions = {}
+    for name, value in metrics.items():
+        if not isinstance(value, (int, float)):
+            continue
+        if re.search(r"_p\d+_ms$", name):
+            directions[name] = "lower"
+        elif name.endswith("_throughput_rps"):
+            directions[name] = "higher"
+        elif name.startswith("backend_global_openai_retries"):
+            directions[name] = "lower"
+    return directions
+
+
+def compare_load(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+                 error_rate_tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Regresiones contra una ejecución anterior del mismo escenario.
+
+    Las tasas de error se comparan en valor absoluto (pasar de 0 a 5% de
+    errores es una regresión aunque no haya cambio relativo que medir).
+    """
+    regressions = compare_results(current, baseline, threshold, metric_directions(baseline))
+    for name, old in baseline.items():
+        new = current.get(name)
+        if name.endswith("_error_rate") and new is not None and new - old > error_rate_tolerance:
+            regressions.append({
+                "metric": name,
+                "baseline": old,
+                "current": new,
+                "change_pct": round((new - old) * 100, 1),
+            })
+    return regressions
+
+
+# --- Ejecución ---
+def _setup_corpus(url: str, scenario: Dict[str, Any], workdir: str, seed: int,
+                  api_key: Optional[str]) -> WorkloadContext:
+    corpus = scenario.get("corpus", {})
+    docs = corpus.get("docs", 3)
+    paths = generate_corpus(workdir, docs + corpus.get("ingest_docs", 3), corpus.get("pages", 5),
+                            corpus.get("words_per_page", 300), seed=seed)
+    preload, ingest = paths[:docs], paths[docs:]
+    if preload:
+        files = [("files", (os.path.basename(p), open(p, "rb").read(), "application/pdf")) for p in preload]
+        response = httpx.post(f"{url}/ingest/batch", files=files, headers=_headers(api_key), timeout=300)
+        if response.status_code != 200 or response.json().get("failed"):
+            raise RuntimeError(f"No se pudo cargar el corpus: {response.status_code} {response.text[:200]}")
+    ingest_pdfs = [open(p, "rb").read() for p in ingest or preload]
+    return WorkloadContext([os.path.basename(p) for p in preload], ingest_pdfs, seed)
+
+
+def run(scenario: Dict[str, Any], target: Optional[str] = None, openai_port: int = 0,
+        duration_s: Optional[float] = None, seed: Optional[int] = None,
+        api_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Ejecuta un escenario y devuelve sus métricas.
+
+    Args:
+        scenario: Escenario (ver load_scenario)
+        target: URL de un backend ya iniciado; None levanta uno en un subproceso
+        openai_port: Puerto del servidor OpenAI falso (0 = libre; fijo con target)
+        duration_s: Reemplaza la duración del escenario
+        seed: Reemplaza la semilla del escenario
+        api_key: API key del backend indicado en target (None = backend de un solo tenant)
+    """
+    duration_s = duration_s or scenario.get("duration_s", 30)
+    seed = scenario.get("seed", 0) if seed is None else seed
+    faults = FaultProfile.from_spec({"seed": seed, **scenario.get("openai", {})})
+
+    with FakeOpenAIServer(dimensions=scenario.get("vector_size", 1536), port=openai_port) as fake, \
+            tempfile.TemporaryDirectory() as workdir:
+        process = None
+        if target is None:
+            env = {"VECTOR_SIZE": str(scenario.get("vector_size", 1536)), "MAX_PDFS": "100000",
+                   "LOG_LEVEL": "WARNING", "TENANT_API_KEYS": f"{API_KEY}={TENANT}", **{k: str(v) for k, v in scenario.get("backend_env", {}).items()}}
+            logger.warning("Levantando el backend...")
+            process, url = start_backend(fake.url, env)
+            api_key = API_KEY
+        else:
+            url = target.rstrip("/")
+            wait_ready(url)
+        try:
+            logger.warning("Cargando el corpus inicial...")
+            ctx = _setup_corpus(url, scenario, workdir, seed, api_key)
+            counters_before = backend_counters(url)
+            stats_before = dict(fake.stats)
+
+            # Las fallas se activan después de la carga inicial: solo afectan a la medición
+            fake.set_faults(faults)
+            timers = [
+                threading.Timer(phase["at_s"], fake.set_faults,
+                                args=(FaultProfile.from_spec({"seed": seed, **phase["openai"]}),))
+                for phase in scenario.get("openai_phases", [])
+            ]
+            samples: List[Sample] = []
+            lock = threading.Lock()
+            timeout_s = scenario.get("request_timeout_s", 60)
+            start = time.perf_counter()
+            end = start + duration_s
+            threads = [
+                threading.Thread(target=_worker, args=(url, spec, ctx, i, start, end, timeout_s, api_key, samples, lock),
+                                 name=f"{spec['name']}-{i}")
+                for spec in scenario["workloads"]
+                for i in range(spec.get("concurrency", 1))
+            ]
+            logger.warning(f"Escenario '{scenario.get('name', '')}': {len(threads)} workers durante {duration_s:.0f}s")
+            for timer in timers:
+                timer.start()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall_s = time.perf_counter() - start
+            for timer in timers:
+                timer.cancel()
+            fake.set_faults(FaultProfile())
+
+            metrics = summarize(samples, duration_s)
+            counters_after = backend_counters(url)
+            metrics.update({
+                name: round(value - counters_before.get(name, 0.0), 2)
+                for name, value in counters_after.items()
+            })
+            metrics["openai_calls"] = {k: v - stats_before.get(k, 0) for k, v in fake.stats.items()}
+        finally:
+            if process is not None:
+                stop_backend(process)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "scenario": scenario,
+            "duration_s": duration_s,
+            "wall_s": round(wall_s, 2),
+            "seed": seed,
+            "target": target or "subproceso",
+        },
+        "metrics": metrics,
+        "timeline": timeline(samples, wall_s),
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Prueba de carga end-to-end con fallas de OpenAI inyectadas")
+    parser.add_argument("--scenario", default="mixed", help="Nombre (benchmarks/scenarios) o ruta de un escenario JSON")
+    parser.add_argument("--target", help="URL de un backend ya iniciado (apuntado al OpenAI falso)")
+    parser.add_argument("--openai-port", type=int, default=0, help="Puerto del OpenAI falso (necesario con --target)")
+    parser.add_argument("--api-key", help="API key del backend indicado en --target (si usa TENANT_API_KEYS)")
+    parser.add_argument("--duration", type=float, help="Duración en segundos (reemplaza la del escenario)")
+    parser.add_argument("--seed", type=int, help="Semilla (reemplaza la del escenario)")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="Resultados JSON previos del mismo escenario para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Empeoramiento relativo tolerado")
+    parser.add_argument("--error-rate-tolerance", type=float, default=0.02,
+                        help="Aumento absoluto tolerado de las tasas de error")
+    parser.add_argument("--log-level", default="WARNING")
+    # Modo interno: el subproceso que corre el backend
+    parser.add_argument("--serve-backend", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--openai-url", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+    if args.serve_backend:
+        serve_backend(args.port, args.openai_url)
+        return 0
+    if args.target and not args.openai_port:
+        logger.error("Con --target hay que fijar --openai-port (el backend debe apuntar a ese OpenAI falso)")
+        return 2
+
+    results = run(load_scenario(args.scenario), target=args.target, openai_port=args.openai_port,
+                  duration_s=args.duration, seed=args.seed, api_key=args.api_key)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("scenario", {}).get("name") != results["meta"]["scenario"].get("name"):
+            logger.warning("La referencia es de otro escenario: la comparación puede no tener sentido")
+        results["regressions"] = compare_load(results["metrics"], baseline.get("metrics", {}),
+                                              args.threshold, args.error_rate_tolerance)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if results.get("regressions"):
+        for r in results["regressions"]:
+            logger.error(f"Regresión en {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_pct']}%)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
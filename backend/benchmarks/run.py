@@ -0,0 +1,464 @@
+"""
+Benchmark offline de ingesta y búsqueda.
+
+Ejemplo:
+    python -m benchmarks.run --docs 3 --pages 20 --words-per-page 400 \\
+        --output results.json --baseline previous.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from benchmarks.environment import prepare_backend
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic_pdf import VOCABULARY, generate_corpus
+
+logger = logging.getLogger("benchmarks")
+
+# Dirección de mejora de cada métrica, usada para detectar regresiones
+METRIC_DIRECTIONS = {
+    "import_s": "lower",
+    "startup_s": "lower",
+    "first_request_s": "lower",
+    "extraction_pages_per_s": "higher",
+    "chunking_mb_per_s": "higher",
+    "embedding_batches_per_s": "higher",
+    "query_embedding_p50_ms": "lower",
+    "query_embedding_p95_ms": "lower",
+    "ingest_total_s": "lower",
+    "ingest_mean_doc_s": "lower",
+    "batch_ingest_total_s": "lower",
+    "chat_p50_ms": "lower",
+    "chat_p95_ms": "lower",
+    "chat_p99_ms": "lower",
+    "batch_qa_total_s": "lower",
+    "followup_session_p50_ms": "lower",
+    "followup_session_cached_ratio": "higher",
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil q (0-100) con interpolación lineal."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(k), math.ceil(k)
+    if lower == upper:
+        return ordered[int(k)]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+# --- Etapas ---
+def bench_import(openai_url: str, repeats: int = 3) -> Dict[str, Any]:
+    """Tiempo de importar ``main`` en un intérprete nuevo (mejor de ``repeats`` corridas)."""
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import time; s = time.perf_counter(); import main; print(time.perf_counter() - s)"
+    env = dict(os.environ, OPENAI_API_KEY="benchmark", OPENAI_BASE_URL=openai_url)
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, "-c", code], cwd=backend_dir, env=env,
+            stderr=subprocess.DEVNULL, text=True
+        )
+        timings.append(float(output.strip().splitlines()[-1]))
+    return {"import_s": round(min(timings), 4)}
+
+
+def bench_first_request(client, start: float) -> Dict[str, Any]:
+    """
+    Mide el arranque (lifespan con warmup) y el tiempo hasta la primera respuesta exitosa.
+
+    Args:
+        client: TestClient recién iniciado
+        start: Instante (perf_counter) previo a iniciar el cliente
+    """
+    startup = time.perf_counter() - start
+    while client.get("/ready").status_code != 200:
+        if time.perf_counter() - start > 30:
+            raise RuntimeError("El backend no quedó listo en 30s")
+        time.sleep(0.05)
+    response = client.post("/chat", json={"message": "hola"})
+    if response.status_code != 200:
+        raise RuntimeError(f"Primera petición falló: {response.status_code} {response.text}")
+    return {
+        "startup_s": round(startup, 4),
+        "first_request_s": round(time.perf_counter() - start, 4),
+    }
+
+
+def bench_extraction(paths: List[str]) -> Dict[str, Any]:
+    from pdf_utils import extract_text_from_pdf
+
+    pages = []
+    start = time.perf_counter()
+    for path in paths:
+        pages.extend(extract_text_from_pdf(path))
+    elapsed = time.perf_counter() - start
+    return {
+        "pages": pages,
+        "metrics": {
+            "extraction_pages": len(pages),
+            "extraction_s": round(elapsed, 4),
+            "extraction_pages_per_s": round(len(pages) / elapsed, 2) if elapsed else 0.0,
+        },
+    }
+
+
+def bench_chunking(pages: List[Dict[str, Any]], iterations: int) -> Dict[str, Any]:
+    from pdf_utils import chunk_text
+
+    texts = [p["text"] for p in pages]
+    total_bytes = sum(len(t.encode("utf-8")) for t in texts) * iterations
+    chunks: List[str] = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        chunks = [c for t in texts for c in chunk_text(t)]
+    elapsed = time.perf_counter() - start
+    mb = total_bytes / 1024 / 1024
+    return {
+        "chunks": chunks,
+        "metrics": {
+            "chunking_chunks": len(chunks),
+            "chunking_mb": round(mb, 3),
+            "chunking_mb_per_s": round(mb / elapsed, 2) if elapsed else 0.0,
+        },
+    }
+
+
+def bench_embeddings(vector_utils, texts: List[str]) -> Dict[str, Any]:
+    vector_utils.clear_cache()
+    batch_size = vector_utils.EMBEDDING_BATCH_SIZE
+    start = time.perf_counter()
+    vector_utils.get_embeddings_batch(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    batches = math.ceil(len(set(texts)) / batch_size)
+    return {
+        "embedding_texts": len(texts),
+        "embedding_batches": batches,
+        "embedding_s": round(elapsed, 4),
+        "embedding_batches_per_s": round(batches / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def bench_query_embedding(vector_utils, queries: int, seed: int = 0) -> Dict[str, Any]:
+    """Latencia de embeber una consulta suelta, sin cache (el camino de /chat)."""
+    rng = random.Random(seed + 3)
+    latencies = []
+    for _ in range(queries):
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(8)) + "?"
+        start = time.perf_counter()
+        vector_utils.get_embedding(text, use_cache=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "query_embedding_provider": vector_utils.get_embedding_provider().model,
+        "query_embedding_p50_ms": round(percentile(latencies, 50), 2),
+        "query_embedding_p95_ms": round(percentile(latencies, 95), 2),
+    }
+
+
+def bench_ingest(client, vector_utils, paths: List[str]) -> Dict[str, Any]:
+    vector_utils.clear_cache()
+    durations = []
+    for path in paths:
+        with open(path, "rb") as f:
+            start = time.perf_counter()
+            response = client.post(
+                "/ingest", files={"file": (os.path.basename(path), f, "application/pdf")}
+            )
+            durations.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"Ingesta falló para {path}: {response.status_code} {response.text}")
+    return {
+        "ingest_docs": len(paths),
+        "ingest_total_s": round(sum(durations), 4),
+        "ingest_mean_doc_s": round(sum(durations) / len(durations), 4) if durations else 0.0,
+    }
+
+
+def bench_batch_ingest(client, vector_utils, paths: List[str]) -> Dict[str, Any]:
+    vector_utils.clear_cache()
+    handles = [open(path, "rb") for path in paths]
+    try:
+        files = [
+            ("files", (f"batch_{os.path.basename(path)}", handle, "application/pdf"))
+            for path, handle in zip(paths, handles)
+        ]
+        start = time.perf_counter()
+        response = client.post("/ingest/batch", files=files)
+        elapsed = time.perf_counter() - start
+    finally:
+        for handle in handles:
+            handle.close()
+    if response.status_code != 200 or response.json().get("failed"):
+        raise RuntimeError(f"Ingesta por lote falló: {response.status_code} {response.text}")
+    return {
+        "batch_ingest_docs": len(paths),
+        "batch_ingest_total_s": round(elapsed, 4),
+    }
+
+
+def bench_chat(client, doc_names: List[str], requests: int, concurrency: int,
+               seed: int = 0) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    bodies = []
+    for i in range(requests):
+        message = " ".join(rng.choice(VOCABULARY) for _ in range(8)) + "?"
+        body = {"message": message}
+        if doc_names and i % 2:
+            body["pdf_name"] = rng.choice(doc_names)
+        bodies.append(body)
+
+    def send(body):
+        start = time.perf_counter()
+        response = client.post("/chat", json=body)
+        return (time.perf_counter() - start) * 1000, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, bodies))
+    wall = time.perf_counter() - start
+
+    latencies = [ms for ms, _ in results]
+    errors = sum(1 for _, code in results if code != 200)
+    return {
+        "chat_requests": requests,
+        "chat_concurrency": concurrency,
+        "chat_errors": errors,
+        "chat_throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        "chat_p50_ms": round(percentile(latencies, 50), 2),
+        "chat_p95_ms": round(percentile(latencies, 95), 2),
+        "chat_p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def bench_batch_qa(client, questions: int, seed: int = 0) -> Dict[str, Any]:
+    """Tiempo total de /chat/batch y de la respuesta más lenta que entrega."""
+    rng = random.Random(seed + 2)
+    body = {"questions": [" ".join(rng.choice(VOCABULARY) for _ in range(8)) + "?" for _ in range(questions)]}
+    start = time.perf_counter()
+    response = client.post("/chat/batch", json=body)
+    elapsed = time.perf_counter() - start
+    answered = len(response.text.splitlines()) if response.status_code == 200 else 0
+    return {
+        "batch_qa_questions": questions,
+        "batch_qa_errors": questions - answered,
+        "batch_qa_total_s": round(elapsed, 4),
+    }
+
+
+def bench_session(client, fake, doc_names: List[str], conversations: int, turns: int,
+                  seed: int = 0) -> Dict[str, Any]:
+    """
+    Conversaciones de varios turnos sobre el mismo tema, con y sin sesión.
+
+    Mide la latencia de los turnos de seguimiento y la fracción de tokens del
+    prompt que el servidor falso reporta como cacheados (prefijo repetido).
+    """
+    rng = random.Random(seed + 1)
+    scripts = []
+    for i in range(conversations):
+        topic = [rng.choice(VOCABULARY) for _ in range(8)]
+        pdf_name = rng.choice(doc_names) if doc_names and i % 2 else None
+        questions = [" ".join(topic + [rng.choice(VOCABULARY)]) + "?" for _ in range(turns)]
+        scripts.append((pdf_name, questions))
+
+    def converse(use_session: bool):
+        latencies = []
+        tokens_before = fake.stats["prompt_tokens"], fake.stats["cached_tokens"]
+        for pdf_name, questions in scripts:
+            session_id = None
+            for turn, message in enumerate(questions):
+                body = {"message": message, "pdf_name": pdf_name, "session_id": session_id}
+                start = time.perf_counter()
+                response = client.post("/chat", json=body)
+                elapsed = (time.perf_counter() - start) * 1000
+                if use_session:
+                    session_id = response.json().get("session_id")
+                if turn:
+                    latencies.append(elapsed)
+        prompt = fake.stats["prompt_tokens"] - tokens_before[0]
+        cached = fake.stats["cached_tokens"] - tokens_before[1]
+        return latencies, (cached / prompt if prompt else 0.0)
+
+    stateless, stateless_cached = converse(use_session=False)
+    session, session_cached = converse(use_session=True)
+    return {
+        "followup_stateless_p50_ms": round(percentile(stateless, 50), 2),
+        "followup_session_p50_ms": round(percentile(session, 50), 2),
+        "followup_stateless_cached_ratio": round(stateless_cached, 3),
+        "followup_session_cached_ratio": round(session_cached, 3),
+    }
+
+
+# --- Comparación ---
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any],
+                    threshold: float, directions: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    """
+    Compara métricas contra una ejecución anterior.
+
+    Args:
+        current: Métricas de la ejecución actual
+        baseline: Métricas de la ejecución de referencia
+        threshold: Empeoramiento relativo tolerado (0.1 = 10%)
+        directions: Dirección de mejora de cada métrica (por defecto METRIC_DIRECTIONS)
+
+    Returns:
+        Lista de regresiones detectadas
+    """
+    regressions = []
+    for name, direction in (directions or METRIC_DIRECTIONS).items():
+        old, new = baseline.get(name), current.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change < -threshold if direction == "higher" else change > threshold
+        if worse:
+            regressions.append({
+                "metric": name,
+                "baseline": old,
+                "current": new,
+                "change_pct": round(change * 100, 1),
+            })
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "desconocido"
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with FakeOpenAIServer(
+        dimensions=args.vector_size,
+        embedding_latency_ms=args.embedding_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+    ) as fake:
+        main, vector_utils = prepare_backend(
+            fake.url, MAX_PDFS=str(args.docs * 2 + 1), VECTOR_SIZE=str(args.vector_size),
+            EMBEDDING_PROVIDER=args.embedding_provider
+        )
+        logging.getLogger().setLevel(args.log_level)
+
+        from fastapi.testclient import TestClient
+
+        metrics: Dict[str, Any] = {}
+        logger.warning("Midiendo tiempo de importación...")
+        metrics.update(bench_import(fake.url))
+        with tempfile.TemporaryDirectory() as workdir:
+            paths = generate_corpus(workdir, args.docs, args.pages, args.words_per_page, seed=args.seed)
+
+            logger.warning("Midiendo extracción...")
+            extraction = bench_extraction(paths)
+            metrics.update(extraction["metrics"])
+
+            logger.warning("Midiendo chunking...")
+            chunking = bench_chunking(extraction["pages"], args.chunk_iterations)
+            metrics.update(chunking["metrics"])
+
+            logger.warning("Midiendo embeddings...")
+            metrics.update(bench_embeddings(vector_utils, chunking["chunks"][:args.embedding_texts]))
+            metrics.update(bench_query_embedding(vector_utils, args.embedding_texts, seed=args.seed))
+
+            logger.warning("Midiendo arranque y primera petición...")
+            start = time.perf_counter()
+            with TestClient(main.app) as client:
+                metrics.update(bench_first_request(client, start))
+
+                logger.warning("Midiendo ingesta end-to-end...")
+                metrics.update(bench_ingest(client, vector_utils, paths))
+
+                logger.warning("Midiendo ingesta por lote...")
+                metrics.update(bench_batch_ingest(client, vector_utils, paths))
+
+                logger.warning("Midiendo latencia de /chat...")
+                doc_names = [os.path.basename(p) for p in paths]
+                metrics.update(bench_chat(client, doc_names, args.chat_requests,
+                                          args.chat_concurrency, seed=args.seed))
+
+                logger.warning("Midiendo preguntas por lote...")
+                metrics.update(bench_batch_qa(client, args.batch_questions, seed=args.seed))
+
+                logger.warning("Midiendo conversaciones con sesión...")
+                metrics.update(bench_session(client, fake, doc_names, args.conversations,
+                                             args.turns, seed=args.seed))
+
+        metrics["fake_openai_calls"] = dict(fake.stats)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "params": vars(args),
+        },
+        "metrics": metrics,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark offline de ingesta y búsqueda")
+    parser.add_argument("--docs", type=int, default=3, help="Número de PDFs sintéticos")
+    parser.add_argument("--pages", type=int, default=10, help="Páginas por PDF")
+    parser.add_argument("--words-per-page", type=int, default=300, help="Densidad de texto por página")
+    parser.add_argument("--chunk-iterations", type=int, default=5, help="Repeticiones del benchmark de chunking")
+    parser.add_argument("--embedding-texts", type=int, default=50, help="Textos para el benchmark de embeddings")
+    parser.add_argument("--chat-requests", type=int, default=50, help="Número de peticiones a /chat")
+    parser.add_argument("--chat-concurrency", type=int, default=4, help="Peticiones /chat concurrentes")
+    parser.add_argument("--batch-questions", type=int, default=50, help="Preguntas enviadas a /chat/batch")
+    parser.add_argument("--conversations", type=int, default=5, help="Conversaciones multi-turno")
+    parser.add_argument("--turns", type=int, default=4, help="Turnos por conversación")
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0, help="Latencia simulada de embeddings")
+    parser.add_argument("--chat-latency-ms", type=float, default=100.0, help="Latencia simulada de chat")
+    parser.add_argument("--vector-size", type=int, default=3072, help="Dimensión de los embeddings")
+    parser.add_argument("--embedding-provider", choices=["openai", "hashing", "local"], default="openai",
+                        help="Proveedor de embeddings (con local, --vector-size debe ser la del modelo)")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla para datos reproducibles")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="Resultados JSON previos para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Empeoramiento relativo tolerado")
+    parser.add_argument("--log-level", default="WARNING", help="Nivel de logging del backend")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    results = run(args)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results["metrics"], baseline.get("metrics", {}), args.threshold)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if results.get("regressions"):
+        for r in results["regressions"]:
+            logger.error(f"Regresión en {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_pct']}%)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
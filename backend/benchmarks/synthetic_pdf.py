@@ -0,0 +1,139 @@
+import os
+import random
+from typing import List
+
+# Vocabulario base para generar texto con apariencia de documento
+VOCABULARY = [
+    "contrato", "cliente", "proveedor", "servicio", "pago", "plazo", "factura",
+    "informe", "análisis", "resultado", "proyecto", "equipo", "riesgo", "costo",
+    "presupuesto", "calidad", "entrega", "objetivo", "estrategia", "mercado",
+    "producto", "ventas", "operación", "gestión", "sistema", "datos", "modelo",
+    "documento", "política", "seguridad", "auditoría", "cumplimiento", "norma",
+    "empresa", "gerencia", "recurso", "capacidad", "proceso", "indicador",
+    "trimestre", "anual", "revisión", "acuerdo", "cláusula", "garantía",
+    "la", "el", "de", "en", "para", "con", "por", "los", "las", "una", "que",
+]
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+WORDS_PER_LINE = 12
+
+
+def generate_page_text(rng: random.Random, words_per_page: int) -> List[str]:
+    """
+    Genera las líneas de texto de una página.
+
+    Args:
+        rng: Generador aleatorio (para resultados reproducibles)
+        words_per_page: Densidad de texto de la página
+
+    Returns:
+        Lista de líneas de texto
+    """
+    words = [rng.choice(VOCABULARY) for _ in range(words_per_page)]
+    return [
+        " ".join(words[i:i + WORDS_PER_LINE])
+        for i in range(0, len(words), WORDS_PER_LINE)
+    ]
+
+
+def _escape(text: str) -> str:
+    """Escapa caracteres especiales de un string literal PDF."""
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages: List[List[str]], title: str = "Benchmark", author: str = "benchmarks") -> bytes:
+    """
+    Construye un PDF mínimo (Helvetica, una columna) con las líneas dadas.
+
+    Args:
+        pages: Lista de páginas, cada una con sus líneas de texto
+        title: Título a guardar en los metadatos
+        author: Autor a guardar en los metadatos
+
+    Returns:
+        Contenido binario del PDF
+    """
+    objects: List[bytes] = []
+
+    # 1: catálogo, 2: árbol de páginas, 3: fuente, 4: metadatos
+    num_pages = len(pages)
+    page_ids = [5 + 2 * i for i in range(num_pages)]
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    objects.append(f"<< /Title ({_escape(title)}) /Author ({_escape(author)}) >>".encode("latin-1"))
+
+    for i, lines in enumerate(pages):
+        content_id = page_ids[i] + 1
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        ops = [f"BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL 40 {PAGE_HEIGHT - 40} Td"]
+        for line in lines:
+            ops.append(f"({_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", errors="replace")
+        objects.append(
+            f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream"
+        )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info 4 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode()
+    return bytes(out)
+
+
+def generate_pdf_file(path: str, num_pages: int, words_per_page: int, seed: int = 0) -> str:
+    """
+    Genera un PDF sintético en disco.
+
+    Args:
+        path: Ruta de destino (debe terminar en .pdf)
+        num_pages: Número de páginas
+        words_per_page: Palabras por página (densidad de texto)
+        seed: Semilla para resultados reproducibles
+
+    Returns:
+        Ruta del archivo generado
+    """
+    rng = random.Random(seed)
+    pages = [generate_page_text(rng, words_per_page) for _ in range(num_pages)]
+    title = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "wb") as f:
+        f.write(build_pdf(pages, title=title))
+    return path
+
+
+def generate_corpus(directory: str, num_docs: int, num_pages: int,
+                    words_per_page: int, seed: int = 0) -> List[str]:
+    """
+    Genera un conjunto de PDFs sintéticos.
+
+    Returns:
+        Lista de rutas de los PDFs generados
+    """
+    os.makedirs(directory, exist_ok=True)
+    return [
+        generate_pdf_file(
+            os.path.join(directory, f"bench_{i + 1:03d}.pdf"),
+            num_pages, words_per_page, seed=seed + i
+        )
+        for i in range(num_docs)
+    ]
@@ -0,0 +1,141 @@
+"""
+Compara REST y gRPC para upserts y búsquedas en Qdrant con nuestro tamaño de vector.
+
+Contra un Qdrant real (p. ej. el de docker-compose):
+    python -m benchmarks.transport --host localhost --points 5000 --output transport.json
+
+Sin Qdrant, midiendo solo el costo de serialización JSON vs protobuf:
+    python -m benchmarks.transport --offline
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import uuid
+from typing import Any, Dict, List
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.conversions.conversion import RestToGrpc
+from qdrant_client.http import models
+
+from benchmarks.run import percentile
+
+logger = logging.getLogger("benchmarks.transport")
+
+
+def make_points(rng: np.random.Generator, count: int, dim: int) -> List[models.PointStruct]:
+    vectors = rng.random((count, dim), dtype=np.float32)
+    return [
+        models.PointStruct(
+            id=str(uuid.uuid4()),
+            vector=vector.tolist(),
+            payload={"doc": f"doc_{i % 10}.pdf", "page": i % 50, "text": "x" * 1000},
+        )
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def bench_serialization(points: List[models.PointStruct], batch_size: int) -> Dict[str, Any]:
+    """Costo de CPU y tamaño en bytes de serializar lotes de upsert en JSON y en protobuf."""
+    batches = [points[i:i + batch_size] for i in range(0, len(points), batch_size)]
+
+    start = time.perf_counter()
+    json_bytes = sum(
+        len(json.dumps({"points": [p.model_dump() for p in batch]}).encode()) for batch in batches
+    )
+    json_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grpc_bytes = sum(
+        sum(len(RestToGrpc.convert_point_struct(p).SerializeToString()) for p in batch)
+        for batch in batches
+    )
+    grpc_s = time.perf_counter() - start
+
+    return {
+        "rest_json_mb": round(json_bytes / 1024 / 1024, 2),
+        "rest_json_ms_per_batch": round(json_s * 1000 / len(batches), 2),
+        "grpc_protobuf_mb": round(grpc_bytes / 1024 / 1024, 2),
+        "grpc_protobuf_ms_per_batch": round(grpc_s * 1000 / len(batches), 2),
+    }
+
+
+def bench_transport(args: argparse.Namespace, prefer_grpc: bool,
+                    points: List[models.PointStruct], queries: np.ndarray) -> Dict[str, Any]:
+    client = QdrantClient(
+        host=args.host, port=args.rest_port, grpc_port=args.grpc_port,
+        prefer_grpc=prefer_grpc, timeout=120,
+    )
+    name = f"bench_transport_{'grpc' if prefer_grpc else 'rest'}_{uuid.uuid4().hex[:8]}"
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=args.vector_size, distance=models.Distance.COSINE),
+    )
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(points), args.batch_size):
+            client.upsert(collection_name=name, points=points[i:i + args.batch_size])
+        upsert_s = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            client.search(collection_name=name, query_vector=query.tolist(),
+                          limit=args.top_k, with_payload=True)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        client.delete_collection(name)
+        client.close()
+
+    return {
+        "upsert_points_per_s": round(len(points) / upsert_s, 1),
+        "search_per_s": round(len(latencies) / (sum(latencies) / 1000), 1),
+        "search_p50_ms": round(percentile(latencies, 50), 2),
+        "search_p95_ms": round(percentile(latencies, 95), 2),
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark REST vs gRPC para Qdrant")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--rest-port", type=int, default=6333)
+    parser.add_argument("--grpc-port", type=int, default=6334)
+    parser.add_argument("--vector-size", type=int, default=3072)
+    parser.add_argument("--points", type=int, default=2000, help="Puntos a insertar")
+    parser.add_argument("--batch-size", type=int, default=256, help="Puntos por upsert")
+    parser.add_argument("--searches", type=int, default=200, help="Búsquedas secuenciales")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--offline", action="store_true", help="Solo medir serialización, sin Qdrant")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    rng = np.random.default_rng(args.seed)
+    points = make_points(rng, args.points, args.vector_size)
+    results: Dict[str, Any] = {
+        "params": vars(args),
+        "serialization": bench_serialization(points, args.batch_size),
+    }
+
+    if not args.offline:
+        queries = rng.random((args.searches, args.vector_size), dtype=np.float32)
+        results["rest"] = bench_transport(args, False, points, queries)
+        results["grpc"] = bench_transport(args, True, points, queries)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", "1800"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))
+# Similitud mínima entre la pregunta y el tema de la sesión para reutilizar el contexto
+SESSION_TOPIC_THRESHOLD = float(os.getenv("SESSION_TOPIC_THRESHOLD", "0.75"))
+
+
+@dataclass
+class ChatSession:
+    """
+    Conversación de un tenant: historial y contexto recuperado.
+
+    ``topic_embedding`` es el embedding de la pregunta que disparó la última
+    recuperación; las preguntas parecidas reutilizan ``context_chunks`` en vez
+    de volver a buscar, y el prompt mantiene el mismo prefijo.
+    """
+    session_id: str
+    tenant: str
+    pdf_name: Optional[str] = None
+    history: List[Dict[str, str]] = field(default_factory=list)
+    context_chunks: List[str] = field(default_factory=list)
+    topic_embedding: Optional[np.ndarray] = None
+    updated_at: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def same_topic(self, embedding: List[float], pdf_name: Optional[str]) -> bool:
+        if not self.context_chunks or self.topic_embedding is None or pdf_name != self.pdf_name:
+            return False
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape != self.topic_embedding.shape:
+            return False  # El modelo de embeddings cambió (migración) desde la última búsqueda
+        norm = np.linalg.norm(query) * np.linalg.norm(self.topic_embedding)
+        if not norm:
+            return False
+        return float(query @ self.topic_embedding) / norm >= SESSION_TOPIC_THRESHOLD
+
+    def set_context(self, chunks: List[str], embedding: List[float], pdf_name: Optional[str]):
+        with self.lock:
+            self.context_chunks = list(chunks)
+            self.topic_embedding = np.asarray(embedding, dtype=np.float32)
+            self.pdf_name = pdf_name
+
+    def recent_history(self) -> List[Dict[str, str]]:
+        with self.lock:
+            return list(self.history)
+
+    def add_turn(self, question: str, answer: str):
+        with self.lock:
+            self.history.append({"role": "user", "content": question})
+            self.history.append({"role": "assistant", "content": answer})
+            # Se recorta desde el inicio: el prefijo (sistema + contexto) no cambia
+            excess = len(self.history) - SESSION_MAX_TURNS * 2
+            if excess > 0:
+                del self.history[:excess]
+
+
+class SessionStore:
+    """
+    Sesiones en memoria con expiración por inactividad y límite LRU.
+
+    Las sesiones son del proceso: con varios workers de uvicorn o varias
+    réplicas, un ``session_id`` solo se encuentra en el proceso que lo creó
+    (el resto responde 404), así que hace falta un único proceso o afinidad
+    de sesión en el balanceador.
+
+    Args:
+        ttl_s: Segundos de inactividad antes de expirar una sesión
+        max_sessions: Máximo de sesiones; se descartan las menos recientes
+    """
+
+    def __init__(self, ttl_s: int = SESSION_TTL_S, max_sessions: int = MAX_SESSIONS):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+
+    def _expire(self, now: float):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.updated_at <= self.ttl_s and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self, tenant: str, pdf_name: Optional[str] = None) -> ChatSession:
+        session = ChatSession(session_id=secrets.token_urlsafe(16), tenant=tenant, pdf_name=pdf_name)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._expire(session.updated_at)
+        return session
+
+    def get(self, session_id: str, tenant: str) -> Optional[ChatSession]:
+        """Devuelve la sesión si existe, no expiró y pertenece al tenant."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None or session.tenant != tenant:
+                return None
+            session.updated_at = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str, tenant: str) -> bool:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.tenant != tenant:
+                return False
+            del self._sessions[session_id]
+            return True
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,527 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", "data/chunks.db")
+
+# SQLite limita la cantidad de parámetros por consulta
+_MAX_PARAMS = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    tenant TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    author TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (tenant, doc)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS chunks (
+    id BLOB PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    char_count INTEGER NOT NULL,
+    pages TEXT NOT NULL DEFAULT ''
+);
+
+CREATE INDEX IF NOT EXISTS chunks_by_doc ON chunks (tenant, doc, page);
+
+CREATE TABLE IF NOT EXISTS embedding_indexes (
+    name TEXT NOT NULL,
+    role TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    model TEXT NOT NULL,
+    vector_size INTEGER NOT NULL,
+    PRIMARY KEY (name, role)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS document_stats (
+    tenant TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    ingest_s REAL NOT NULL DEFAULT 0,
+    queries INTEGER NOT NULL DEFAULT 0,
+    last_accessed_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (tenant, doc)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS tenant_stats (
+    tenant TEXT PRIMARY KEY,
+    documents INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    ingest_s REAL NOT NULL DEFAULT 0,
+    queries INTEGER NOT NULL DEFAULT 0,
+    last_query_at TEXT NOT NULL DEFAULT ''
+) WITHOUT ROWID;
+"""
+
+# Contadores de documento que se suman a los del tenant (document_stats -> tenant_stats)
+_ADDITIVE_STATS = ("chunks", "characters", "pages", "bytes", "ingest_s")
+_DOCUMENT_STATS = _ADDITIVE_STATS + ("queries", "last_accessed_at")
+_TENANT_STATS = ("documents",) + _ADDITIVE_STATS + ("queries", "last_query_at")
+
+
+def _stats_row(keys: Tuple[str, ...], row: Tuple[Any, ...]) -> Dict[str, Any]:
+    stats = dict(zip(keys, row))
+    if "ingest_s" in stats:
+        stats["ingest_s"] = round(stats["ingest_s"], 3)
+    return stats
+
+
+def _id_bytes(point_id: Any) -> bytes:
+    """Los ids de Qdrant son UUIDs: se guardan como 16 bytes en vez de 36 caracteres."""
+    return uuid.UUID(str(point_id)).bytes
+
+
+def _pages_text(page: int, pages: Optional[List[int]]) -> str:
+    """Páginas de un chunk deduplicado ("3,7,12"); vacío si el chunk es de una sola página."""
+    if not pages or list(pages) == [page]:
+        return ""
+    return ",".join(str(p) for p in pages)
+
+
+def _pages_list(page: int, pages: str) -> List[int]:
+    return [int(p) for p in pages.split(",")] if pages else [page]
+
+
+def _chunked(items: List[Any], size: int = _MAX_PARAMS) -> Iterator[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ChunkStore:
+    """
+    Almacén local del texto de los chunks y de los metadatos de cada documento.
+
+    Qdrant guarda solo los vectores y los campos de filtrado (tenant, doc);
+    el texto se busca aquí por id de punto, en una sola consulta para los
+    resultados finales de cada búsqueda.
+
+    Args:
+        path: Archivo SQLite (se crea si no existe)
+    """
+
+    def __init__(self, path: str = CHUNK_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            had_stats = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_stats'"
+            ).fetchone() is not None
+            conn.executescript(SCHEMA)
+            columns = {name for _, name, *_ in conn.execute("PRAGMA table_info(chunks)")}
+            if "pages" not in columns:
+                # Almacenes creados antes de la deduplicación de chunks
+                conn.execute("ALTER TABLE chunks ADD COLUMN pages TEXT NOT NULL DEFAULT ''")
+        if not had_stats:
+            # Almacenes creados antes de las estadísticas: calcularlas una vez desde los chunks
+            keys = list(self._connect().execute("SELECT tenant, doc FROM documents"))
+            if keys:
+                self.refresh_document_stats(keys)
+                logger.info(f"Estadísticas calculadas para {len(keys)} documentos existentes")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por thread: sqlite3 no permite compartirlas entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Escritura ---
+    def put_documents(self, documents: Iterable[Tuple[str, str, str, str, str]]):
+        """Registra documentos como tuplas (tenant, doc, title, author, created_at)."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents (tenant, doc, title, author, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                documents
+            )
+
+    def put_chunks(self, chunks: Iterable[Tuple[Any, ...]]):
+        """
+        Guarda chunks como tuplas (point_id, tenant, doc, page, text[, pages]).
+
+        ``pages`` lista todas las páginas que representa un chunk deduplicado.
+        """
+        rows = [
+            (_id_bytes(point_id), tenant, doc, page, text, len(text), _pages_text(page, rest[0] if rest else None))
+            for point_id, tenant, doc, page, text, *rest in chunks
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, tenant, doc, page, text, char_count, pages) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def delete_document(self, tenant: str, doc: str) -> int:
+        """Elimina un documento, sus chunks y sus estadísticas. Devuelve la cantidad de chunks eliminados."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = conn.execute(
+                "DELETE FROM chunks WHERE tenant = ? AND doc = ?", (tenant, doc)
+            ).rowcount
+            conn.execute("DELETE FROM documents WHERE tenant = ? AND doc = ?", (tenant, doc))
+            self._set_document_stats(conn, tenant, doc, None)
+        return deleted
+
+    # --- Estadísticas ---
+    def _set_document_stats(self, conn: sqlite3.Connection, tenant: str, doc: str,
+                            stats: Optional[Dict[str, Any]]):
+        """
+        Reemplaza los contadores de un documento (None lo quita) y aplica la diferencia al tenant.
+
+        Se llama dentro de una transacción abierta con BEGIN IMMEDIATE, así
+        los totales del tenant siempre coinciden con la suma de sus documentos.
+        """
+        columns = ", ".join(_ADDITIVE_STATS)
+        old = conn.execute(
+            f"SELECT {columns} FROM document_stats WHERE tenant = ? AND doc = ?", (tenant, doc)
+        ).fetchone()
+        if old is None and stats is None:
+            return
+        old_values = dict(zip(_ADDITIVE_STATS, old)) if old else dict.fromkeys(_ADDITIVE_STATS, 0)
+        new_values = {key: stats.get(key, old_values[key]) for key in _ADDITIVE_STATS} if stats else \
+            dict.fromkeys(_ADDITIVE_STATS, 0)
+
+        if stats is None:
+            conn.execute("DELETE FROM document_stats WHERE tenant = ? AND doc = ?", (tenant, doc))
+        else:
+            conn.execute(
+                f"INSERT INTO document_stats (tenant, doc, {columns}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT (tenant, doc) DO UPDATE SET "
+                + ", ".join(f"{key} = excluded.{key}" for key in _ADDITIVE_STATS),
+                (tenant, doc, *(new_values[key] for key in _ADDITIVE_STATS))
+            )
+        documents = (old is None) - (stats is None)
+        conn.execute("INSERT OR IGNORE INTO tenant_stats (tenant) VALUES (?)", (tenant,))
+        conn.execute(
+            "UPDATE tenant_stats SET documents = documents + ?, "
+            + ", ".join(f"{key} = {key} + ?" for key in _ADDITIVE_STATS)
+            + " WHERE tenant = ?",
+            (documents, *(new_values[key] - old_values[key] for key in _ADDITIVE_STATS), tenant)
+        )
+
+    def refresh_document_stats(self, keys: Iterable[Tuple[str, str]],
+                               bytes_: Optional[Dict[Tuple[str, str], int]] = None,
+                               ingest_s: Optional[Dict[Tuple[str, str], float]] = None):
+        """
+        Recalcula chunks, caracteres y páginas de los documentos pedidos al terminar de escribirlos.
+
+        Es una consulta por documento sobre su índice, al escribir: las lecturas
+        de estadísticas no recorren chunks.
+
+        Args:
+            keys: Documentos como tuplas (tenant, doc)
+            bytes_: Tamaño del PDF original por documento (si se conoce)
+            ingest_s: Duración de la ingesta por documento (si se conoce)
+        """
+        conn = self._connect()
+        for tenant, doc in keys:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute(
+                    "SELECT 1 FROM documents WHERE tenant = ? AND doc = ?", (tenant, doc)
+                ).fetchone() is None:
+                    self._set_document_stats(conn, tenant, doc, None)
+                    continue
+                chunks = characters = 0
+                pages = set()
+                for page, extra, char_count in conn.execute(
+                    "SELECT page, pages, char_count FROM chunks WHERE tenant = ? AND doc = ?", (tenant, doc)
+                ):
+                    chunks += 1
+                    characters += char_count
+                    pages.update(_pages_list(page, extra))
+                stats = {"chunks": chunks, "characters": characters, "pages": len(pages)}
+                if bytes_ and (tenant, doc) in bytes_:
+                    stats["bytes"] = bytes_[(tenant, doc)]
+                if ingest_s and (tenant, doc) in ingest_s:
+                    stats["ingest_s"] = ingest_s[(tenant, doc)]
+                self._set_document_stats(conn, tenant, doc, stats)
+
+    def record_ingest(self, tenant: str, doc: str, bytes_: int, ingest_s: float):
+        """Guarda el tamaño del PDF y la duración de su ingesta (después de refresh_document_stats)."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute(
+                "SELECT 1 FROM document_stats WHERE tenant = ? AND doc = ?", (tenant, doc)
+            ).fetchone() is not None:
+                self._set_document_stats(conn, tenant, doc, {"bytes": bytes_, "ingest_s": ingest_s})
+
+    def record_queries(self, tenants: Dict[str, Tuple[int, str]],
+                       documents: Dict[Tuple[str, str], Tuple[int, str]]):
+        """
+        Suma consultas acumuladas en memoria, en una transacción.
+
+        Args:
+            tenants: {tenant: (búsquedas, fecha de la última)}
+            documents: {(tenant, doc): (búsquedas que lo devolvieron, fecha de la última)}
+        """
+        with self._connect() as conn:
+            for tenant, (count, at) in tenants.items():
+                conn.execute("INSERT OR IGNORE INTO tenant_stats (tenant) VALUES (?)", (tenant,))
+                conn.execute(
+                    "UPDATE tenant_stats SET queries = queries + ?, last_query_at = MAX(last_query_at, ?) "
+                    "WHERE tenant = ?",
+                    (count, at, tenant)
+                )
+            # Solo documentos que siguen existiendo: UPDATE sin INSERT
+            conn.executemany(
+                "UPDATE document_stats SET queries = queries + ?, last_accessed_at = MAX(last_accessed_at, ?) "
+                "WHERE tenant = ? AND doc = ?",
+                [(count, at, tenant, doc) for (tenant, doc), (count, at) in documents.items()]
+            )
+
+    def tenant_stats(self, tenant: str) -> Dict[str, Any]:
+        """Totales de un tenant (una fila, sin recorrer documentos)."""
+        row = self._connect().execute(
+            f"SELECT {', '.join(_TENANT_STATS)} FROM tenant_stats WHERE tenant = ?", (tenant,)
+        ).fetchone()
+        if row is None:
+            return {key: "" if key == "last_query_at" else 0 for key in _TENANT_STATS}
+        return _stats_row(_TENANT_STATS, row)
+
+    def global_stats(self) -> Dict[str, Any]:
+        """Totales de todos los tenants (una fila por tenant)."""
+        columns = ("documents",) + _ADDITIVE_STATS + ("queries",)
+        row = self._connect().execute(
+            f"SELECT COUNT(*), {', '.join(f'COALESCE(SUM({key}), 0)' for key in columns)}, "
+            "COALESCE(MAX(last_query_at), '') FROM tenant_stats"
+        ).fetchone()
+        return _stats_row(("tenants",) + columns + ("last_query_at",), row)
+
+    def document_stats(self, tenant: str, doc: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Contadores por documento de un tenant (o de uno de sus documentos)."""
+        query = f"SELECT doc, {', '.join(_DOCUMENT_STATS)} FROM document_stats WHERE tenant = ?"
+        params: Tuple[Any, ...] = (tenant,)
+        if doc is not None:
+            query += " AND doc = ?"
+            params += (doc,)
+        return [
+            _stats_row(("name",) + _DOCUMENT_STATS, row)
+            for row in self._connect().execute(query + " ORDER BY doc", params)
+        ]
+
+    # --- Índices de embeddings ---
+    def get_indexes(self, name: str) -> Dict[str, Tuple[str, str, int]]:
+        """Índices registrados de una colección lógica: {rol: (colección, modelo, tamaño)}."""
+        return {
+            role: (collection, model, vector_size)
+            for role, collection, model, vector_size in self._connect().execute(
+                "SELECT role, collection, model, vector_size FROM embedding_indexes WHERE name = ?", (name,)
+            )
+        }
+
+    def set_index(self, name: str, role: str, collection: str, model: str, vector_size: int):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO embedding_indexes (name, role, collection, model, vector_size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (name, role, collection, model, vector_size)
+            )
+
+    def delete_index(self, name: str, role: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM embedding_indexes WHERE name = ? AND role = ?", (name, role))
+
+    def promote_shadow(self, name: str):
+        """El índice sombra pasa a ser el activo, en una sola transacción."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM embedding_indexes WHERE name = ? AND role = 'active'", (name,))
+            conn.execute(
+                "UPDATE embedding_indexes SET role = 'active' WHERE name = ? AND role = 'shadow'", (name,)
+            )
+
+    def get_migration(self, name: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT state FROM migrations WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_migration(self, name: str,
+                         update: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]
+                         ) -> Optional[Dict[str, Any]]:
+        """
+        Lee y reescribe el estado de una migración en una transacción exclusiva.
+
+        ``update`` recibe el estado actual (o None) y devuelve el nuevo, o None
+        para no escribir nada; así dos procesos no pisan sus cambios.
+
+        Returns:
+            El estado escrito, o None si no se escribió
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT state FROM migrations WHERE name = ?", (name,)).fetchone()
+            state = update(json.loads(row[0]) if row else None)
+            if state is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO migrations (name, state) VALUES (?, ?)", (name, json.dumps(state))
+                )
+        return state
+
+    # --- Lectura ---
+    def get_texts(self, point_ids: List[Any]) -> Dict[str, str]:
+        """
+        Textos de los chunks pedidos, en una consulta por cada 900 ids.
+
+        Returns:
+            Diccionario {id de punto (str): texto}; los ids desconocidos se omiten
+        """
+        keys = {_id_bytes(point_id): str(point_id) for point_id in point_ids}
+        texts = {}
+        conn = self._connect()
+        for batch in _chunked(list(keys)):
+            placeholders = ",".join("?" * len(batch))
+            for key, text in conn.execute(
+                f"SELECT id, text FROM chunks WHERE id IN ({placeholders})", batch
+            ):
+                texts[keys[key]] = text
+        return texts
+
+    def get_chunks(self, point_ids: List[Any]) -> Dict[str, Tuple[str, str, int, str, List[int]]]:
+        """
+        Filas completas de los chunks pedidos, en una consulta por cada 900 ids.
+
+        Returns:
+            Diccionario {id de punto (str): (tenant, doc, page, text, pages)}
+        """
+        keys = {_id_bytes(point_id): str(point_id) for point_id in point_ids}
+        rows = {}
+        conn = self._connect()
+        for batch in _chunked(list(keys)):
+            placeholders = ",".join("?" * len(batch))
+            for key, tenant, doc, page, text, pages in conn.execute(
+                f"SELECT id, tenant, doc, page, text, pages FROM chunks WHERE id IN ({placeholders})", batch
+            ):
+                rows[keys[key]] = (tenant, doc, page, text, _pages_list(page, pages))
+        return rows
+
+    def document_rows(self, keys: Iterable[Tuple[str, str]]) -> List[Tuple[str, str, str, str, str]]:
+        """Filas (tenant, doc, title, author, created_at) de los documentos pedidos."""
+        conn = self._connect()
+        rows = []
+        for tenant, doc in keys:
+            row = conn.execute(
+                "SELECT tenant, doc, title, author, created_at FROM documents WHERE tenant = ? AND doc = ?",
+                (tenant, doc)
+            ).fetchone()
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def count_chunks(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def chunks_after(self, rowid: int, limit: int) -> List[Tuple[int, str, str, str, str]]:
+        """
+        Siguiente página de chunks en orden de inserción, para recorrer todo el almacén.
+
+        Returns:
+            Tuplas (rowid, id de punto, tenant, doc, text)
+        """
+        return [
+            (row, str(uuid.UUID(bytes=key)), tenant, doc, text)
+            for row, key, tenant, doc, text in self._connect().execute(
+                "SELECT rowid, id, tenant, doc, text FROM chunks WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (rowid, limit)
+            )
+        ]
+
+    def has_document(self, tenant: str, doc: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM documents WHERE tenant = ? AND doc = ?", (tenant, doc)
+        ).fetchone()
+        return row is not None
+
+    def document_keys(self) -> List[Tuple[str, str]]:
+        """Pares (tenant, doc) de todos los documentos."""
+        return self._connect().execute("SELECT tenant, doc FROM documents ORDER BY tenant, doc").fetchall()
+
+    def list_documents(self, tenant: str) -> List[str]:
+        return [
+            doc for (doc,) in self._connect().execute(
+                "SELECT doc FROM documents WHERE tenant = ? ORDER BY doc", (tenant,)
+            )
+        ]
+
+    def document_chunks(self, tenant: str, doc: str, limit: Optional[int] = None) -> List[str]:
+        """Textos de un documento en orden de página."""
+        query = "SELECT text FROM chunks WHERE tenant = ? AND doc = ? ORDER BY page, rowid"
+        params: Tuple[Any, ...] = (tenant, doc)
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit,)
+        return [text for (text,) in self._connect().execute(query, params)]
+
+    def iter_texts(self, tenant: str, doc: Optional[str] = None) -> Iterator[str]:
+        """Recorre los textos de un tenant (o de uno de sus documentos) sin cargarlos todos."""
+        if doc:
+            cursor = self._connect().execute(
+                "SELECT text FROM chunks WHERE tenant = ? AND doc = ?", (tenant, doc)
+            )
+        else:
+            cursor = self._connect().execute("SELECT text FROM chunks WHERE tenant = ?", (tenant,))
+        for (text,) in cursor:
+            yield text
+
+    def document_info(self, tenant: str, doc: str) -> Dict[str, Any]:
+        """Metadatos y estadísticas de un documento ({} si no existe)."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT title, author, created_at FROM documents WHERE tenant = ? AND doc = ?",
+            (tenant, doc)
+        ).fetchone()
+        if row is None:
+            return {}
+        # Los chunks deduplicados también cuentan las páginas de los chunks que reemplazan
+        pages = sorted({
+            p
+            for page, extra in conn.execute(
+                "SELECT DISTINCT page, pages FROM chunks WHERE tenant = ? AND doc = ?", (tenant, doc)
+            )
+            for p in _pages_list(page, extra)
+        })
+        total_chunks, total_chars = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(char_count), 0) FROM chunks WHERE tenant = ? AND doc = ?",
+            (tenant, doc)
+        ).fetchone()
+        title, author, created_at = row
+        return {
+            "name": doc,
+            "title": title,
+            "author": author,
+            "total_chunks": total_chunks,
+            "total_pages": len(pages),
+            "total_characters": total_chars,
+            "created_at": created_at,
+            "pages": pages,
+        }
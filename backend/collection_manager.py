@@ -0,0 +1,246 @@
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Set
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CollectionSpec:
+    """
+    Configuración declarativa de una colección de Qdrant.
+
+    ``schema_version`` se incrementa cuando cambia la forma de los puntos
+    (payload, índices); los parámetros de HNSW y del optimizador se
+    reconcilian en caliente sobre colecciones existentes.
+    """
+    vector_size: int
+    distance: models.Distance = models.Distance.COSINE
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    hnsw_payload_m: Optional[int] = None
+    on_disk_vectors: bool = False
+    on_disk_payload: bool = True
+    indexing_threshold: int = 20000
+    default_segment_number: int = 0
+    payload_indexes: Dict[str, models.PayloadSchemaType] = field(default_factory=dict)
+    schema_version: int = 1
+
+
+class CollectionManager:
+    """
+    Crea, reconcilia y cachea las colecciones de Qdrant.
+
+    Recuerda qué colecciones existen y con qué versión de esquema fueron
+    verificadas, así las búsquedas e ingestas no consultan los metadatos de
+    Qdrant en cada llamada. El cache es por proceso: si otra instancia borra
+    una colección, ``invalidate`` la vuelve a verificar en el siguiente uso.
+
+    Args:
+        client_factory: Callable que devuelve el cliente de Qdrant
+        spec_factory: Callable que devuelve la especificación de una colección a partir de su tamaño de vector
+    """
+
+    def __init__(self, client_factory: Callable[[], QdrantClient],
+                 spec_factory: Callable[[int], CollectionSpec]):
+        self._client_factory = client_factory
+        self._spec_factory = spec_factory
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._known: Set[str] = set()
+        self._bulk_loads: Dict[str, int] = {}
+
+    def _collection_names(self):
+        with observe_stage("qdrant_metadata"):
+            return {c.name for c in self._client_factory().get_collections().collections}
+
+    def exists(self, collection_name: str) -> bool:
+        """Indica si la colección existe; solo consulta Qdrant si no está en cache."""
+        if collection_name in self._known:
+            return True
+        names = self._collection_names()
+        with self._lock:
+            self._known.update(names)
+        return collection_name in names
+
+    def ensure(self, collection_name: str, vector_size: int) -> CollectionSpec:
+        """
+        Garantiza que la colección exista con la configuración declarada.
+
+        Args:
+            collection_name: Nombre de la colección
+            vector_size: Tamaño del vector
+
+        Returns:
+            Especificación aplicada
+        """
+        spec = self._spec_factory(vector_size)
+        if self._versions.get(collection_name) == spec.schema_version:
+            return spec
+        with self._lock:
+            if self._versions.get(collection_name) == spec.schema_version:
+                return spec
+            if collection_name in self._collection_names():
+                self._reconcile(collection_name, spec)
+            else:
+                self._create(collection_name, spec)
+            self._ensure_payload_indexes(collection_name, spec)
+            self._versions[collection_name] = spec.schema_version
+            self._known.add(collection_name)
+        return spec
+
+    def invalidate(self, collection_name: Optional[str] = None):
+        """Olvida el estado cacheado de una colección (o de todas)."""
+        with self._lock:
+            if collection_name is None:
+                self._versions.clear()
+                self._known.clear()
+            else:
+                self._versions.pop(collection_name, None)
+                self._known.discard(collection_name)
+
+    def _hnsw_config(self, spec: CollectionSpec) -> models.HnswConfigDiff:
+        return models.HnswConfigDiff(
+            m=spec.hnsw_m,
+            ef_construct=spec.hnsw_ef_construct,
+            payload_m=spec.hnsw_payload_m
+        )
+
+    def _optimizers_config(self, spec: CollectionSpec, indexing_threshold: int) -> models.OptimizersConfigDiff:
+        return models.OptimizersConfigDiff(
+            indexing_threshold=indexing_threshold,
+            default_segment_number=spec.default_segment_number
+        )
+
+    def _indexing_threshold(self, collection_name: str, spec: CollectionSpec) -> int:
+        # Durante una carga masiva el índice HNSW queda desactivado (umbral 0)
+        return 0 if self._bulk_loads.get(collection_name) else spec.indexing_threshold
+
+    def _create(self, collection_name: str, spec: CollectionSpec):
+        client = self._client_factory()
+        with observe_stage("qdrant_metadata"):
+            client.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(
+                    size=spec.vector_size,
+                    distance=spec.distance,
+                    on_disk=spec.on_disk_vectors
+                ),
+                hnsw_config=self._hnsw_config(spec),
+                optimizers_config=self._optimizers_config(
+                    spec, self._indexing_threshold(collection_name, spec)
+                ),
+                on_disk_payload=spec.on_disk_payload
+            )
+        logger.info(f"Colección '{collection_name}' creada con éxito.")
+
+    def _reconcile(self, collection_name: str, spec: CollectionSpec):
+        """Aplica a una colección existente los parámetros que pueden cambiarse en caliente."""
+        client = self._client_factory()
+        with observe_stage("qdrant_metadata"):
+            config = client.get_collection(collection_name).config
+
+        vectors = config.params.vectors
+        if isinstance(vectors, models.VectorParams) and vectors.size != spec.vector_size:
+            raise ValueError(
+                f"La colección '{collection_name}' tiene vectores de {vectors.size} dimensiones, "
+                f"se esperaban {spec.vector_size}"
+            )
+        if isinstance(vectors, models.VectorParams) and bool(vectors.on_disk) != spec.on_disk_vectors:
+            logger.warning(
+                f"'{collection_name}': on_disk de los vectores difiere de la configuración; "
+                "requiere recrear la colección"
+            )
+
+        hnsw = config.hnsw_config
+        optimizer = config.optimizer_config
+        threshold = self._indexing_threshold(collection_name, spec)
+        if (hnsw.m, hnsw.ef_construct, hnsw.payload_m) != (spec.hnsw_m, spec.hnsw_ef_construct, spec.hnsw_payload_m) \
+                or optimizer.indexing_threshold != threshold \
+                or optimizer.default_segment_number != spec.default_segment_number:
+            with observe_stage("qdrant_metadata"):
+                client.update_collection(
+                    collection_name=collection_name,
+                    hnsw_config=self._hnsw_config(spec),
+                    optimizers_config=self._optimizers_config(spec, threshold)
+                )
+            logger.info(f"Configuración de '{collection_name}' actualizada")
+
+    def _ensure_payload_indexes(self, collection_name: str, spec: CollectionSpec):
+        client = self._client_factory()
+        with observe_stage("qdrant_metadata"):
+            schema = client.get_collection(collection_name).payload_schema or {}
+        for field_name, field_schema in spec.payload_indexes.items():
+            if field_name not in schema:
+                client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=field_name,
+                    field_schema=field_schema
+                )
+                logger.info(f"Índice de payload '{field_name}' creado en '{collection_name}'")
+
+    def is_indexed(self, collection_name: str, vector_size: int) -> bool:
+        """
+        Indica si Qdrant terminó de optimizar la colección y de indexar sus vectores.
+
+        Una colección cuyos vectores no superan ``indexing_threshold`` (kB)
+        no se indexa con HNSW: basta con que esté en verde.
+        """
+        spec = self._spec_factory(vector_size)
+        with observe_stage("qdrant_metadata"):
+            info = self._client_factory().get_collection(collection_name)
+        if info.status != models.CollectionStatus.GREEN:
+            return False
+        points = info.points_count or 0
+        if points * spec.vector_size * 4 <= spec.indexing_threshold * 1024:
+            return True
+        return (info.indexed_vectors_count or 0) >= points
+
+    @contextmanager
+    def bulk_load(self, collection_name: str, vector_size: int):
+        """
+        Desactiva la construcción del índice HNSW mientras dura una carga masiva.
+
+        Insertar con el índice activo obliga a Qdrant a reindexar segmentos
+        una y otra vez; con el umbral en 0 solo guarda los vectores y el índice
+        se construye una vez al salir. Cargas concurrentes sobre la misma
+        colección comparten el modo: el índice se reactiva al terminar la última.
+        La cuenta es por proceso: otro proceso que termina su carga reactiva el
+        índice aunque esta siga en curso (solo cuesta reindexar antes de tiempo).
+        """
+        spec = self.ensure(collection_name, vector_size)
+        client = self._client_factory()
+        with self._lock:
+            self._bulk_loads[collection_name] = self._bulk_loads.get(collection_name, 0) + 1
+            if self._bulk_loads[collection_name] == 1:
+                with observe_stage("qdrant_metadata"):
+                    client.update_collection(
+                        collection_name=collection_name,
+                        optimizers_config=self._optimizers_config(spec, 0)
+                    )
+                logger.info(f"'{collection_name}': modo carga masiva activado")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._bulk_loads[collection_name] -= 1
+                if not self._bulk_loads[collection_name]:
+                    del self._bulk_loads[collection_name]
+                    try:
+                        with observe_stage("qdrant_metadata"):
+                            client.update_collection(
+                                collection_name=collection_name,
+                                optimizers_config=self._optimizers_config(spec, spec.indexing_threshold)
+                            )
+                        logger.info(f"'{collection_name}': modo carga masiva desactivado")
+                    except Exception as e:
+                        # Si no se pudo reactivar, el próximo ensure() lo reintenta
+                        self._versions.pop(collection_name, None)
+                        logger.error(f"No se pudo reactivar el índice de '{collection_name}': {e}")
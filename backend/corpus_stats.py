@@ -0,0 +1,77 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Tuple
+
+from chunk_store import ChunkStore
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se escriben al chunk store las consultas acumuladas en memoria
+STATS_FLUSH_INTERVAL_S = float(os.getenv("STATS_FLUSH_INTERVAL_S", "5"))
+
+
+def _add(counters: Dict, key, count: int, at: str):
+    pending, last = counters.get(key, (0, ""))
+    counters[key] = (pending + count, max(last, at))
+
+
+class QueryStats:
+    """
+    Cuenta búsquedas por tenant y por documento y las persiste en lotes.
+
+    Las búsquedas solo suman en memoria; la primera que llega después de
+    ``flush_interval_s`` escribe todo lo acumulado en una transacción, así el
+    camino de la búsqueda no espera una escritura a SQLite en cada consulta.
+    Las lecturas de estadísticas llaman a ``flush`` antes de leer.
+
+    Args:
+        get_store: Devuelve el chunk store donde se persisten los contadores
+        flush_interval_s: Intervalo mínimo entre escrituras
+    """
+
+    def __init__(self, get_store: Callable[[], ChunkStore], flush_interval_s: float = STATS_FLUSH_INTERVAL_S):
+        self._get_store = get_store
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.Lock()
+        self._tenants: Dict[str, Tuple[int, str]] = {}
+        self._documents: Dict[Tuple[str, str], Tuple[int, str]] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, tenant: str, docs: Iterable[str] = (), searches: int = 1):
+        """
+        Registra búsquedas de un tenant y los documentos que aparecieron en los resultados.
+
+        Args:
+            tenant: Tenant que buscó
+            docs: Documentos devueltos (cada uno cuenta una vez por llamada)
+            searches: Búsquedas que representa la llamada (lotes de preguntas)
+        """
+        now = datetime.now().isoformat()
+        with self._lock:
+            _add(self._tenants, tenant, searches, now)
+            for doc in set(docs):
+                _add(self._documents, (tenant, doc), 1, now)
+            due = time.monotonic() - self._last_flush >= self.flush_interval_s
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Escribe las consultas acumuladas. Si falla, se conservan para el próximo intento."""
+        with self._lock:
+            tenants, documents = self._tenants, self._documents
+            self._tenants, self._documents = {}, {}
+            self._last_flush = time.monotonic()
+        if not tenants and not documents:
+            return
+        try:
+            self._get_store().record_queries(tenants, documents)
+        except Exception as e:
+            logger.warning(f"No se pudieron guardar las estadísticas de consultas: {e}")
+            with self._lock:
+                for tenant, (count, at) in tenants.items():
+                    _add(self._tenants, tenant, count, at)
+                for key, (count, at) in documents.items():
+                    _add(self._documents, key, count, at)
@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Una línea es boilerplate si aparece en al menos esta fracción de las páginas (y en 2 o más)
+BOILERPLATE_MIN_RATIO = float(os.getenv("BOILERPLATE_MIN_RATIO", "0.5"))
+# Con menos páginas no hay frecuencias confiables y no se quita nada
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "3"))
+# Bits de diferencia (de 64) entre SimHash para considerar dos chunks candidatos a casi duplicados
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3"))
+# Similitud de Jaccard mínima entre los shingles de dos candidatos para descartar uno
+NEAR_DUPLICATE_MIN_JACCARD = float(os.getenv("NEAR_DUPLICATE_MIN_JACCARD", "0.9"))
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+# Líneas no vacías al principio y al final de cada página donde están encabezados, pies y números de página
+EDGE_LINES = 2
+
+DIGITS_RE = re.compile(r"\d+")
+SPACES_RE = re.compile(r"\s+")
+WORD_RE = re.compile(r"\w+")
+LETTER_RE = re.compile(r"[^\W\d_]")
+
+
+def _line_key(line: str, edge: bool) -> str:
+    """
+    Forma normalizada de una línea: sin mayúsculas y, en los bordes de la página,
+    sin números ("Página 3 de 10" == "Página 7 de 10").
+
+    En el cuerpo los números se conservan y las líneas sin letras no tienen
+    clave: una tabla que repite "100" en varias páginas no es boilerplate.
+    """
+    line = line.lower()
+    if edge:
+        line = DIGITS_RE.sub("#", line)
+    elif not LETTER_RE.search(line):
+        return ""
+    return SPACES_RE.sub(" ", line).strip()
+
+
+def _line_keys(lines: List[str]) -> List[str]:
+    """Clave de cada línea de una página; las líneas vacías no cuentan para los bordes."""
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    edges = set(content[:EDGE_LINES] + content[-EDGE_LINES:])
+    return [_line_key(line, i in edges) for i, line in enumerate(lines)]
+
+
+def strip_boilerplate(pages: List[Dict[str, Any]],
+                      min_ratio: float = BOILERPLATE_MIN_RATIO,
+                      min_pages: int = BOILERPLATE_MIN_PAGES) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Quita encabezados, pies, avisos legales y números de página repetidos.
+
+    Cuenta en cuántas páginas aparece cada línea (normalizada) y elimina las
+    que se repiten en al menos ``min_ratio`` de ellas. Las páginas que quedan
+    vacías se descartan.
+
+    Args:
+        pages: Páginas devueltas por extract_text_from_pdf
+        min_ratio: Fracción mínima de páginas en que debe aparecer una línea
+        min_pages: Páginas mínimas del documento para aplicar el filtro
+
+    Returns:
+        Tupla (páginas limpias, líneas eliminadas)
+    """
+    if len(pages) < min_pages:
+        return pages, 0
+
+    frequency = Counter()
+    for page in pages:
+        frequency.update(set(_line_keys(page["text"].split("\n"))) - {""})
+    threshold = max(2, math.ceil(min_ratio * len(pages)))
+    boilerplate = {key for key, count in frequency.items() if count >= threshold}
+    if not boilerplate:
+        return pages, 0
+
+    cleaned, removed = [], 0
+    for page in pages:
+        lines = page["text"].split("\n")
+        kept = [line for line, key in zip(lines, _line_keys(lines)) if key not in boilerplate]
+        removed += len(lines) - len(kept)
+        text = "\n".join(kept).strip()
+        if text:
+            cleaned.append({**page, "text": text, "char_count": len(text)})
+    logger.info(f"Boilerplate: {len(boilerplate)} líneas repetidas, {removed} apariciones eliminadas")
+    return cleaned, removed
+
+
+def shingles(text: str) -> Set[str]:
+    """Shingles de 3 palabras de un texto (el texto completo si es más corto)."""
+    words = WORD_RE.findall(text.lower())
+    if len(words) > SHINGLE_SIZE:
+        return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return {" ".join(words)}
+
+
+def simhash(text: str, features: Optional[Set[str]] = None) -> int:
+    """
+    SimHash de 64 bits sobre shingles de 3 palabras.
+
+    Textos casi iguales dan hashes que difieren en pocos bits.
+    """
+    features = features or shingles(text)
+    digests = b"".join(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest() for f in features)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(features), SIMHASH_BITS)
+    # Cada bit del hash es el voto mayoritario de ese bit entre los features
+    votes = bits.sum(axis=0) * 2 > len(features)
+    return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def dedupe_chunks(chunks: List[Dict[str, Any]],
+                  max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE,
+                  min_jaccard: float = NEAR_DUPLICATE_MIN_JACCARD) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Deja un chunk representativo por grupo de chunks casi duplicados.
+
+    El representativo es la primera aparición; su campo "pages" lista las
+    páginas de todos los miembros del grupo. Los candidatos se buscan por
+    bandas del SimHash: con ``max_distance + 1`` bandas, dos hashes a esa
+    distancia coinciden en al menos una banda, así no se compara cada par.
+    El SimHash solo propone candidatos: un chunk se descarta si además sus
+    shingles tienen Jaccard ``min_jaccard`` o más con el representativo y
+    los dos tienen los mismos números (tablas o versiones que difieren
+    solo en una cifra no se fusionan).
+
+    Args:
+        chunks: Chunks de un documento (build_chunks)
+        max_distance: Bits de diferencia máximos entre candidatos
+        min_jaccard: Similitud mínima entre shingles para confirmar el duplicado
+
+    Returns:
+        Tupla (chunks representativos, chunks descartados)
+    """
+    bands = max_distance + 1
+    width = SIMHASH_BITS // bands
+    mask = (1 << width) - 1
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    representatives: List[Dict[str, Any]] = []
+    hashes: List[int] = []
+    features: List[Set[str]] = []
+    numbers: List[List[str]] = []
+
+    for chunk in chunks:
+        chunk_features = shingles(chunk["chunk"])
+        chunk_numbers = DIGITS_RE.findall(chunk["chunk"])
+        fingerprint = simhash(chunk["chunk"], chunk_features)
+        keys = [(band, (fingerprint >> (band * width)) & mask) for band in range(bands)]
+        match = next((
+            rep for key in keys for rep in buckets.get(key, ())
+            if hamming_distance(fingerprint, hashes[rep]) <= max_distance
+            and numbers[rep] == chunk_numbers
+            and jaccard(chunk_features, features[rep]) >= min_jaccard
+        ), None)
+        if match is not None:
+            pages = representatives[match]["pages"]
+            if chunk["page"] not in pages:
+                pages.append(chunk["page"])
+            continue
+        for key in keys:
+            buckets.setdefault(key, []).append(len(representatives))
+        hashes.append(fingerprint)
+        features.append(chunk_features)
+        numbers.append(chunk_numbers)
+        representatives.append({**chunk, "pages": [chunk["page"]]})
+
+    for rep in representatives:
+        rep["pages"].sort()
+    return representatives, len(chunks) - len(representatives)
+
+
+def dedup_report(chunks_before: int, chunks_after: int, boilerplate_lines: int,
+                 near_duplicates: int) -> Dict[str, Any]:
+    """
+    Resumen por documento para la respuesta de ingesta.
+
+    Args:
+        chunks_before: Chunks que se habrían generado sin limpieza ni deduplicación
+        chunks_after: Chunks que se almacenan (uno por punto en Qdrant)
+        boilerplate_lines: Líneas de boilerplate eliminadas
+        near_duplicates: Chunks descartados por casi duplicados
+    """
+    saved = chunks_before - chunks_after
+    return {
+        "boilerplate_lines_removed": boilerplate_lines,
+        "near_duplicates_removed": near_duplicates,
+        "chunks_before": chunks_before,
+        "chunks_after": chunks_after,
+        "reduction_pct": round(100 * saved / chunks_before, 1) if chunks_before else 0.0,
+    }
@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = "active"
+SHADOW = "shadow"
+
+
+@dataclass(frozen=True)
+class EmbeddingIndex:
+    """Colección física de Qdrant y el modelo de embeddings con el que se llenó."""
+    collection: str
+    model: str
+    vector_size: int
+
+
+class IndexRegistry:
+    """
+    Resuelve una colección lógica ("pdf_chunks") a sus índices físicos.
+
+    Fuera de una migración solo hay índice activo; durante una migración de
+    modelo hay además un índice sombra que recibe las mismas escrituras. El
+    estado persiste en el chunk store para que todos los procesos del API lo
+    vean, y se relee como mucho cada ``refresh_s`` segundos: un cambio de
+    índice activo llega a todas las instancias en ese plazo.
+
+    Una colección sin registro resuelve a sí misma con el modelo por defecto,
+    así las instalaciones que nunca migraron no necesitan configuración.
+
+    Args:
+        load: Callable que devuelve {rol: EmbeddingIndex} de una colección lógica
+        default: Callable que devuelve el índice por defecto de una colección lógica
+        refresh_s: Antigüedad máxima del estado cacheado
+    """
+
+    def __init__(self, load: Callable[[str], Dict[str, EmbeddingIndex]],
+                 default: Callable[[str], EmbeddingIndex], refresh_s: float = 5.0):
+        self._load = load
+        self._default = default
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, Dict[str, EmbeddingIndex]]] = {}
+
+    def _state(self, name: str) -> Dict[str, EmbeddingIndex]:
+        cached = self._cache.get(name)
+        if cached is not None and time.monotonic() - cached[0] < self.refresh_s:
+            return cached[1]
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and time.monotonic() - cached[0] < self.refresh_s:
+                return cached[1]
+            state = self._load(name)
+            self._cache[name] = (time.monotonic(), state)
+            return state
+
+    def active(self, name: str) -> EmbeddingIndex:
+        """Índice donde se busca."""
+        return self._state(name).get(ACTIVE) or self._default(name)
+
+    def shadow(self, name: str) -> Optional[EmbeddingIndex]:
+        """Índice en construcción por una migración, si hay una en curso."""
+        return self._state(name).get(SHADOW)
+
+    def targets(self, name: str) -> List[EmbeddingIndex]:
+        """Índices que deben recibir las escrituras: el activo y, si existe, el sombra."""
+        shadow = self.shadow(name)
+        return [self.active(name)] + ([shadow] if shadow else [])
+
+    def invalidate(self, name: Optional[str] = None):
+        """Fuerza a releer el estado en el próximo uso."""
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(name, None)
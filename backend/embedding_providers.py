@@ -0,0 +1,259 @@
+import itertools
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from metrics import QUEUE_DEPTH, observe_stage
+from rate_limiter import BULK, INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# Modelo local (sentence-transformers) y su lote dinámico
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_DEVICE = os.getenv("LOCAL_EMBEDDING_DEVICE", "cpu")
+LOCAL_EMBEDDING_WORKERS = int(os.getenv("LOCAL_EMBEDDING_WORKERS", "1"))
+LOCAL_EMBEDDING_MAX_BATCH = int(os.getenv("LOCAL_EMBEDDING_MAX_BATCH", "64"))  # textos por llamada al modelo
+LOCAL_EMBEDDING_MAX_WAIT_MS = float(os.getenv("LOCAL_EMBEDDING_MAX_WAIT_MS", "2"))
+LOCAL_EMBEDDING_QUEUE_SIZE = int(os.getenv("LOCAL_EMBEDDING_QUEUE_SIZE", "1024"))  # pedidos en espera
+LOCAL_EMBEDDING_QUEUE_TIMEOUT_S = float(os.getenv("LOCAL_EMBEDDING_QUEUE_TIMEOUT_S", "5"))
+
+# Identificadores de modelo guardados en el índice (ver embedding_index.py)
+HASHING_MODEL = "hashing"
+LOCAL_PREFIX = "local:"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class EmbeddingQueueFull(RuntimeError):
+    """La cola del modelo local está llena: el pedido se rechaza en vez de esperar sin límite."""
+
+
+class EmbeddingProvider(ABC):
+    """
+    Genera embeddings con un modelo concreto.
+
+    Args:
+        model: Identificador del modelo, tal como se guarda en el índice
+        dimensions: Dimensión de los vectores que produce
+    """
+
+    def __init__(self, model: str, dimensions: int):
+        self.model = model
+        self.dimensions = dimensions
+
+    @abstractmethod
+    def embed(self, texts: List[str], priority: str = INTERACTIVE) -> List[List[float]]:
+        """Embeddings de los textos, en el mismo orden."""
+
+    def close(self):
+        pass
+
+
+# --- Hashing ---
+def hashing_embedding(text: str, dimensions: int) -> np.ndarray:
+    """
+    Embedding determinista por feature hashing de las palabras del texto.
+
+    Textos que comparten palabras tienen similitud coseno alta, así que la
+    búsqueda devuelve resultados con sentido sin red ni modelo.
+
+    Returns:
+        Vector float32 normalizado (norma L2 = 1)
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in TOKEN_RE.findall(text.lower()):
+        h = zlib.crc32(token.encode("utf-8"))
+        vector[h % dimensions] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Embeddings por feature hashing: sustituto determinista para tests, CI y benchmarks."""
+
+    def __init__(self, dimensions: int):
+        super().__init__(HASHING_MODEL, dimensions)
+
+    def embed(self, texts: List[str], priority: str = INTERACTIVE) -> List[List[float]]:
+        with observe_stage("embedding"):
+            return [hashing_embedding(text, self.dimensions).tolist() for text in texts]
+
+
+# --- Modelo local ---
+_PRIORITY_RANK = {INTERACTIVE: 0, BULK: 1}
+_STOP_RANK = 2
+
+
+@dataclass(order=True)
+class _Request:
+    rank: int
+    seq: int
+    texts: List[str] = field(compare=False, default_factory=list)
+    future: Optional[Future] = field(compare=False, default=None)
+
+
+class DynamicBatcher:
+    """
+    Agrupa pedidos concurrentes de embeddings en lotes para un modelo local.
+
+    Los pedidos esperan en una cola acotada con prioridad (las consultas
+    interactivas antes que la ingesta). Cada worker toma el primer pedido y
+    le suma los que lleguen en ``max_wait_ms`` hasta juntar ``max_batch``
+    textos: con poca carga una consulta sale sola y casi sin espera, con
+    mucha carga el modelo trabaja con lotes llenos.
+
+    Args:
+        encode: Callable que recibe textos y devuelve una matriz (textos x dimensión)
+        name: Nombre de la cola en las métricas
+        workers: Threads que llaman al modelo (los modelos de torch liberan el GIL)
+        max_batch: Máximo de textos por lote
+        max_wait_ms: Espera máxima para completar un lote
+        queue_size: Máximo de pedidos en espera
+        queue_timeout_s: Espera máxima para entrar a la cola antes de rechazar el pedido
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], name: str = "local_embedding",
+                 workers: int = LOCAL_EMBEDDING_WORKERS, max_batch: int = LOCAL_EMBEDDING_MAX_BATCH,
+                 max_wait_ms: float = LOCAL_EMBEDDING_MAX_WAIT_MS, queue_size: int = LOCAL_EMBEDDING_QUEUE_SIZE,
+                 queue_timeout_s: float = LOCAL_EMBEDDING_QUEUE_TIMEOUT_S):
+        self._encode = encode
+        self.name = name
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000
+        self.queue_timeout_s = queue_timeout_s
+        self._queue: "queue.PriorityQueue[_Request]" = queue.PriorityQueue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, texts: List[str], priority: str = INTERACTIVE) -> Future:
+        future: Future = Future()
+        request = _Request(_PRIORITY_RANK.get(priority, 1), next(self._seq), list(texts), future)
+        try:
+            self._queue.put(request, timeout=self.queue_timeout_s)
+        except queue.Full:
+            raise EmbeddingQueueFull(f"Cola de embeddings '{self.name}' llena ({self._queue.maxsize} pedidos)")
+        QUEUE_DEPTH.labels(queue=self.name).set(self._queue.qsize())
+        return future
+
+    def embed(self, texts: List[str], priority: str = INTERACTIVE) -> np.ndarray:
+        return self.submit(texts, priority).result()
+
+    def _next_batch(self, first: _Request) -> List[_Request]:
+        batch, size = [first], len(first.texts)
+        wait_until = time.monotonic() + self.max_wait_s
+        while size < self.max_batch:
+            remaining = wait_until - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request.future is None:
+                self._queue.put(request)  # señal de cierre: que la vea el siguiente get
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _worker(self):
+        while True:
+            first = self._queue.get()
+            if first.future is None:
+                self._queue.put(first)  # que también la vean los demás workers
+                return
+            batch = self._next_batch(first)
+            QUEUE_DEPTH.labels(queue=self.name).set(self._queue.qsize())
+            texts = [text for request in batch for text in request.texts]
+            try:
+                with observe_stage("embedding"):
+                    vectors = self._encode(texts)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+    def close(self):
+        self._queue.put(_Request(_STOP_RANK, next(self._seq)))
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Modelo de sentence-transformers en CPU (o GPU con LOCAL_EMBEDDING_DEVICE).
+
+    Requiere instalar ``sentence-transformers``; el modelo se descarga la
+    primera vez. Los pedidos se agrupan con un DynamicBatcher.
+
+    Args:
+        model_name: Nombre del modelo en Hugging Face o ruta local
+        device: Dispositivo de torch
+    """
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, device: str = LOCAL_EMBEDDING_DEVICE):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "El proveedor de embeddings local requiere sentence-transformers "
+                "(pip install sentence-transformers)"
+            ) from e
+        logger.info(f"Cargando modelo de embeddings local '{model_name}' en {device}")
+        self._model = SentenceTransformer(model_name, device=device)
+        super().__init__(LOCAL_PREFIX + model_name, self._model.get_sentence_embedding_dimension())
+        self._batcher = DynamicBatcher(self._encode)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(
+            texts,
+            batch_size=LOCAL_EMBEDDING_MAX_BATCH,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+
+    def embed(self, texts: List[str], priority: str = INTERACTIVE) -> List[List[float]]:
+        return self._batcher.embed(texts, priority).tolist()
+
+    def close(self):
+        self._batcher.close()
+
+
+def create_offline_provider(model: str, dimensions: Optional[int]) -> Optional[EmbeddingProvider]:
+    """
+    Crea el proveedor de un modelo que no usa la API de OpenAI.
+
+    Args:
+        model: Identificador del modelo ("hashing" o "local:<modelo>")
+        dimensions: Dimensión pedida (obligatoria para hashing; el modelo local declara la suya)
+
+    Returns:
+        El proveedor, o None si el modelo es de OpenAI
+    """
+    if model == HASHING_MODEL:
+        if not dimensions:
+            raise ValueError("El proveedor de hashing necesita una dimensión")
+        return HashingEmbeddingProvider(dimensions)
+    if model.startswith(LOCAL_PREFIX):
+        return LocalEmbeddingProvider(model[len(LOCAL_PREFIX):])
+    return None
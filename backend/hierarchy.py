@@ -0,0 +1,99 @@
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Páginas consecutivas que forman una sección (los PDFs no traen estructura de capítulos confiable)
+SECTION_PAGES = int(os.getenv("HIERARCHICAL_SECTION_PAGES", "5"))
+
+DOCUMENT = "doc"
+SECTION = "section"
+
+# Ids deterministas: reconstruir los resúmenes de un documento reemplaza los anteriores
+_SUMMARY_NAMESPACE = uuid.UUID("8f5d1c52-3f0e-4c3a-9b8e-6a2f4e1d7c90")
+
+
+def summary_collection_name(collection_name: str) -> str:
+    """Colección con los vectores de resumen de una colección física de chunks."""
+    return f"{collection_name}__summaries"
+
+
+def summary_point_id(tenant: str, doc: str, level: str, section: int = 0) -> str:
+    return str(uuid.uuid5(_SUMMARY_NAMESPACE, f"{tenant}/{doc}/{level}/{section}"))
+
+
+def _centroid(vectors: np.ndarray) -> List[float]:
+    centroid = vectors.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    return (centroid / norm if norm else centroid).tolist()
+
+
+def summary_points(tenant: str, doc: str, chunks: Iterable[Tuple[int, List[float]]],
+                   section_pages: int = SECTION_PAGES) -> List[Tuple[str, List[float], Dict[str, Any]]]:
+    """
+    Vectores de resumen de un documento: el centroide de todos sus chunks y uno por sección.
+
+    Los vectores se normalizan antes de promediar, así el centroide es la
+    dirección media en el espacio coseno. Un documento de una sola sección
+    no repite su centroide como sección.
+
+    Args:
+        tenant: Tenant dueño del documento
+        doc: Nombre del documento
+        chunks: Pares (página, vector) de los chunks del documento
+        section_pages: Páginas por sección
+
+    Returns:
+        Lista de (id de punto, vector, payload)
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return []
+    pages = np.array([page for page, _ in chunks])
+    vectors = np.asarray([vector for _, vector in chunks], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def payload(level: str, mask: np.ndarray) -> Dict[str, Any]:
+        return {
+            "tenant": tenant,
+            "doc": doc,
+            "level": level,
+            "page_start": int(pages[mask].min()),
+            "page_end": int(pages[mask].max()),
+            "chunks": int(mask.sum()),
+        }
+
+    everything = np.ones(len(pages), dtype=bool)
+    points = [(summary_point_id(tenant, doc, DOCUMENT), _centroid(vectors), payload(DOCUMENT, everything))]
+    sections = (np.maximum(pages, 1) - 1) // max(section_pages, 1)
+    if len(np.unique(sections)) > 1:
+        for section in np.unique(sections):
+            mask = sections == section
+            points.append((
+                summary_point_id(tenant, doc, SECTION, int(section)),
+                _centroid(vectors[mask]),
+                payload(SECTION, mask),
+            ))
+    return points
+
+
+def candidate_documents(hits: Iterable[Tuple[str, float]], max_documents: int) -> List[str]:
+    """
+    Documentos con mejor score entre los resultados de documentos y secciones.
+
+    Un documento cuenta con su mejor score: una sola sección muy relevante
+    basta para elegirlo aunque su centroide general no lo sea.
+
+    Args:
+        hits: Pares (documento, score) de la primera etapa
+        max_documents: Documentos a devolver
+
+    Returns:
+        Nombres de documentos, del más al menos relevante
+    """
+    best: Dict[str, float] = {}
+    for doc, score in hits:
+        if score > best.get(doc, float("-inf")):
+            best[doc] = score
+    return sorted(best, key=best.get, reverse=True)[:max_documents]
@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Cola de trabajos: backend ("sqlite:///ruta" o una ruta), intentos por trabajo y retención de terminados
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "data/jobs.db")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_S = float(os.getenv("JOB_RETRY_DELAY_S", "10"))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(7 * 24 * 3600)))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED)
+
+
+@dataclass
+class Job:
+    """Trabajo de la cola, con su estado y su lease actual."""
+    id: str
+    kind: str
+    tenant: str
+    payload: Dict[str, Any]
+    status: str = QUEUED
+    attempts: int = 0
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Vista pública del trabajo (sin el payload interno ni el lease)."""
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "filename": self.payload.get("filename"),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobQueue(ABC):
+    """
+    Cola durable de trabajos con leases.
+
+    Un worker toma un trabajo con ``lease`` y lo conserva renovando el lease
+    con ``heartbeat``; si el worker muere, el lease vence y otro worker
+    retoma el trabajo (hasta ``max_attempts`` intentos). ``complete`` y
+    ``fail`` solo tienen efecto si quien los llama sigue siendo el dueño del
+    lease, así un worker que se colgó y volvió no pisa el trabajo de otro.
+    """
+
+    @abstractmethod
+    def enqueue(self, kind: str, tenant: str, payload: Dict[str, Any],
+                max_attempts: int = JOB_MAX_ATTEMPTS) -> Job:
+        """Encola un trabajo y lo devuelve con su id."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """Trabajo por id, o None si no existe."""
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_s: float, kinds: Optional[List[str]] = None) -> Optional[Job]:
+        """Toma el trabajo disponible más antiguo, o None si no hay."""
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_s: float) -> bool:
+        """Extiende el lease. False si el worker ya no es el dueño del trabajo."""
+
+    @abstractmethod
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Marca el trabajo como terminado. False si el worker ya no es el dueño del trabajo."""
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True) -> bool:
+        """Registra un error; con ``retry`` y sin agotar los intentos, el trabajo vuelve a la cola."""
+
+    @abstractmethod
+    def pending(self, tenant: str, kind: Optional[str] = None) -> List[Job]:
+        """Trabajos en cola o en curso de un tenant."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Cantidad de trabajos por estado."""
+
+    @abstractmethod
+    def purge(self, older_than_s: float = JOB_RETENTION_S) -> int:
+        """Borra los trabajos terminados hace más de ``older_than_s`` segundos."""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_by_tenant ON jobs (tenant, status);
+"""
+
+_COLUMNS = ("id, kind, tenant, payload, status, attempts, max_attempts, lease_owner, lease_expires, "
+            "result, error, created_at, updated_at")
+
+
+def _row_to_job(row) -> Job:
+    (job_id, kind, tenant, payload, status, attempts, max_attempts, lease_owner, lease_expires,
+     result, error, created_at, updated_at) = row
+    return Job(
+        id=job_id, kind=kind, tenant=tenant, payload=json.loads(payload), status=status,
+        attempts=attempts, max_attempts=max_attempts, lease_owner=lease_owner, lease_expires=lease_expires,
+        result=json.loads(result) if result else None, error=error,
+        created_at=created_at, updated_at=updated_at,
+    )
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Cola de trabajos en un archivo SQLite, para API y workers en el mismo host.
+
+    Cada lease se toma en una transacción ``BEGIN IMMEDIATE``: varios
+    procesos pueden pedir trabajos a la vez sin que dos reciban el mismo.
+    Los tiempos son de reloj de pared porque se comparan entre procesos.
+
+    Args:
+        path: Archivo SQLite (se crea si no existe)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por thread: sqlite3 no permite compartirlas entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, tenant: str, payload: Dict[str, Any],
+                max_attempts: int = JOB_MAX_ATTEMPTS) -> Job:
+        job = Job(id=uuid.uuid4().hex, kind=kind, tenant=tenant, payload=payload, max_attempts=max_attempts)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, tenant, payload, status, attempts, max_attempts, available_at, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                (job.id, kind, tenant, json.dumps(payload), QUEUED, max_attempts,
+                 job.created_at, job.created_at, job.updated_at)
+            )
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._connect().execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def lease(self, worker_id: str, lease_s: float, kinds: Optional[List[str]] = None) -> Optional[Job]:
+        now = time.time()
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})" if kinds else ""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Leases vencidos sin intentos restantes: el worker murió en el último intento
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, updated_at = ?, "
+                "error = COALESCE(error, 'El worker dejó de responder') "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (FAILED, now, RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE ((status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?))"
+                f"{kind_filter} ORDER BY available_at LIMIT 1",
+                (QUEUED, now, RUNNING, now, *(kinds or []))
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (RUNNING, worker_id, now + lease_s, now, row[0])
+            )
+            job = _row_to_job(conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (row[0],)).fetchone())
+        return job
+
+    def _update_owned(self, job_id: str, worker_id: str, assignments: str, params: tuple) -> bool:
+        with self._connect() as conn:
+            updated = conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = ?",
+                (*params, time.time(), job_id, worker_id, RUNNING)
+            ).rowcount
+        return updated == 1
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_s: float) -> bool:
+        return self._update_owned(job_id, worker_id, "lease_expires = ?", (time.time() + lease_s,))
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        return self._update_owned(
+            job_id, worker_id, "status = ?, result = ?, error = NULL, lease_owner = NULL, lease_expires = NULL",
+            (SUCCEEDED, json.dumps(result))
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True) -> bool:
+        job = self.get(job_id)
+        if job is None:
+            return False
+        if retry and job.attempts < job.max_attempts:
+            # Espera creciente entre intentos para no insistir sobre una dependencia caída
+            delay = JOB_RETRY_DELAY_S * (2 ** (job.attempts - 1))
+            return self._update_owned(
+                job_id, worker_id,
+                "status = ?, error = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL",
+                (QUEUED, error, time.time() + delay)
+            )
+        return self._update_owned(
+            job_id, worker_id, "status = ?, error = ?, lease_owner = NULL, lease_expires = NULL",
+            (FAILED, error)
+        )
+
+    def pending(self, tenant: str, kind: Optional[str] = None) -> List[Job]:
+        query = f"SELECT {_COLUMNS} FROM jobs WHERE tenant = ? AND status IN (?, ?)"
+        params: tuple = (tenant, QUEUED, RUNNING)
+        if kind:
+            query += " AND kind = ?"
+            params += (kind,)
+        return [_row_to_job(row) for row in self._connect().execute(query + " ORDER BY created_at", params)]
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        for status, count in self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def purge(self, older_than_s: float = JOB_RETENTION_S) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED, time.time() - older_than_s)
+            ).rowcount
+
+
+# Backends disponibles por esquema de URL; otro backend (Redis, SQS...) se agrega con register_backend
+_BACKENDS: Dict[str, Callable[[str], JobQueue]] = {"sqlite": SQLiteJobQueue}
+
+
+def register_backend(scheme: str, factory: Callable[[str], JobQueue]):
+    """Registra una implementación de JobQueue para URLs ``<scheme>://...``."""
+    _BACKENDS[scheme] = factory
+
+
+def create_job_queue(url: str = JOB_QUEUE_URL) -> JobQueue:
+    """
+    Crea la cola indicada por la URL.
+
+    Args:
+        url: "<esquema>://<destino>" o una ruta (SQLite)
+    """
+    scheme, sep, target = url.partition("://")
+    if not sep:
+        return SQLiteJobQueue(url)
+    factory = _BACKENDS.get(scheme)
+    if factory is None:
+        raise ValueError(f"Backend de cola desconocido: '{scheme}'")
+    # sqlite:///data/jobs.db -> /data/jobs.db, sqlite://data/jobs.db -> data/jobs.db
+    return factory(target)
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Cola de trabajos del proceso (se crea al primer uso)."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = create_job_queue()
+    return _job_queue
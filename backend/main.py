@@ -1,38 +1,236 @@
 import os
+import asyncio
+import hashlib
+import contextvars
+import json
+import re
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException, status
+import multiprocessing
+import secrets
+import tarfile
+import threading
+import time
+import zipfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI, UploadFile, File, Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import BaseModel, validator
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import tempfile
 import shutil
-from pdf_utils import extract_text_from_pdf, chunk_text
+from pdf_utils import extract_text_from_pdf, prepare_chunks, process_pdf
+from chat_sessions import ChatSession, SessionStore
+from migration import (
+    MigrationError,
+    cancel_migration,
+    migration_status,
+    resume_migrations,
+    start_migration,
+    stop_migrations,
+)
+from snapshots import (
+    SnapshotError,
+    export_snapshot,
+    import_snapshot,
+    pack_snapshot,
+    read_documents,
+    read_manifest,
+    unpack_snapshot,
+)
+from metrics import (
+    HTTP_LATENCY,
+    IN_FLIGHT,
+    QUEUE_DEPTH,
+    WORKERS_BUSY,
+    observe_duration,
+    observe_stage,
+    observe_threadpool,
+    render_metrics,
+)
+from tracing import start_trace, current_trace, span, debug_timings
+from profiling import SamplingProfiler, save_profile, load_profile
+from singleflight import SingleFlight, flight_key
+from admission import AdmissionMiddleware, WorkloadPool
+from job_queue import QUEUED, RUNNING, get_job_queue
 from vector_utils import (
     store_chunks, 
+    store_chunks_multi,
     search_chunks, 
+    search_chunks_batch,
+    get_embedding,
     generate_answer, 
-    create_collection_if_not_exists,
+    generate_answer_stream,
     list_pdfs,
+    pdf_exists,
     delete_pdf,
     get_pdf_chunks,
-    get_collection_info
+    get_collection_info,
+    get_corpus_summary,
+    get_usage_metrics,
+    record_ingest,
+    warmup,
+    upgrade_legacy_points,
+    check_embedding_config,
+    check_readiness,
+    close_clients,
+    embedding_indexes,
+    DEFAULT_TENANT
 )
+from rate_limiter import BULK
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Configuración desde variables de entorno
+VECTOR_SIZE = int(os.getenv("VECTOR_SIZE", "3072"))
+MAX_PDFS = int(os.getenv("MAX_PDFS", "5"))  # Cupo por tenant (salvo que TENANT_QUOTAS diga otra cosa)
+TENANT_QUOTAS = {
+    tenant.strip(): int(quota)
+    for tenant, _, quota in (item.partition("=") for item in os.getenv("TENANT_QUOTAS", "").split(","))
+    if tenant.strip() and quota.strip()
+}
+TENANT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Multi-tenancy: cada API key identifica a un tenant ("clave1=equipo-a,clave2=equipo-b").
+# Se guarda el SHA-256 de cada clave; sin claves la API es de un solo tenant (DEFAULT_TENANT)
+TENANT_API_KEYS = {
+    hashlib.sha256(key.strip().encode()).hexdigest(): tenant.strip()
+    for key, _, tenant in (item.rpartition("=") for item in os.getenv("TENANT_API_KEYS", "").split(","))
+    if key.strip() and tenant.strip()
+}
+_invalid_tenants = [t for t in TENANT_API_KEYS.values() if not TENANT_ID_RE.match(t)]
+if _invalid_tenants:
+    raise ValueError(f"TENANT_API_KEYS tiene tenants inválidos: {', '.join(_invalid_tenants)}")
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # 50MB por defecto
+MAX_SNAPSHOT_SIZE = int(os.getenv("MAX_SNAPSHOT_SIZE", str(20 * 1024 ** 3)))  # 20GB por defecto
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Requerido para el profiling bajo demanda y las migraciones
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "100"))
+# Recuperación para el chat: resultados y score mínimo, buscando en todos los PDFs o en uno;
+# si no hay resultados se reintenta con el fallback (ver benchmarks/evaluate.py para elegirlos)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "10"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.6"))
+RETRIEVAL_PDF_TOP_K = int(os.getenv("RETRIEVAL_PDF_TOP_K", "8"))
+RETRIEVAL_PDF_MIN_SCORE = float(os.getenv("RETRIEVAL_PDF_MIN_SCORE", "0.5"))
+RETRIEVAL_FALLBACK_TOP_K = int(os.getenv("RETRIEVAL_FALLBACK_TOP_K", "8"))
+RETRIEVAL_FALLBACK_MIN_SCORE = float(os.getenv("RETRIEVAL_FALLBACK_MIN_SCORE", "0.4"))
+RETRIEVAL_PDF_FALLBACK_TOP_K = int(os.getenv("RETRIEVAL_PDF_FALLBACK_TOP_K", "5"))
+RETRIEVAL_PDF_FALLBACK_MIN_SCORE = float(os.getenv("RETRIEVAL_PDF_FALLBACK_MIN_SCORE", "0.3"))
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "500"))
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))  # completions en paralelo por lote
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 2)))
+# Control de admisión: peticiones en ejecución, en espera y espera máxima por clase de carga.
+# Interactivas + pesadas no deberían superar los 40 threads del threadpool de anyio,
+# así una ráfaga de ingestas nunca deja al chat sin threads
+ADMISSION_INTERACTIVE_CONCURRENCY = int(os.getenv("ADMISSION_INTERACTIVE_CONCURRENCY", "32"))
+ADMISSION_INTERACTIVE_QUEUE = int(os.getenv("ADMISSION_INTERACTIVE_QUEUE", "64"))
+ADMISSION_INTERACTIVE_TIMEOUT_S = float(os.getenv("ADMISSION_INTERACTIVE_TIMEOUT_S", "5"))
+ADMISSION_HEAVY_CONCURRENCY = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", "4"))
+ADMISSION_HEAVY_QUEUE = int(os.getenv("ADMISSION_HEAVY_QUEUE", "16"))
+ADMISSION_HEAVY_TIMEOUT_S = float(os.getenv("ADMISSION_HEAVY_TIMEOUT_S", "30"))
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+MULTIPART_OVERHEAD = 64 * 1024  # cabeceras y separadores del multipart alrededor del archivo
+# "inline": el API procesa las subidas; "queue": solo las encola para los workers (python -m worker)
+INGEST_MODE = os.getenv("INGEST_MODE", "inline").lower()
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", "data/uploads")  # PDFs en espera, compartido con los workers
+if INGEST_MODE == "queue":
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+WARMUP_OPENAI = os.getenv("WARMUP_OPENAI", "false").lower() == "true"
+WARMUP_QUERIES = [q.strip() for q in os.getenv("WARMUP_QUERIES", "").split("|") if q.strip()]
+
+# Pool de procesos para extraer PDFs en paralelo (se crea al primer uso)
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+
+def get_extraction_pool(reset: bool = False) -> ProcessPoolExecutor:
+    global _extraction_pool
+    if reset and _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+    if _extraction_pool is None:
+        # spawn: el proceso del API tiene threads (uvicorn, clientes HTTP) y fork no es seguro
+        _extraction_pool = ProcessPoolExecutor(
+            max_workers=INGEST_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _extraction_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warmup opcional al arrancar y liberación de recursos al apagar"""
+    if STARTUP_WARMUP:
+        try:
+            await run_in_threadpool(
+                warmup,
+                "pdf_chunks",
+                VECTOR_SIZE,
+                openai=WARMUP_OPENAI,
+                queries=WARMUP_QUERIES
+            )
+        except Exception as e:
+            # No impedir el arranque: /ready seguirá fallando hasta que las dependencias respondan
+            logger.error(f"Warmup falló: {e}")
+    try:
+        # Puntos con el esquema anterior (sin tenant, con el texto en el payload), con o sin warmup
+        await run_in_threadpool(upgrade_legacy_points, "pdf_chunks")
+    except Exception as e:
+        logger.error(f"No se pudieron actualizar los puntos con el esquema anterior: {e}")
+    # Sin try: con un modelo distinto al del índice el API no arranca (mezclaría espacios vectoriales)
+    await run_in_threadpool(check_embedding_config, "pdf_chunks")
+    try:
+        # Una migración de modelo interrumpida por un reinicio continúa desde su último lote
+        await run_in_threadpool(resume_migrations, "pdf_chunks")
+    except Exception as e:
+        logger.error(f"No se pudo retomar la migración de embeddings: {e}")
+    yield
+    stop_migrations()
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+    close_clients()
+
 app = FastAPI(
     title="Copiloto PDF API",
     description="API para análisis inteligente de documentos PDF usando IA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Configuración desde variables de entorno
-VECTOR_SIZE = int(os.getenv("VECTOR_SIZE", "3072"))
-MAX_PDFS = int(os.getenv("MAX_PDFS", "5"))
-MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # 50MB por defecto
+# Control de admisión: el chat y las operaciones pesadas tienen cupos y colas separados
+interactive_pool = WorkloadPool(
+    "interactive", ADMISSION_INTERACTIVE_CONCURRENCY, ADMISSION_INTERACTIVE_QUEUE, ADMISSION_INTERACTIVE_TIMEOUT_S
+)
+heavy_pool = WorkloadPool(
+    "heavy", ADMISSION_HEAVY_CONCURRENCY, ADMISSION_HEAVY_QUEUE, ADMISSION_HEAVY_TIMEOUT_S
+)
+HEAVY_PATH_PREFIXES = ("/ingest", "/chat/batch", "/summary/", "/compare", "/classify/", "/snapshot/")
+
+def _admission_pool(method: str, path: str) -> Optional[WorkloadPool]:
+    if method == "POST" and path == "/chat":
+        return interactive_pool
+    if path.startswith(HEAVY_PATH_PREFIXES):
+        return heavy_pool
+    return None
+
+# Se agrega antes que CORS para que los 429/503 también lleven las cabeceras CORS
+app.add_middleware(AdmissionMiddleware, classify=_admission_pool)
+
+@app.middleware("http")
+async def upload_size_guard(request: Request, call_next):
+    """Rechaza una subida a /ingest que declara un tamaño excesivo antes de leer el cuerpo"""
+    if request.method == "POST" and request.url.path == "/ingest":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+            return JSONResponse(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                content={"detail": f"El archivo excede el tamaño máximo de {MAX_FILE_SIZE // 1024 // 1024}MB"}
+            )
+    return await call_next(request)
 
 # CORS
 app.add_middleware(
@@ -41,12 +239,120 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id", "Retry-After"],
 )
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Registra peticiones en curso, la latencia por ruta y la ocupación del threadpool"""
+    IN_FLIGHT.inc()
+    observe_threadpool()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.dec()
+        observe_threadpool()
+        # Usar la plantilla de la ruta para no crear una serie por cada nombre de PDF
+        route = request.scope.get("route")
+        HTTP_LATENCY.labels(
+            method=request.method,
+            route=route.path if route else "sin_ruta",
+            status=str(status_code)
+        ).observe(time.perf_counter() - start)
+
+def _flag_enabled(request: Request, header: str, param: str) -> bool:
+    value = request.headers.get(header) or request.query_params.get(param) or ""
+    return value.lower() in ("1", "true", "yes")
+
+def _is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+def _require_admin(token: Optional[str]):
+    if not _is_admin(token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Token de administrador inválido"
+        )
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """Desglose de tiempos por petición (Server-Timing) y profiling opcional"""
+    debug = _flag_enabled(request, "X-Debug-Timing", "debug_timing")
+    profiler = None
+    if _flag_enabled(request, "X-Profile", "profile"):
+        if not _is_admin(request.headers.get("X-Admin-Token")):
+            return JSONResponse(
+                status_code=status.HTTP_403_FORBIDDEN,
+                content={"detail": "El profiling requiere un token de administrador válido"}
+            )
+        profiler = SamplingProfiler()
+        profiler.add_thread(threading.get_ident())
+        profiler.start()
+
+    trace = start_trace(debug=debug, profiler=profiler)
+    try:
+        response = await call_next(request)
+    finally:
+        if profiler:
+            profiler.stop()
+
+    response.headers["Server-Timing"] = trace.server_timing()
+    if profiler:
+        response.headers["X-Profile-Id"] = save_profile(profiler)
+    return response
+
+def get_tenant(x_api_key: Optional[str] = Header(None), x_tenant_id: Optional[str] = Header(None)) -> str:
+    """
+    Tenant de la petición, derivado de su API key (cabecera X-API-Key).
+    
+    Con TENANT_API_KEYS configurado, una clave ausente o desconocida recibe 401.
+    Sin claves la API es de un solo tenant. X-Tenant-ID no elige el tenant (lo
+    enviaría cualquier cliente): si llega, debe coincidir con el de la clave.
+    """
+    if TENANT_API_KEYS:
+        tenant = TENANT_API_KEYS.get(hashlib.sha256(x_api_key.encode()).hexdigest()) if x_api_key else None
+        if tenant is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="API key inválida o ausente (cabecera X-API-Key)",
+                headers={"WWW-Authenticate": "ApiKey"}
+            )
+    else:
+        tenant = DEFAULT_TENANT
+    if x_tenant_id and x_tenant_id != tenant:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="X-Tenant-ID no corresponde a la API key" if TENANT_API_KEYS
+            else "Multi-tenancy deshabilitada: configura TENANT_API_KEYS"
+        )
+    return tenant
+
+def tenant_quota(tenant: str) -> int:
+    return TENANT_QUOTAS.get(tenant, MAX_PDFS)
+
+def _with_timings(payload: dict) -> dict:
+    """Agrega el desglose de tiempos a la respuesta si la petición lo solicitó"""
+    timings = debug_timings()
+    if timings:
+        payload["timings"] = timings
+    return payload
+
+# Sesiones de chat (historial y contexto recuperado), en memoria por proceso
+chat_sessions = SessionStore()
+
+# Análisis por documento (resumen, comparación, clasificación) idénticos y simultáneos
+analysis_flights = SingleFlight("analysis")
+
 # ----------------- MODELOS -----------------
 class ChatRequest(BaseModel):
     message: str
     pdf_name: Optional[str] = None
+    session_id: Optional[str] = None
+    stream: bool = False
     
     @validator('message')
     def validate_message(cls, v):
@@ -56,6 +362,23 @@ class ChatRequest(BaseModel):
             raise ValueError('El mensaje no puede exceder 1000 caracteres')
         return v.strip()
 
+class BatchChatRequest(BaseModel):
+    questions: List[str]
+    pdf_name: Optional[str] = None
+    
+    @validator('questions')
+    def validate_questions(cls, v):
+        if not v:
+            raise ValueError('Debes enviar al menos una pregunta')
+        if len(v) > MAX_BATCH_QUESTIONS:
+            raise ValueError(f'El lote no puede exceder {MAX_BATCH_QUESTIONS} preguntas')
+        questions = [q.strip() for q in v]
+        if any(not q for q in questions):
+            raise ValueError('Las preguntas no pueden estar vacías')
+        if any(len(q) > 1000 for q in questions):
+            raise ValueError('Cada pregunta no puede exceder 1000 caracteres')
+        return questions
+
 class CompareRequest(BaseModel):
     pdfs: List[str]
     
@@ -67,6 +390,16 @@ class CompareRequest(BaseModel):
             raise ValueError('Los PDFs deben ser diferentes')
         return v
 
+class MigrationRequest(BaseModel):
+    model: str
+    vector_size: Optional[int] = None  # None = la dimensión que declara el modelo
+    
+    @validator('vector_size')
+    def validate_vector_size(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('La dimensión debe ser positiva')
+        return v
+
 class HealthResponse(BaseModel):
     status: str
     version: str
@@ -92,19 +425,34 @@ def health_check():
         timestamp=datetime.now().isoformat()
     )
 
+@app.get("/ready", tags=["Sistema"])
+def readiness_check():
+    """Indica si el backend puede atender tráfico (Qdrant y OpenAI disponibles)"""
+    checks = check_readiness()
+    ready = all(result == "ok" for result in checks.values())
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
 @app.get("/status", tags=["Sistema"])
-def get_status():
+def get_status(tenant: str = Depends(get_tenant)):
     """Obtener información del estado del sistema"""
     try:
-        pdfs = list_pdfs()
-        collection_info = get_collection_info("pdf_chunks")
+        # Solo lecturas locales (contadores y chunk store): se puede consultar seguido sin cargar Qdrant
+        pdfs = list_pdfs(tenant=tenant)
+        corpus = get_corpus_summary("pdf_chunks", tenant)
+        index = embedding_indexes.active("pdf_chunks")
         return {
             "status": "operational",
+            "tenant": tenant,
             "pdfs_count": len(pdfs),
-            "max_pdfs": MAX_PDFS,
-            "vector_size": VECTOR_SIZE,
+            "max_pdfs": tenant_quota(tenant),
+            "embedding_model": index.model,
+            "vector_size": index.vector_size,
             "available_pdfs": pdfs,
-            "collection_info": collection_info
+            "corpus": corpus["tenant"],
+            "collection_info": corpus["collection_info"]
         }
     except Exception as e:
         logger.error(f"Error obteniendo estado: {e}")
@@ -113,12 +461,50 @@ def get_status():
             "error": str(e)
         }
 
+@app.get("/usage", tags=["Sistema"])
+def get_usage(tenant: str = Depends(get_tenant)):
+    """Estadísticas de uso del tenant: totales y, por PDF, chunks, páginas, tamaño, ingesta y consultas"""
+    usage = get_usage_metrics(tenant=tenant)
+    if not usage:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno obteniendo estadísticas de uso"
+        )
+    return usage
+
+@app.get("/admin/usage", tags=["Administración"])
+def get_global_usage(x_admin_token: Optional[str] = Header(None)):
+    """Totales de todos los tenants"""
+    _require_admin(x_admin_token)
+    return get_corpus_summary("pdf_chunks")["global"]
+
+@app.get("/metrics", tags=["Sistema"])
+async def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus"""
+    if INGEST_MODE == "queue":
+        counts = await run_in_threadpool(get_job_queue().counts)
+        QUEUE_DEPTH.labels(queue="jobs").set(counts[QUEUED])
+        WORKERS_BUSY.labels(pool="jobs").set(counts[RUNNING])
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/profiles/{profile_id}", tags=["Debug"])
+def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Descargar un perfil guardado (formato folded, compatible con speedscope)"""
+    _require_admin(x_admin_token)
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Perfil '{profile_id}' no encontrado"
+        )
+    return PlainTextResponse(profile)
+
 @app.get("/debug/search/{pdf_name}", tags=["Debug"])
-def debug_search(pdf_name: str, query: str = "test"):
+def debug_search(pdf_name: str, query: str = "test", tenant: str = Depends(get_tenant)):
     """Endpoint de debug para probar búsquedas"""
     try:
         # Verificar si el PDF existe
-        existing_pdfs = list_pdfs()
+        existing_pdfs = list_pdfs(tenant=tenant)
         if pdf_name not in existing_pdfs:
             return {
                 "error": f"PDF '{pdf_name}' no encontrado",
@@ -126,14 +512,16 @@ def debug_search(pdf_name: str, query: str = "test"):
             }
         
         # Probar búsqueda
-        chunks = search_chunks(query, pdf_name=pdf_name, top_k=5, min_score=0.5)
+        chunks = search_chunks(query, pdf_name=pdf_name, top_k=5, min_score=0.5, tenant=tenant)
+        trace = current_trace()
         
         return {
             "pdf_name": pdf_name,
             "query": query,
             "chunks_found": len(chunks),
             "chunks": chunks[:2] if chunks else [],  # Solo mostrar los primeros 2
-            "collection_info": get_collection_info("pdf_chunks")
+            "collection_info": get_collection_info("pdf_chunks"),
+            "timings": trace.summary() if trace else {}
         }
         
     except Exception as e:
@@ -144,62 +532,132 @@ def debug_search(pdf_name: str, query: str = "test"):
             "query": query
         }
 
+def _retrieve_context(message: str, pdf_name: Optional[str], tenant: str) -> List[str]:
+    """Busca los chunks para una pregunta, bajando el score mínimo si no hay resultados"""
+    if pdf_name:
+        # Buscar en PDF específico con score más bajo para obtener más resultados
+        chunks = search_chunks(message, pdf_name=pdf_name, top_k=RETRIEVAL_PDF_TOP_K,
+                               min_score=RETRIEVAL_PDF_MIN_SCORE, tenant=tenant)
+        logger.info(f"Chat con PDF específico: {pdf_name} - {len(chunks)} chunks encontrados")
+    else:
+        # Buscar en todos los PDFs
+        chunks = search_chunks(message, top_k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE, tenant=tenant)
+        logger.info(f"Chat con todos los PDFs - {len(chunks)} chunks encontrados")
+    
+    if not chunks:
+        # Si no se encontraron chunks relevantes, intentar con score más bajo
+        logger.info("No se encontraron chunks relevantes, intentando con score más bajo")
+        with span("retrieval_fallback"):
+            if pdf_name:
+                chunks = search_chunks(message, pdf_name=pdf_name, top_k=RETRIEVAL_PDF_FALLBACK_TOP_K,
+                                       min_score=RETRIEVAL_PDF_FALLBACK_MIN_SCORE, tenant=tenant)
+            else:
+                chunks = search_chunks(message, top_k=RETRIEVAL_FALLBACK_TOP_K,
+                                       min_score=RETRIEVAL_FALLBACK_MIN_SCORE, tenant=tenant)
+    return chunks
+
+def _session_context(session: ChatSession, message: str, pdf_name: Optional[str], tenant: str):
+    """
+    Contexto para un turno de la sesión.
+    
+    Si la pregunta sigue el tema de la última recuperación (y el mismo PDF), se
+    reutilizan sus chunks: no hay búsqueda y el prompt conserva el mismo prefijo.
+    
+    Returns:
+        (chunks, reutilizado)
+    """
+    embedding = get_embedding(message)
+    if session.same_topic(embedding, pdf_name):
+        return session.context_chunks, True
+    chunks = _retrieve_context(message, pdf_name, tenant)
+    if chunks:
+        session.set_context(chunks, embedding, pdf_name)
+    return chunks, False
+
+def _stream_answer(session: ChatSession, message: str, chunks: List[str], history: List[dict]):
+    parts = []
+    try:
+        for delta in generate_answer_stream(message, chunks, history=history):
+            parts.append(delta)
+            yield delta
+    finally:
+        # Si el cliente se desconecta o el stream falla, el turno queda con lo que alcanzó a recibir
+        if parts:
+            session.add_turn(message, "".join(parts))
+
 @app.post("/chat", tags=["Chat"])
-def chat_contextual(req: ChatRequest):
-    """Chat contextual con los PDFs cargados"""
+def chat_contextual(req: ChatRequest, tenant: str = Depends(get_tenant)):
+    """
+    Chat contextual con los PDFs cargados.
+    
+    Cada respuesta incluye un ``session_id``; enviarlo en el siguiente mensaje
+    conserva el historial y, mientras la conversación siga el mismo tema,
+    reutiliza el contexto ya recuperado. Con ``stream`` la respuesta se envía
+    como texto a medida que se genera (session_id en la cabecera X-Session-Id).
+    """
     try:
+        if req.session_id:
+            session = chat_sessions.get(req.session_id, tenant)
+            if session is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="La sesión no existe o expiró"
+                )
+        else:
+            session = chat_sessions.create(tenant, req.pdf_name)
+        
         # Validar que hay PDFs disponibles
-        existing_pdfs = list_pdfs()
+        existing_pdfs = list_pdfs(tenant=tenant)
         if not existing_pdfs:
-            return {
+            return _with_timings({
                 "user_message": req.message,
                 "pdf_used": "ninguno",
                 "bot_response": "No hay documentos cargados. Por favor, sube algunos PDFs primero.",
-                "chunks_used": 0
-            }
+                "chunks_used": 0,
+                "session_id": session.session_id
+            })
         
         # Validar si se busca en un PDF específico
-        if req.pdf_name:
-            if req.pdf_name not in existing_pdfs:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, 
-                    detail=f"El PDF '{req.pdf_name}' no existe en la base de datos"
-                )
-            
-            # Buscar en PDF específico con score más bajo para obtener más resultados
-            chunks = search_chunks(req.message, pdf_name=req.pdf_name, top_k=8, min_score=0.5)
-            logger.info(f"Chat con PDF específico: {req.pdf_name} - {len(chunks)} chunks encontrados")
-        else:
-            # Buscar en todos los PDFs
-            chunks = search_chunks(req.message, top_k=10, min_score=0.6)
-            logger.info(f"Chat con todos los PDFs - {len(chunks)} chunks encontrados")
+        if req.pdf_name and req.pdf_name not in existing_pdfs:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, 
+                detail=f"El PDF '{req.pdf_name}' no existe en la base de datos"
+            )
         
+        chunks, reused = _session_context(session, req.message, req.pdf_name, tenant)
         if not chunks:
-            # Si no se encontraron chunks relevantes, intentar con score más bajo
-            logger.info("No se encontraron chunks relevantes, intentando con score más bajo")
-            if req.pdf_name:
-                chunks = search_chunks(req.message, pdf_name=req.pdf_name, top_k=5, min_score=0.3)
-            else:
-                chunks = search_chunks(req.message, top_k=8, min_score=0.4)
-            
-            if not chunks:
-                return {
-                    "user_message": req.message,
-                    "pdf_used": req.pdf_name if req.pdf_name else "todos",
-                    "bot_response": "No encontré información relevante en los documentos para responder tu pregunta. Intenta reformular tu pregunta o especificar un documento específico.",
-                    "chunks_used": 0
+            return _with_timings({
+                "user_message": req.message,
+                "pdf_used": req.pdf_name if req.pdf_name else "todos",
+                "bot_response": "No encontré información relevante en los documentos para responder tu pregunta. Intenta reformular tu pregunta o especificar un documento específico.",
+                "chunks_used": 0,
+                "session_id": session.session_id
+            })
+        
+        history = session.recent_history()
+        if req.stream:
+            return StreamingResponse(
+                _stream_answer(session, req.message, chunks, history),
+                media_type="text/plain; charset=utf-8",
+                headers={
+                    "X-Session-Id": session.session_id,
+                    "X-Context-Reused": str(reused).lower()
                 }
+            )
         
         # Generar respuesta
-        answer = generate_answer(req.message, chunks)
+        answer = generate_answer(req.message, chunks, history=history)
+        session.add_turn(req.message, answer)
         
-        return {
+        return _with_timings({
             "user_message": req.message,
             "pdf_used": req.pdf_name if req.pdf_name else "todos",
             "bot_response": answer,
             "chunks_used": len(chunks),
-            "available_pdfs": existing_pdfs
-        }
+            "available_pdfs": existing_pdfs,
+            "session_id": session.session_id,
+            "context_reused": reused
+        })
         
     except HTTPException:
         raise
@@ -210,10 +668,75 @@ def chat_contextual(req: ChatRequest):
             detail="Error interno del servidor"
         )
 
+def _batch_answers(questions: List[str], contexts: List[List[str]]):
+    """Genera las respuestas en paralelo y entrega una línea JSON por pregunta a medida que terminan"""
+    pool = ThreadPoolExecutor(max_workers=BATCH_QA_CONCURRENCY, thread_name_prefix="batch-qa")
+    try:
+        futures = {
+            pool.submit(
+                contextvars.copy_context().run, generate_answer, question, chunks, priority=BULK
+            ): index
+            for index, (question, chunks) in enumerate(zip(questions, contexts))
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            yield json.dumps({
+                "index": index,
+                "question": questions[index],
+                "answer": future.result(),
+                "chunks_used": len(contexts[index])
+            }, ensure_ascii=False) + "\n"
+    finally:
+        # Si el cliente se desconecta no se lanzan las completions pendientes
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@app.post("/chat/batch", tags=["Chat"])
+def chat_batch(req: BatchChatRequest, tenant: str = Depends(get_tenant)):
+    """
+    Responde muchas preguntas sobre los PDFs en una petición.
+    
+    Los embeddings de todas las preguntas se piden en lote y la búsqueda se
+    hace en una sola llamada a Qdrant; las completions corren en paralelo
+    (``BATCH_QA_CONCURRENCY``). La respuesta es NDJSON: una línea por
+    pregunta, en el orden en que terminan (``index`` indica la pregunta).
+    """
+    if req.pdf_name and not pdf_exists(req.pdf_name, tenant=tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"El PDF '{req.pdf_name}' no existe en la base de datos"
+        )
+    try:
+        # Mismos umbrales que la primera búsqueda de /chat; si no alcanzan, se bajan un 30%
+        if req.pdf_name:
+            contexts = search_chunks_batch(req.questions, top_k=RETRIEVAL_PDF_TOP_K, pdf_name=req.pdf_name,
+                                           min_score=RETRIEVAL_PDF_MIN_SCORE, tenant=tenant)
+        else:
+            contexts = search_chunks_batch(req.questions, top_k=RETRIEVAL_TOP_K,
+                                           min_score=RETRIEVAL_MIN_SCORE, tenant=tenant)
+    except Exception as e:
+        logger.error(f"Error en búsqueda por lote: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno del servidor"
+        )
+    logger.info(f"Lote de {len(req.questions)} preguntas - contexto recuperado")
+    return StreamingResponse(_batch_answers(req.questions, contexts), media_type="application/x-ndjson")
+
+@app.delete("/chat/sessions/{session_id}", tags=["Chat"])
+def delete_chat_session(session_id: str, tenant: str = Depends(get_tenant)):
+    """Descarta el historial y el contexto de una sesión de chat"""
+    if not chat_sessions.delete(session_id, tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="La sesión no existe o expiró"
+        )
+    return {"message": "Sesión eliminada", "session_id": session_id}
+
 @app.post("/ingest", tags=["Documentos"])
-async def ingest_pdf(file: UploadFile = File(...)):
+async def ingest_pdf(file: UploadFile = File(...), tenant: str = Depends(get_tenant)):
     """Subir y procesar un archivo PDF"""
     temp_file = None
+    start = time.perf_counter()
     
     try:
         # Validaciones del archivo
@@ -229,20 +752,13 @@ async def ingest_pdf(file: UploadFile = File(...)):
                 detail="Solo se permiten archivos PDF"
             )
         
-        # Verificar tamaño del archivo
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"El archivo excede el tamaño máximo de {MAX_FILE_SIZE // 1024 // 1024}MB. Tamaño actual: {len(file_content) // 1024 // 1024}MB"
-            )
-        
-        # Verificar límite de PDFs
-        existing_pdfs = list_pdfs()
-        if len(existing_pdfs) >= MAX_PDFS:
+        # Verificar el cupo de PDFs del tenant
+        existing_pdfs = await run_in_threadpool(_documents_and_pending, tenant)
+        quota = tenant_quota(tenant)
+        if len(existing_pdfs) >= quota:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Ya hay {MAX_PDFS} PDFs cargados. Elimina uno antes de subir otro."
+                detail=f"Ya hay {quota} PDFs cargados. Elimina uno antes de subir otro."
             )
         
         # Verificar si el PDF ya existe
@@ -252,35 +768,53 @@ async def ingest_pdf(file: UploadFile = File(...)):
                 detail=f"El PDF '{file.filename}' ya existe en la base de datos"
             )
         
-        # Crear archivo temporal
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        temp_file.write(file_content)
+        # Copiar la subida a disco por bloques (con su SHA-256), cortando al pasar el tamaño máximo
+        temp_file = tempfile.NamedTemporaryFile(
+            delete=False, suffix='.pdf', dir=JOB_SPOOL_DIR if INGEST_MODE == "queue" else None
+        )
         temp_file.close()
+        error, file_size, sha256 = await run_in_threadpool(_spool_upload, file.file, temp_file.name)
+        if error:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=error
+            )
+        
+        if INGEST_MODE == "queue":
+            job = await run_in_threadpool(
+                get_job_queue().enqueue, "ingest", tenant,
+                {"filename": file.filename, "path": temp_file.name, "sha256": sha256, "file_size": file_size}
+            )
+            temp_file = None  # el archivo ahora es del worker
+            logger.info(f"PDF encolado: {file.filename} (trabajo {job.id})")
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+                "filename": file.filename,
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": f"/jobs/{job.id}",
+                "file_size_mb": round(file_size / 1024 / 1024, 2),
+                "sha256": sha256,
+                "message": "PDF recibido: se procesará en segundo plano"
+            })
         
         logger.info(f"Procesando PDF: {file.filename}")
         
-        # Extraer texto del PDF
-        pages = extract_text_from_pdf(temp_file.name)
+        # Extraer texto del PDF (fuera del event loop: PyPDF2 lee el archivo por mmap)
+        with observe_stage("pdf_extraction"):
+            pages = await run_in_threadpool(extract_text_from_pdf, temp_file.name)
         if not pages:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No se pudo extraer texto del PDF. Verifica que el archivo no esté corrupto."
             )
         
-        # Crear chunks
-        all_chunks = []
-        for page in pages:
-            chunks = chunk_text(page["text"])
-            for c in chunks:
-                all_chunks.append({
-                    "doc": file.filename,
-                    "page": page["page"],
-                    "chunk": c
-                })
+        # Crear chunks sin boilerplate ni chunks casi duplicados (fuera del event loop: la deduplicación es CPU)
+        with observe_stage("chunking"):
+            all_chunks, dedup = await run_in_threadpool(prepare_chunks, pages, file.filename)
         
         # Guardar en Qdrant
-        create_collection_if_not_exists("pdf_chunks", VECTOR_SIZE)
-        store_chunks(all_chunks)
+        await run_in_threadpool(store_chunks, all_chunks, tenant=tenant)
+        await run_in_threadpool(record_ingest, file.filename, file_size, time.perf_counter() - start, tenant)
         
         logger.info(f"PDF procesado exitosamente: {file.filename} - {len(all_chunks)} chunks")
         
@@ -288,7 +822,9 @@ async def ingest_pdf(file: UploadFile = File(...)):
             "filename": file.filename,
             "num_chunks": len(all_chunks),
             "num_pages": len(pages),
-            "file_size_mb": round(len(file_content) / 1024 / 1024, 2),
+            "file_size_mb": round(file_size / 1024 / 1024, 2),
+            "sha256": sha256,
+            "dedup": dedup,
             "message": "PDF procesado y chunks guardados en Qdrant"
         }
         
@@ -308,15 +844,273 @@ async def ingest_pdf(file: UploadFile = File(...)):
             except Exception as e:
                 logger.warning(f"No se pudo eliminar archivo temporal: {e}")
 
+def _documents_and_pending(tenant: str) -> List[str]:
+    """PDFs del tenant, incluidos los que esperan en la cola de ingesta"""
+    pdfs = list_pdfs(tenant=tenant)
+    if INGEST_MODE == "queue":
+        pdfs += [job.payload["filename"] for job in get_job_queue().pending(tenant, "ingest")]
+    return pdfs
+
+def _enqueue_batch(accepted: List[dict], tenant: str):
+    for entry in accepted:
+        # Mover fuera del directorio del lote (que se borra al responder) sin copiar
+        path = os.path.join(JOB_SPOOL_DIR, f"{secrets.token_hex(16)}.pdf")
+        os.replace(entry["path"], path)
+        job = get_job_queue().enqueue("ingest", tenant, {"filename": entry["filename"], "path": path})
+        entry["job_id"] = job.id
+
+def _spool_upload(source, dest_path: str, max_size: int = MAX_FILE_SIZE) -> Tuple[Optional[str], int, str]:
+    """
+    Copia un stream a disco por bloques calculando su SHA-256, cortando si supera max_size.
+    
+    En memoria solo hay un bloque a la vez, sea cual sea el tamaño del archivo.
+    
+    Returns:
+        Tupla (mensaje de error o None, bytes copiados, SHA-256 en hexadecimal)
+    """
+    written = 0
+    digest = hashlib.sha256()
+    with open(dest_path, "wb") as dest:
+        while True:
+            block = source.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                return None, written, digest.hexdigest()
+            written += len(block)
+            if written > max_size:
+                return f"El archivo excede el tamaño máximo de {max_size // 1024 // 1024}MB", written, ""
+            digest.update(block)
+            dest.write(block)
+
+def _copy_limited(source, dest_path: str, max_size: int = MAX_FILE_SIZE) -> Optional[str]:
+    """
+    Copia un stream a disco por bloques cortando si supera max_size.
+    
+    Returns:
+        Mensaje de error o None si la copia fue correcta
+    """
+    return _spool_upload(source, dest_path, max_size)[0]
+
+def _collect_batch_files(upload: UploadFile, workdir: str, entries: List[dict]):
+    """
+    Guarda en workdir los PDFs de una subida (un PDF suelto o un archivo zip/tar).
+    
+    Agrega a entries un diccionario por PDF con filename y path, o con error.
+    """
+    filename = upload.filename or ""
+    lower = filename.lower()
+    
+    def next_path() -> str:
+        return os.path.join(workdir, f"{len(entries)}.pdf")
+    
+    def reserve(count: int):
+        # Antes de escribir nada: un archivo con miles de PDFs diminutos no llega a llenar el disco
+        if len(entries) + count > MAX_BATCH_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"El lote excede el máximo de {MAX_BATCH_FILES} PDFs"
+            )
+    
+    if lower.endswith(".pdf"):
+        reserve(1)
+        path = next_path()
+        error = _copy_limited(upload.file, path)
+        entries.append({"filename": filename, "path": None if error else path, "error": error})
+        return
+    
+    if not lower.endswith(ARCHIVE_SUFFIXES):
+        entries.append({"filename": filename, "path": None, "error": "Solo se permiten archivos PDF o archivos zip/tar"})
+        return
+    
+    archive_path = os.path.join(workdir, f"archive_{len(entries)}")
+    error = _copy_limited(upload.file, archive_path)
+    if error:
+        entries.append({"filename": filename, "path": None, "error": error})
+        return
+    
+    try:
+        if lower.endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as archive:
+                members = [
+                    info for info in archive.infolist()
+                    if not info.is_dir() and os.path.basename(info.filename).lower().endswith(".pdf")
+                    and not info.filename.startswith("__MACOSX")
+                ]
+                reserve(len(members))
+                for info in members:
+                    name = os.path.basename(info.filename)
+                    if info.file_size > MAX_FILE_SIZE:
+                        entries.append({"filename": name, "path": None, "error": f"El archivo excede el tamaño máximo de {MAX_FILE_SIZE // 1024 // 1024}MB"})
+                        continue
+                    path = next_path()
+                    with archive.open(info) as member:
+                        error = _copy_limited(member, path)
+                    entries.append({"filename": name, "path": None if error else path, "error": error})
+        else:
+            with tarfile.open(archive_path) as archive:
+                # Solo se leen las cabeceras, y se corta en cuanto el lote se pasa del máximo
+                members = []
+                for member in archive:
+                    if member.isfile() and os.path.basename(member.name).lower().endswith(".pdf"):
+                        members.append(member)
+                        reserve(len(members))
+                for member in members:
+                    name = os.path.basename(member.name)
+                    if member.size > MAX_FILE_SIZE:
+                        entries.append({"filename": name, "path": None, "error": f"El archivo excede el tamaño máximo de {MAX_FILE_SIZE // 1024 // 1024}MB"})
+                        continue
+                    path = next_path()
+                    error = _copy_limited(archive.extractfile(member), path)
+                    entries.append({"filename": name, "path": None if error else path, "error": error})
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        entries.append({"filename": filename, "path": None, "error": f"Archivo comprimido inválido: {e}"})
+    finally:
+        os.unlink(archive_path)
+
+@app.post("/ingest/batch", tags=["Documentos"])
+async def ingest_pdf_batch(files: List[UploadFile] = File(...), tenant: str = Depends(get_tenant)):
+    """Subir y procesar varios PDFs (o archivos zip/tar con PDFs) en una sola petición"""
+    workdir = tempfile.mkdtemp(prefix="ingest_batch_", dir=JOB_SPOOL_DIR if INGEST_MODE == "queue" else None)
+    start = time.perf_counter()
+    
+    try:
+        # Guardar los PDFs en disco (incluye los que vienen dentro de zip/tar)
+        entries: List[dict] = []
+        for upload in files:
+            await run_in_threadpool(_collect_batch_files, upload, workdir, entries)
+        
+        if not entries:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No se encontraron PDFs en la petición"
+            )
+        
+        # Validar duplicados y cupo una sola vez para todo el lote
+        existing_pdfs = set(await run_in_threadpool(_documents_and_pending, tenant))
+        quota = tenant_quota(tenant)
+        available = quota - len(existing_pdfs)
+        seen = set()
+        accepted = []
+        for entry in entries:
+            if entry["error"]:
+                continue
+            if entry["filename"] in existing_pdfs:
+                entry["error"] = f"El PDF '{entry['filename']}' ya existe en la base de datos"
+            elif entry["filename"] in seen:
+                entry["error"] = f"El PDF '{entry['filename']}' está repetido en el lote"
+            elif len(accepted) >= available:
+                entry["error"] = f"Se alcanzó el límite de {quota} PDFs"
+            else:
+                seen.add(entry["filename"])
+                accepted.append(entry)
+        
+        if INGEST_MODE == "queue":
+            # Cada PDF aceptado pasa a ser un trabajo para los workers
+            await run_in_threadpool(_enqueue_batch, accepted, tenant)
+            files_report = [
+                {"filename": e["filename"], "status": "error", "error": e["error"]} if e["error"]
+                else {"filename": e["filename"], "status": "queued", "job_id": e["job_id"]}
+                for e in entries
+            ]
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+                "total_files": len(files_report),
+                "queued": len(accepted),
+                "failed": len(files_report) - len(accepted),
+                "elapsed_s": round(time.perf_counter() - start, 3),
+                "files": files_report
+            })
+        
+        # Extraer y dividir en chunks en paralelo (procesos: la extracción es CPU intensiva)
+        loop = asyncio.get_running_loop()
+        pool = get_extraction_pool()
+        with span("pdf_processing"):
+            results = await asyncio.gather(
+                *[loop.run_in_executor(pool, process_pdf, e["path"], e["filename"]) for e in accepted],
+                return_exceptions=True
+            )
+        if any(isinstance(r, BrokenProcessPool) for r in results):
+            # Un worker murió (p. ej. sin memoria): recrear el pool para las próximas peticiones
+            logger.error("Pool de extracción roto, se recreará")
+            get_extraction_pool(reset=True)
+        
+        all_chunks = []
+        for entry, result in zip(accepted, results):
+            if isinstance(result, Exception):
+                entry["error"] = str(result) or "No se pudo extraer texto del PDF"
+                continue
+            observe_duration("pdf_extraction", result["extraction_s"])
+            observe_duration("chunking", result["chunking_s"])
+            entry["num_pages"] = result["num_pages"]
+            entry["num_chunks"] = len(result["chunks"])
+            entry["dedup"] = result["dedup"]
+            all_chunks.extend(result["chunks"])
+        
+        # Embeddings y upserts en lotes compartidos entre todos los archivos
+        failed = await run_in_threadpool(store_chunks_multi, all_chunks, tenant=tenant) if all_chunks else {}
+        # Los lotes de embeddings son compartidos: cada documento cuenta una parte igual del tiempo total
+        stored = [e for e in accepted if not e["error"] and e["filename"] not in failed]
+        for entry in stored:
+            await run_in_threadpool(
+                record_ingest, entry["filename"], os.path.getsize(entry["path"]),
+                (time.perf_counter() - start) / len(stored), tenant
+            )
+        
+        files_report = []
+        for entry in entries:
+            error = entry["error"] or failed.get(entry["filename"])
+            if error:
+                files_report.append({"filename": entry["filename"], "status": "error", "error": error})
+            else:
+                files_report.append({
+                    "filename": entry["filename"],
+                    "status": "ok",
+                    "num_pages": entry["num_pages"],
+                    "num_chunks": entry["num_chunks"],
+                    "dedup": entry["dedup"]
+                })
+        
+        succeeded = [f for f in files_report if f["status"] == "ok"]
+        logger.info(f"Lote procesado: {len(succeeded)}/{len(files_report)} PDFs correctos")
+        
+        return {
+            "total_files": len(files_report),
+            "succeeded": len(succeeded),
+            "failed": len(files_report) - len(succeeded),
+            "total_chunks": sum(f["num_chunks"] for f in succeeded),
+            "elapsed_s": round(time.perf_counter() - start, 3),
+            "files": files_report
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error procesando lote de PDFs: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno procesando el lote de PDFs"
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+@app.get("/jobs/{job_id}", tags=["Documentos"])
+def get_job_status(job_id: str, tenant: str = Depends(get_tenant)):
+    """Estado de un trabajo de ingesta encolado (INGEST_MODE=queue)"""
+    job = get_job_queue().get(job_id)
+    if job is None or job.tenant != tenant:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Trabajo '{job_id}' no encontrado"
+        )
+    return job.to_dict()
+
 @app.get("/pdfs", tags=["Documentos"])
-def get_pdfs():
+def get_pdfs(tenant: str = Depends(get_tenant)):
     """Obtener lista de PDFs disponibles"""
     try:
-        pdfs = list_pdfs()
+        pdfs = list_pdfs(tenant=tenant)
         return {
             "pdfs": pdfs,
             "count": len(pdfs),
-            "max_pdfs": MAX_PDFS
+            "max_pdfs": tenant_quota(tenant)
         }
     except Exception as e:
         logger.error(f"Error obteniendo PDFs: {e}")
@@ -326,7 +1120,7 @@ def get_pdfs():
         )
 
 @app.delete("/delete_pdf/{pdf_name}", tags=["Documentos"])
-def delete_pdf_endpoint(pdf_name: str):
+def delete_pdf_endpoint(pdf_name: str, tenant: str = Depends(get_tenant)):
     """Eliminar un PDF específico"""
     try:
         if not pdf_name:
@@ -335,7 +1129,7 @@ def delete_pdf_endpoint(pdf_name: str):
                 detail="Nombre del PDF requerido"
             )
         
-        deleted = delete_pdf(pdf_name)
+        deleted = delete_pdf(pdf_name, tenant=tenant)
         if not deleted:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
@@ -354,9 +1148,129 @@ def delete_pdf_endpoint(pdf_name: str):
             detail="Error interno eliminando el PDF"
         )
 
+@app.get("/snapshot/export", tags=["Documentos"])
+def export_snapshot_endpoint(pdf_name: Optional[str] = None, quantize: Optional[str] = None,
+                             tenant: str = Depends(get_tenant)):
+    """
+    Descargar los vectores, textos y metadatos del tenant (o de un PDF) como snapshot (tar).
+    
+    Con ``quantize=int8`` los vectores ocupan 4 veces menos.
+    """
+    if quantize not in (None, "int8"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="quantize solo admite 'int8'"
+        )
+    if pdf_name and not pdf_exists(pdf_name, tenant=tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"PDF '{pdf_name}' no encontrado"
+        )
+    
+    workdir = tempfile.mkdtemp(prefix="snapshot_")
+    try:
+        manifest = export_snapshot(os.path.join(workdir, "snapshot"), tenant=tenant,
+                                   pdf_name=pdf_name, quantize=quantize)
+        archive = os.path.join(workdir, "snapshot.tar")
+        pack_snapshot(os.path.join(workdir, "snapshot"), archive)
+    except SnapshotError as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except Exception as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        logger.error(f"Error exportando snapshot: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno exportando el snapshot"
+        )
+    
+    filename = f"snapshot-{tenant}-{pdf_name}.tar" if pdf_name else f"snapshot-{tenant}.tar"
+    return FileResponse(
+        archive,
+        media_type="application/x-tar",
+        filename=filename,
+        headers={"X-Snapshot-Points": str(manifest["count"])},
+        background=BackgroundTask(shutil.rmtree, workdir, ignore_errors=True)
+    )
+
+@app.post("/snapshot/import", tags=["Documentos"])
+async def import_snapshot_endpoint(file: UploadFile = File(...), tenant: str = Depends(get_tenant)):
+    """Restaurar un snapshot en el tenant sin volver a generar embeddings"""
+    workdir = tempfile.mkdtemp(prefix="snapshot_")
+    try:
+        archive = os.path.join(workdir, "snapshot.tar")
+        error = await run_in_threadpool(_copy_limited, file.file, archive, MAX_SNAPSHOT_SIZE)
+        if error:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=error)
+        directory = os.path.join(workdir, "snapshot")
+        os.makedirs(directory)
+        await run_in_threadpool(unpack_snapshot, archive, directory)
+        os.unlink(archive)
+        
+        # Validar compatibilidad, duplicados y cupo antes de subir nada
+        await run_in_threadpool(read_manifest, directory)
+        documents = {d["doc"] for d in await run_in_threadpool(read_documents, directory)}
+        existing_pdfs = set(await run_in_threadpool(list_pdfs, tenant=tenant))
+        duplicated = sorted(documents & existing_pdfs)
+        if duplicated:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Los PDFs ya existen en la base de datos: {', '.join(duplicated)}"
+            )
+        quota = tenant_quota(tenant)
+        if len(existing_pdfs) + len(documents) > quota:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"El snapshot excede el cupo de {quota} PDFs del tenant"
+            )
+        
+        result = await run_in_threadpool(import_snapshot, directory, tenant=tenant)
+        logger.info(f"Snapshot importado en '{tenant}': {result['points']} puntos")
+        return {"message": "Snapshot importado correctamente", **result}
+    
+    except HTTPException:
+        raise
+    except SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importando snapshot: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno importando el snapshot"
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
 # ----------------- FUNCIONALIDADES OPCIONALES -----------------
+def _summary(pdf_name: str, tenant: str) -> dict:
+    # Verificar si el PDF existe
+    if not pdf_exists(pdf_name, tenant=tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"PDF '{pdf_name}' no encontrado en la base de datos"
+        )
+    
+    # Obtener chunks del PDF directamente
+    chunks = get_pdf_chunks(pdf_name, top_k=20, tenant=tenant)
+    if not chunks:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"No se encontraron chunks para el PDF '{pdf_name}'"
+        )
+    
+    full_text = " ".join(chunks)
+    summary = generate_answer("Resume el siguiente documento de manera clara y concisa:", [full_text])
+    
+    logger.info(f"Resumen generado para: {pdf_name} - {len(chunks)} chunks usados")
+    return {
+        "pdf": pdf_name,
+        "summary": summary,
+        "chunks_used": len(chunks),
+        "total_chars": len(full_text)
+    }
+
 @app.get("/summary/{pdf_name}", tags=["Análisis"])
-def summarize_pdf(pdf_name: str):
+def summarize_pdf(pdf_name: str, tenant: str = Depends(get_tenant)):
     """Generar resumen de un PDF específico"""
     try:
         if not pdf_name:
@@ -365,32 +1279,9 @@ def summarize_pdf(pdf_name: str):
                 detail="Nombre del PDF requerido"
             )
         
-        # Verificar si el PDF existe
-        existing_pdfs = list_pdfs()
-        if pdf_name not in existing_pdfs:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"PDF '{pdf_name}' no encontrado en la base de datos"
-            )
-        
-        # Obtener chunks del PDF directamente
-        chunks = get_pdf_chunks(pdf_name, top_k=20)
-        if not chunks:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"No se encontraron chunks para el PDF '{pdf_name}'"
-            )
-        
-        full_text = " ".join(chunks)
-        summary = generate_answer("Resume el siguiente documento de manera clara y concisa:", [full_text])
-        
-        logger.info(f"Resumen generado para: {pdf_name} - {len(chunks)} chunks usados")
-        return {
-            "pdf": pdf_name,
-            "summary": summary,
-            "chunks_used": len(chunks),
-            "total_chars": len(full_text)
-        }
+        # Varios "Resumen" simultáneos del mismo documento esperan al primero
+        return analysis_flights.do(flight_key("summary", tenant, pdf_name),
+                                   lambda: _summary(pdf_name, tenant))
         
     except HTTPException:
         raise
@@ -401,58 +1292,61 @@ def summarize_pdf(pdf_name: str):
             detail="Error interno generando el resumen"
         )
 
+def _comparison(pdf_a: str, pdf_b: str, tenant: str) -> dict:
+    # Verificar si los PDFs existen
+    if not pdf_exists(pdf_a, tenant=tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"PDF '{pdf_a}' no existe en la base de datos"
+        )
+    
+    if not pdf_exists(pdf_b, tenant=tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"PDF '{pdf_b}' no existe en la base de datos"
+        )
+    
+    # Obtener chunks de ambos PDFs directamente
+    chunks_a = get_pdf_chunks(pdf_a, top_k=15, tenant=tenant)
+    chunks_b = get_pdf_chunks(pdf_b, top_k=15, tenant=tenant)
+    
+    if not chunks_a:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"No se encontraron chunks para el PDF '{pdf_a}'"
+        )
+    
+    if not chunks_b:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"No se encontraron chunks para el PDF '{pdf_b}'"
+        )
+    
+    text_a = " ".join(chunks_a)
+    text_b = " ".join(chunks_b)
+    
+    comparison = generate_answer(
+        f"Documento 1 ({pdf_a}):\n{text_a}\n\n"
+        f"Documento 2 ({pdf_b}):\n{text_b}\n\n"
+        "Compara ambos documentos resaltando diferencias y similitudes de manera estructurada.",
+        []
+    )
+    
+    logger.info(f"Comparación generada entre: {pdf_a} y {pdf_b}")
+    return {
+        "comparison": comparison,
+        "pdf1": pdf_a,
+        "pdf2": pdf_b,
+        "chunks_pdf1": len(chunks_a),
+        "chunks_pdf2": len(chunks_b)
+    }
+
 @app.post("/compare", tags=["Análisis"])
-def compare_pdfs(req: CompareRequest):
+def compare_pdfs(req: CompareRequest, tenant: str = Depends(get_tenant)):
     """Comparar dos PDFs"""
     try:
-        # Verificar si los PDFs existen
-        existing_pdfs = list_pdfs()
-        if req.pdfs[0] not in existing_pdfs:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"PDF '{req.pdfs[0]}' no existe en la base de datos"
-            )
-        
-        if req.pdfs[1] not in existing_pdfs:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"PDF '{req.pdfs[1]}' no existe en la base de datos"
-            )
-        
-        # Obtener chunks de ambos PDFs directamente
-        chunks_a = get_pdf_chunks(req.pdfs[0], top_k=15)
-        chunks_b = get_pdf_chunks(req.pdfs[1], top_k=15)
-        
-        if not chunks_a:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"No se encontraron chunks para el PDF '{req.pdfs[0]}'"
-            )
-        
-        if not chunks_b:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"No se encontraron chunks para el PDF '{req.pdfs[1]}'"
-            )
-        
-        text_a = " ".join(chunks_a)
-        text_b = " ".join(chunks_b)
-        
-        comparison = generate_answer(
-            f"Documento 1 ({req.pdfs[0]}):\n{text_a}\n\n"
-            f"Documento 2 ({req.pdfs[1]}):\n{text_b}\n\n"
-            "Compara ambos documentos resaltando diferencias y similitudes de manera estructurada.",
-            []
-        )
-        
-        logger.info(f"Comparación generada entre: {req.pdfs[0]} y {req.pdfs[1]}")
-        return {
-            "comparison": comparison,
-            "pdf1": req.pdfs[0],
-            "pdf2": req.pdfs[1],
-            "chunks_pdf1": len(chunks_a),
-            "chunks_pdf2": len(chunks_b)
-        }
+        return analysis_flights.do(flight_key("compare", tenant, req.pdfs[0], req.pdfs[1]),
+                                   lambda: _comparison(req.pdfs[0], req.pdfs[1], tenant))
         
     except HTTPException:
         raise
@@ -463,8 +1357,42 @@ def compare_pdfs(req: CompareRequest):
             detail="Error interno comparando documentos"
         )
 
+def _classification(pdf_name: str, tenant: str) -> dict:
+    # Verificar si el PDF existe
+    if not pdf_exists(pdf_name, tenant=tenant):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"PDF '{pdf_name}' no encontrado en la base de datos"
+        )
+    
+    # Obtener chunks del PDF directamente
+    chunks = get_pdf_chunks(pdf_name, top_k=10, tenant=tenant)
+    if not chunks:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"No se encontraron chunks para el PDF '{pdf_name}'"
+        )
+    
+    topics = []
+    for i, c in enumerate(chunks[:10]):  # Limitar a 10 chunks para evitar costos altos
+        topic = generate_answer(
+            "Clasifica el siguiente texto en un tema principal y uno secundario. Responde solo con los temas separados por coma:",
+            [c]
+        )
+        topics.append({
+            "chunk_index": i + 1,
+            "topics": topic
+        })
+    
+    logger.info(f"Clasificación generada para: {pdf_name}")
+    return {
+        "pdf": pdf_name,
+        "topics": topics,
+        "chunks_analyzed": len(topics)
+    }
+
 @app.get("/classify/{pdf_name}", tags=["Análisis"])
-def classify_pdf(pdf_name: str):
+def classify_pdf(pdf_name: str, tenant: str = Depends(get_tenant)):
     """Clasificar temas de un PDF específico"""
     try:
         if not pdf_name:
@@ -473,39 +1401,8 @@ def classify_pdf(pdf_name: str):
                 detail="Nombre del PDF requerido"
             )
         
-        # Verificar si el PDF existe
-        existing_pdfs = list_pdfs()
-        if pdf_name not in existing_pdfs:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"PDF '{pdf_name}' no encontrado en la base de datos"
-            )
-        
-        # Obtener chunks del PDF directamente
-        chunks = get_pdf_chunks(pdf_name, top_k=10)
-        if not chunks:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"No se encontraron chunks para el PDF '{pdf_name}'"
-            )
-        
-        topics = []
-        for i, c in enumerate(chunks[:10]):  # Limitar a 10 chunks para evitar costos altos
-            topic = generate_answer(
-                "Clasifica el siguiente texto en un tema principal y uno secundario. Responde solo con los temas separados por coma:",
-                [c]
-            )
-            topics.append({
-                "chunk_index": i + 1,
-                "topics": topic
-            })
-        
-        logger.info(f"Clasificación generada para: {pdf_name}")
-        return {
-            "pdf": pdf_name,
-            "topics": topics,
-            "chunks_analyzed": len(topics)
-        }
+        return analysis_flights.do(flight_key("classify", tenant, pdf_name),
+                                   lambda: _classification(pdf_name, tenant))
         
     except HTTPException:
         raise
@@ -516,6 +1413,37 @@ def classify_pdf(pdf_name: str):
             detail="Error interno clasificando el documento"
         )
 
+# ----------------- ADMINISTRACIÓN -----------------
+@app.post("/admin/migration", status_code=status.HTTP_202_ACCEPTED, tags=["Administración"])
+def start_embedding_migration(request: MigrationRequest, x_admin_token: Optional[str] = Header(None)):
+    """Migrar el índice a otro modelo de embeddings en segundo plano, sin cortar las búsquedas"""
+    _require_admin(x_admin_token)
+    try:
+        return start_migration(request.model, request.vector_size, "pdf_chunks")
+    except MigrationError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@app.get("/admin/migration", tags=["Administración"])
+def get_embedding_migration(x_admin_token: Optional[str] = Header(None)):
+    """Progreso de la migración de embeddings: chunks procesados, ritmo y tiempo restante"""
+    _require_admin(x_admin_token)
+    result = migration_status("pdf_chunks")
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No hay migraciones registradas"
+        )
+    return result
+
+@app.delete("/admin/migration", tags=["Administración"])
+def cancel_embedding_migration(x_admin_token: Optional[str] = Header(None)):
+    """Cancelar la migración en curso (antes del cambio de índice) y borrar la colección sombra"""
+    _require_admin(x_admin_token)
+    try:
+        return cancel_migration("pdf_chunks")
+    except MigrationError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
 # ----------------- MANEJADOR DE EXCEPCIONES GLOBAL -----------------
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -0,0 +1,182 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from anyio import to_thread
+from prometheus_client import (
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Buckets pensados para etapas que van de milisegundos (búsqueda) a decenas de segundos (ingesta)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- Latencias ---
+STAGE_LATENCY = Histogram(
+    "copiloto_stage_duration_seconds",
+    "Duración de cada etapa del pipeline (extracción, chunking, embeddings, Qdrant, chat)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_LATENCY = Histogram(
+    "copiloto_http_request_duration_seconds",
+    "Duración de las peticiones HTTP por ruta",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_WAIT = Histogram(
+    "copiloto_admission_wait_seconds",
+    "Espera en la cola de admisión antes de ejecutar la petición, por pool",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# --- Contadores ---
+EMBEDDING_CACHE = Counter(
+    "copiloto_embedding_cache_total",
+    "Consultas al cache de embeddings",
+    ["result"],
+)
+OPENAI_RETRIES = Counter(
+    "copiloto_openai_retries_total",
+    "Reintentos de llamadas a OpenAI",
+    ["operation"],
+)
+OPENAI_RATE_LIMITED = Counter(
+    "copiloto_openai_rate_limited_total",
+    "Respuestas 429 recibidas de OpenAI",
+    ["operation"],
+)
+OPENAI_TOKENS = Counter(
+    "copiloto_openai_tokens_total",
+    "Tokens facturados según el campo usage de las respuestas de OpenAI",
+    ["model", "kind"],
+)
+SINGLE_FLIGHT = Counter(
+    "copiloto_single_flight_total",
+    "Llamadas por grupo de single-flight: ejecutadas (leader) o que compartieron una en curso (shared)",
+    ["group", "result"],
+)
+JOBS = Counter(
+    "copiloto_jobs_total",
+    "Trabajos de la cola procesados por los workers (succeeded, retried, failed)",
+    ["kind", "result"],
+)
+ADMISSION_REJECTED = Counter(
+    "copiloto_admission_rejected_total",
+    "Peticiones rechazadas por el control de admisión (cola llena o espera agotada)",
+    ["pool", "reason"],
+)
+
+# --- Gauges ---
+IN_FLIGHT = Gauge(
+    "copiloto_http_requests_in_flight",
+    "Peticiones HTTP en curso",
+)
+QUEUE_DEPTH = Gauge(
+    "copiloto_queue_depth",
+    "Tareas esperando en cada cola",
+    ["queue"],
+)
+WORKERS_BUSY = Gauge(
+    "copiloto_workers_busy",
+    "Workers ocupados en cada pool",
+    ["pool"],
+)
+
+# Etapas conocidas (inicializadas para que aparezcan en /metrics desde el arranque)
+STAGES = (
+    "pdf_extraction",
+    "chunking",
+    "embedding",
+    "qdrant_upsert",
+    "qdrant_search",
+    "qdrant_summary_search",
+    "rerank",
+    "qdrant_scroll",
+    "qdrant_metadata",
+    "qdrant_delete",
+    "chat_completion",
+    "chat_first_token",
+    "rate_limit_wait",
+    "job",
+)
+for _stage in STAGES:
+    STAGE_LATENCY.labels(stage=_stage)
+for _result in ("hit", "miss"):
+    EMBEDDING_CACHE.labels(result=_result)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """
+    Mide la duración de un bloque y la registra en el histograma de etapas.
+
+    También registra un span en el trace de la petición actual, de modo que
+    la misma etapa aparece en /metrics y en la cabecera Server-Timing.
+
+    Args:
+        stage: Nombre de la etapa (ver STAGES)
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def observe_duration(stage: str, seconds: float):
+    """Registra una duración medida fuera de este proceso (p. ej. en un pool de procesos)."""
+    STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
+
+def record_usage(model: str, usage: Optional[Any]):
+    """
+    Suma los tokens del campo ``usage`` de una respuesta de OpenAI.
+
+    Args:
+        model: Modelo usado en la llamada
+        usage: Objeto usage de la respuesta (puede ser None)
+    """
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    # Tokens del prompt servidos desde el cache de prefijos del proveedor (subconjunto de prompt)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    if prompt_tokens:
+        OPENAI_TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+    if cached_tokens:
+        OPENAI_TOKENS.labels(model=model, kind="cached_prompt").inc(cached_tokens)
+    if completion_tokens:
+        OPENAI_TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
+
+
+def observe_threadpool():
+    """
+    Ocupación y cola del threadpool de anyio, donde corren los endpoints síncronos.
+
+    Se llama desde el event loop al empezar y terminar cada petición HTTP y
+    en cada cambio de los pools de admisión, así el valor sigue la carga entre
+    scrapes; fuera de un event loop (p. ej. en los workers) no hace nada.
+    """
+    try:
+        stats = to_thread.current_default_thread_limiter().statistics()
+    except RuntimeError:
+        return
+    WORKERS_BUSY.labels(pool="threadpool").set(stats.borrowed_tokens)
+    QUEUE_DEPTH.labels(queue="threadpool").set(stats.tasks_waiting)
+
+
+def render_metrics() -> bytes:
+    """Serializa todas las métricas en formato de texto de Prometheus."""
+    return generate_latest()
@@ -0,0 +1,584 @@
+"""
+Migración del modelo de embeddings sin cortar el servicio.
+
+1. Se crea una colección sombra para el modelo nuevo y se registra como
+   índice sombra: desde ese momento las ingestas escriben en las dos.
+2. Un thread de fondo recorre el chunk store en orden de inserción y genera
+   los embeddings nuevos en lotes con prioridad BULK (el planificador de
+   rate limits atiende antes las consultas interactivas).
+3. Pasadas de reconciliación completan los puntos que falten: ingestas que
+   empezaron antes del registro, snapshots importados, escrituras fallidas.
+4. El índice sombra pasa a activo en una sola transacción; todas las
+   instancias del API buscan en la colección nueva en INDEX_REFRESH_S.
+5. Pasados MIGRATION_DROP_DELAY_S se borra la colección anterior.
+
+Las búsquedas usan el índice activo en todo momento. El estado se guarda en
+el chunk store: si el proceso se cae, la migración se reanuda desde el
+último lote al arrancar el API o al volver a pedirla.
+
+Uso:
+    python -m migration start MODELO [DIMENSIÓN]
+    python -m migration status
+    python -m migration cancel
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from qdrant_client.http import models
+from qdrant_client.http.models import PointStruct
+
+from embedding_index import SHADOW, EmbeddingIndex
+from hierarchy import summary_collection_name
+from metrics import observe_stage
+from rate_limiter import BULK
+from vector_utils import (
+    INDEX_REFRESH_S,
+    _upsert_points,
+    backfill_summaries,
+    close_clients,
+    create_collection_if_not_exists,
+    embedding_indexes,
+    embedding_provider_for,
+    get_chunk_store,
+    get_embeddings_batch,
+    get_qdrant,
+    qdrant_collections,
+)
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "256"))
+MIGRATION_CONCURRENCY = int(os.getenv("MIGRATION_CONCURRENCY", "2"))  # lotes de embeddings en paralelo
+MIGRATION_DROP_DELAY_S = float(os.getenv("MIGRATION_DROP_DELAY_S", "30"))
+# Sin noticias del proceso dueño durante este tiempo, otro proceso puede retomar la migración
+MIGRATION_LEASE_S = float(os.getenv("MIGRATION_LEASE_S", "120"))
+# Espera máxima a que Qdrant termine de indexar la colección sombra antes de activarla
+MIGRATION_INDEX_TIMEOUT_S = float(os.getenv("MIGRATION_INDEX_TIMEOUT_S", "1800"))
+MIGRATION_INDEX_POLL_S = 5
+MAX_RECONCILE_SWEEPS = 3
+
+RUNNING = "running"
+SWITCHED = "switched"
+COMPLETED = "completed"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+FAILED = "failed"
+LIVE = (RUNNING, SWITCHED, CANCELLING)
+
+PUBLIC_FIELDS = (
+    "status", "phase", "model", "vector_size", "collection", "previous", "done", "total",
+    "embedded", "chunks_per_s", "started_at", "switched_at", "finished_at", "error",
+)
+
+
+class MigrationError(ValueError):
+    """La migración no puede iniciarse o cancelarse en el estado actual."""
+
+
+def shadow_collection_name(name: str, model: str, vector_size: int) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", model.lower()).strip("_")
+    return f"{name}__{slug}_{vector_size}"
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _stale(state: Dict[str, Any]) -> bool:
+    return time.time() - state.get("heartbeat", 0) > MIGRATION_LEASE_S
+
+
+def _delete_collection(collection_name: str):
+    # Los vectores de resumen de la colección se van con ella
+    for name in (collection_name, summary_collection_name(collection_name)):
+        if qdrant_collections.exists(name):
+            with observe_stage("qdrant_delete"):
+                get_qdrant().delete_collection(name)
+        qdrant_collections.invalidate(name)
+    logger.info(f"Colección '{collection_name}' eliminada")
+
+
+class MigrationJob:
+    """
+    Ejecuta una migración en un thread de fondo.
+
+    Cada lote guarda el cursor, el progreso y un heartbeat; si al guardar
+    encuentra la migración cancelada desde otro proceso (o tomada por otro
+    dueño), se detiene.
+
+    Args:
+        name: Colección lógica que se migra
+        state: Estado persistido de la migración (ya reclamado por este proceso)
+    """
+
+    def __init__(self, name: str, state: Dict[str, Any]):
+        self.name = name
+        self.state = state
+        self.owner = state["owner"]
+        self._stop = threading.Event()
+        self._cancel_requested = False
+        self._thread: Optional[threading.Thread] = None
+        self._started = time.monotonic()
+        self._processed = 0
+
+    @property
+    def index(self) -> EmbeddingIndex:
+        return EmbeddingIndex(self.state["collection"], self.state["model"], self.state["vector_size"])
+
+    def start(self) -> "MigrationJob":
+        self._thread = threading.Thread(target=self._run, name=f"migration-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def cancel(self):
+        self._cancel_requested = True
+        self._stop.set()
+
+    def stop(self):
+        """Detiene el thread sin cancelar: la migración se reanuda más tarde."""
+        self._stop.set()
+
+    # --- Estado ---
+    def _save(self, force: bool = False, **changes) -> bool:
+        """
+        Persiste cambios del estado. Devuelve False (y detiene el job) si la
+        migración fue cancelada desde otro proceso o tiene otro dueño.
+        """
+        changes["heartbeat"] = time.time()
+
+        def update(state):
+            if state is None or state.get("owner") != self.owner:
+                return None
+            if state["status"] == CANCELLING and not force:
+                return None
+            return {**state, **changes}
+
+        saved = get_chunk_store().update_migration(self.name, update)
+        if saved is None:
+            current = get_chunk_store().get_migration(self.name) or {}
+            if current.get("owner") == self.owner and current.get("status") == CANCELLING:
+                self._cancel_requested = True
+            self._stop.set()
+            return False
+        self.state = saved
+        return True
+
+    def _wait(self, seconds: float):
+        """Espera interrumpible que mantiene vivo el heartbeat."""
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._save():
+                return
+            self._stop.wait(min(remaining, MIGRATION_LEASE_S / 4))
+
+    def _rate(self) -> float:
+        elapsed = time.monotonic() - self._started
+        return round(self._processed / elapsed, 1) if elapsed > 0 else 0.0
+
+    # --- Ejecución ---
+    def _run(self):
+        try:
+            if self.state["status"] == RUNNING:
+                self._backfill()
+                if not self._stop.is_set():
+                    # Resúmenes antes del cambio: la búsqueda jerárquica los necesita desde la primera consulta
+                    backfill_summaries(self.index)
+                    self._wait_indexed()
+                if not self._stop.is_set():
+                    self._switch()
+            if self.state["status"] == SWITCHED and not self._stop.is_set():
+                self._drop_previous()
+        except Exception as e:
+            logger.error(f"Migración de '{self.name}' falló: {e}")
+            self._fail(e)
+            return
+        if self._cancel_requested or self.state["status"] == CANCELLING:
+            self._cleanup_cancelled()
+        elif self._stop.is_set():
+            self._release()
+
+    def _release(self):
+        """Libera el lease al detenerse: otro proceso (o un reinicio) puede retomar enseguida."""
+        get_chunk_store().update_migration(
+            self.name,
+            lambda state: {**state, "heartbeat": 0} if state and state.get("owner") == self.owner else None
+        )
+
+    def _backfill(self):
+        shadow = self.index
+        create_collection_if_not_exists(shadow.collection, shadow.vector_size)
+        store = get_chunk_store()
+        store.set_index(self.name, SHADOW, shadow.collection, shadow.model, shadow.vector_size)
+        embedding_indexes.invalidate(self.name)
+        logger.info(f"Migrando '{self.name}' a {shadow.model} ({shadow.vector_size}) en '{shadow.collection}'")
+
+        with qdrant_collections.bulk_load(shadow.collection, shadow.vector_size):
+            if self.state["phase"] == "backfill":
+                self._sweep(shadow)
+                if self._stop.is_set() or not self._save(phase="reconcile", cursor=0, done=0):
+                    return
+            # Hasta INDEX_REFRESH_S después del registro, otras instancias pueden no escribir en el sombra
+            self._wait(INDEX_REFRESH_S)
+            for _ in range(MAX_RECONCILE_SWEEPS):
+                missing = self._sweep(shadow)
+                if self._stop.is_set() or not missing:
+                    return
+                logger.info(f"Reconciliación: {missing} puntos faltaban en '{shadow.collection}'")
+                if not self._save(cursor=0, done=0):
+                    return
+                self._wait(INDEX_REFRESH_S)
+
+    def _wait_indexed(self):
+        """
+        Espera a que Qdrant construya el índice HNSW de la colección sombra.
+
+        La carga masiva deja los vectores sin indexar hasta el final: activarla
+        antes haría que las primeras búsquedas recorran la colección completa.
+        """
+        shadow = self.index
+        if not self._save(phase="indexing"):
+            return
+        deadline = time.monotonic() + MIGRATION_INDEX_TIMEOUT_S
+        while not self._stop.is_set():
+            if qdrant_collections.is_indexed(shadow.collection, shadow.vector_size):
+                return
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    f"'{shadow.collection}' sigue sin indexar tras {MIGRATION_INDEX_TIMEOUT_S:.0f}s, "
+                    "se activa de todos modos"
+                )
+                return
+            self._wait(MIGRATION_INDEX_POLL_S)
+
+    def _sweep(self, shadow: EmbeddingIndex) -> int:
+        """Recorre el chunk store desde el cursor guardado. Devuelve cuántos puntos faltaban."""
+        store = get_chunk_store()
+        cursor = self.state["cursor"]
+        missing = 0
+        if not self._save(total=store.count_chunks()):
+            return 0
+        with ThreadPoolExecutor(max_workers=MIGRATION_CONCURRENCY) as pool:
+            while not self._stop.is_set():
+                pages = []
+                while len(pages) < MIGRATION_CONCURRENCY:
+                    rows = store.chunks_after(cursor, MIGRATION_BATCH_SIZE)
+                    if not rows:
+                        break
+                    pages.append(rows)
+                    cursor = rows[-1][0]
+                if not pages:
+                    break
+                found = sum(pool.map(partial(self._migrate_rows, shadow), pages))
+                processed = sum(len(rows) for rows in pages)
+                missing += found
+                self._processed += processed
+                if not self._save(cursor=cursor, done=self.state["done"] + processed,
+                                  embedded=self.state["embedded"] + found, chunks_per_s=self._rate()):
+                    break
+        return missing
+
+    def _migrate_rows(self, shadow: EmbeddingIndex, rows: List[Tuple[int, str, str, str, str]]) -> int:
+        """Genera y sube los vectores que faltan en el índice sombra para una página de chunks."""
+        ids = [point_id for _, point_id, _, _, _ in rows]
+        with observe_stage("qdrant_metadata"):
+            existing = {
+                str(p.id) for p in get_qdrant().retrieve(
+                    shadow.collection, ids=ids, with_payload=False, with_vectors=False
+                )
+            }
+        pending = [row for row in rows if row[1] not in existing]
+        if not pending:
+            return 0
+
+        embeddings = get_embeddings_batch(
+            [text for _, _, _, _, text in pending], priority=BULK, index=shadow, use_cache=False
+        )
+        _upsert_points(shadow.collection, [
+            PointStruct(id=point_id, vector=embedding, payload={"tenant": tenant, "doc": doc})
+            for (_, point_id, tenant, doc, _), embedding in zip(pending, embeddings)
+        ])
+        # Un documento borrado mientras se generaban los embeddings no debe dejar puntos huérfanos
+        texts = get_chunk_store().get_texts([row[1] for row in pending])
+        orphans = [row[1] for row in pending if row[1] not in texts]
+        if orphans:
+            with observe_stage("qdrant_delete"):
+                get_qdrant().delete(shadow.collection, points_selector=models.PointIdsList(points=orphans))
+        return len(pending)
+
+    def _switch(self):
+        get_chunk_store().promote_shadow(self.name)
+        embedding_indexes.invalidate(self.name)
+        self._save(status=SWITCHED, switched_at=_now())
+        logger.info(f"'{self.name}' busca ahora en '{self.state['collection']}' ({self.state['model']})")
+
+    def _drop_previous(self):
+        # Las demás instancias cambian en INDEX_REFRESH_S; se da margen a las búsquedas en curso
+        self._wait(max(MIGRATION_DROP_DELAY_S, INDEX_REFRESH_S))
+        if self._stop.is_set():
+            return
+        previous = self.state["previous"]
+        if previous != self.state["collection"]:
+            _delete_collection(previous)
+        self._save(status=COMPLETED, phase=None, finished_at=_now())
+        logger.info(f"Migración de '{self.name}' completada en {time.monotonic() - self._started:.0f}s")
+
+    def _fail(self, error: Exception):
+        # Sin índice sombra las ingestas dejan de pagar la doble escritura; la colección
+        # y el cursor se conservan para reanudar
+        if self.state["status"] == RUNNING:
+            get_chunk_store().delete_index(self.name, SHADOW)
+            embedding_indexes.invalidate(self.name)
+        self._save(force=True, status=FAILED, error=str(error), finished_at=_now())
+
+    def _cleanup_cancelled(self):
+        get_chunk_store().delete_index(self.name, SHADOW)
+        embedding_indexes.invalidate(self.name)
+        # Las escrituras que todavía ven el índice sombra fallan sin afectar la ingesta
+        time.sleep(min(INDEX_REFRESH_S, MIGRATION_LEASE_S / 4))
+        _delete_collection(self.state["collection"])
+        self._save(force=True, status=CANCELLED, phase=None, finished_at=_now())
+        logger.info(f"Migración de '{self.name}' cancelada")
+
+
+# Jobs que corren en este proceso
+_jobs: Dict[str, MigrationJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _claim(name: str, observed: Optional[Dict[str, Any]], new_state: Dict[str, Any]):
+    """Escribe ``new_state`` solo si nadie modificó el estado desde que se leyó."""
+    def update(current):
+        if (current or {}).get("owner") != (observed or {}).get("owner") \
+                or (current or {}).get("heartbeat") != (observed or {}).get("heartbeat"):
+            raise MigrationError("Otra instancia modificó la migración al mismo tiempo, reintentar")
+        return new_state
+    get_chunk_store().update_migration(name, update)
+
+
+def _cleanup_leftovers(name: str, state: Dict[str, Any]):
+    """Termina lo que dejó a medias una migración abandonada por su proceso."""
+    if state["status"] == SWITCHED:
+        if state["previous"] != state["collection"]:
+            _delete_collection(state["previous"])
+        return
+    if state["status"] in (RUNNING, FAILED, CANCELLING):
+        shadow = embedding_indexes.shadow(name)
+        if shadow is not None and shadow.collection == state["collection"]:
+            get_chunk_store().delete_index(name, SHADOW)
+            embedding_indexes.invalidate(name)
+        if state["collection"] != embedding_indexes.active(name).collection:
+            _delete_collection(state["collection"])
+
+
+def _launch(name: str, state: Dict[str, Any]) -> MigrationJob:
+    with _jobs_lock:
+        job = MigrationJob(name, state)
+        _jobs[name] = job
+    return job.start()
+
+
+def start_migration(model: str, vector_size: Optional[int] = None,
+                    collection_name: str = "pdf_chunks") -> Dict[str, Any]:
+    """
+    Inicia (o reanuda) la migración de una colección a otro modelo de embeddings.
+
+    Args:
+        model: Modelo de destino (de OpenAI, "local:<modelo>" o "hashing")
+        vector_size: Dimensión de los vectores (None = la que declara el proveedor)
+        collection_name: Colección lógica a migrar
+
+    Returns:
+        Estado de la migración
+    """
+    if not model or (vector_size is not None and vector_size <= 0):
+        raise MigrationError("Se requieren el modelo y una dimensión positiva")
+    try:
+        vector_size = embedding_provider_for(model, vector_size).dimensions
+    except (ValueError, RuntimeError) as e:
+        raise MigrationError(str(e))
+    embedding_indexes.invalidate(collection_name)
+    active = embedding_indexes.active(collection_name)
+    if (active.model, active.vector_size) == (model, vector_size):
+        raise MigrationError(f"'{collection_name}' ya usa {model} con {vector_size} dimensiones")
+
+    state = get_chunk_store().get_migration(collection_name)
+    if state is not None and state["status"] in LIVE and not _stale(state):
+        raise MigrationError(f"Ya hay una migración de '{collection_name}' en curso ({state['status']})")
+
+    owner = uuid.uuid4().hex
+    resume = state is not None and state["status"] in (RUNNING, FAILED) \
+        and (state["model"], state["vector_size"]) == (model, vector_size)
+    if resume:
+        new_state = {**state, "status": RUNNING, "error": None, "finished_at": None}
+    else:
+        new_state = {
+            "status": RUNNING,
+            "phase": "backfill",
+            "model": model,
+            "vector_size": vector_size,
+            "collection": shadow_collection_name(collection_name, model, vector_size),
+            "previous": active.collection,
+            "cursor": 0,
+            "done": 0,
+            "total": 0,
+            "embedded": 0,
+            "chunks_per_s": 0.0,
+            "started_at": _now(),
+            "switched_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+    new_state.update(owner=owner, heartbeat=time.time())
+    _claim(collection_name, state, new_state)
+    if state is not None and not resume:
+        _cleanup_leftovers(collection_name, state)
+
+    _launch(collection_name, new_state)
+    logger.info(f"Migración de '{collection_name}' {'reanudada' if resume else 'iniciada'}: {model} ({vector_size})")
+    return migration_status(collection_name)
+
+
+def resume_migrations(collection_name: str = "pdf_chunks") -> bool:
+    """
+    Retoma una migración cuyo proceso dueño dejó de dar señales (p. ej. tras un reinicio).
+
+    Returns:
+        True si se retomó una migración
+    """
+    state = get_chunk_store().get_migration(collection_name)
+    if state is None or state["status"] not in LIVE or not _stale(state):
+        return False
+    new_state = {**state, "owner": uuid.uuid4().hex, "heartbeat": time.time()}
+    try:
+        _claim(collection_name, state, new_state)
+    except MigrationError:
+        return False
+    _launch(collection_name, new_state)
+    logger.info(f"Migración de '{collection_name}' retomada ({state['status']})")
+    return True
+
+
+def cancel_migration(collection_name: str = "pdf_chunks") -> Dict[str, Any]:
+    """
+    Cancela una migración antes del cambio de índice y borra la colección sombra.
+
+    Returns:
+        Estado de la migración
+    """
+    state = get_chunk_store().get_migration(collection_name)
+    if state is None or state["status"] not in (RUNNING, FAILED):
+        raise MigrationError(f"No hay una migración de '{collection_name}' que se pueda cancelar")
+
+    job = _jobs.get(collection_name)
+    if job is not None and job.alive() and job.owner == state["owner"]:
+        job.cancel()
+    elif state["status"] == RUNNING and not _stale(state):
+        # La ejecuta otro proceso: se entera en su próximo lote y limpia él mismo
+        def request_cancel(current):
+            if current is None or current.get("owner") != state["owner"]:
+                return None
+            return {**current, "status": CANCELLING}
+        get_chunk_store().update_migration(collection_name, request_cancel)
+    else:
+        new_state = {**state, "status": CANCELLED, "phase": None, "finished_at": _now(),
+                     "owner": uuid.uuid4().hex, "heartbeat": time.time()}
+        _claim(collection_name, state, new_state)
+        _cleanup_leftovers(collection_name, state)
+    return migration_status(collection_name)
+
+
+def stop_migrations(timeout: float = 5.0):
+    """Detiene los jobs de este proceso sin cancelarlos (al apagar el API)."""
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    for job in jobs:
+        job.stop()
+    for job in jobs:
+        job.join(timeout)
+
+
+def migration_status(collection_name: str = "pdf_chunks") -> Optional[Dict[str, Any]]:
+    """
+    Estado de la última migración de la colección, con porcentaje y tiempo restante estimado.
+
+    Returns:
+        Diccionario de estado, o None si la colección nunca se migró
+    """
+    state = get_chunk_store().get_migration(collection_name)
+    if state is None:
+        return None
+    status = {field: state.get(field) for field in PUBLIC_FIELDS}
+    done, total, rate = state.get("done", 0), state.get("total", 0), state.get("chunks_per_s") or 0
+    status["percent"] = round(100 * min(done, total) / total, 1) if total else 0.0
+    status["eta_s"] = round((total - done) / rate) if state["status"] == RUNNING and rate and total > done else None
+    status["stale"] = state["status"] in LIVE and _stale(state)
+    status["active_index"] = asdict(embedding_indexes.active(collection_name))
+    return status
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migrar el índice a otro modelo de embeddings")
+    parser.add_argument("--collection", default="pdf_chunks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    start_parser = sub.add_parser("start", help="Iniciar o reanudar una migración y esperar a que termine")
+    start_parser.add_argument("model")
+    start_parser.add_argument("vector_size", type=int, nargs="?",
+                              help="Dimensión (por defecto, la que declara el modelo)")
+    sub.add_parser("status", help="Mostrar el progreso")
+    sub.add_parser("cancel", help="Cancelar la migración en curso")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        if args.command == "start":
+            start_migration(args.model, args.vector_size, args.collection)
+            job = _jobs[args.collection]
+            while job.alive():
+                job.join(10)
+                status = migration_status(args.collection)
+                logger.info(f"{status['status']} ({status['phase']}): {status['done']}/{status['total']} "
+                            f"chunks, {status['chunks_per_s']}/s, ETA {status['eta_s']}s")
+            result = migration_status(args.collection)
+        elif args.command == "cancel":
+            result = cancel_migration(args.collection)
+            job = _jobs.get(args.collection)
+            if job is not None:
+                job.join()
+                result = migration_status(args.collection)
+        else:
+            result = migration_status(args.collection)
+    except MigrationError as e:
+        logger.error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        stop_migrations()
+        logger.info("Migración detenida: se reanuda repitiendo el mismo comando")
+        return 1
+    finally:
+        close_clients()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0 if result is None or result["status"] != FAILED else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,39 @@
 import os
 import logging
+import mmap
 import re
-from typing import List, Dict, Optional
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Dict, Optional, Tuple, Union
 from PyPDF2 import PdfReader
 from PyPDF2.errors import PdfReadError
 
+from dedup import DEDUP_ENABLED, dedup_report, dedupe_chunks, strip_boilerplate
+
 logger = logging.getLogger(__name__)
 
+# Tamaño de los chunks y superposición entre chunks consecutivos (caracteres)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+@contextmanager
+def open_pdf_stream(file_path: str) -> Iterator[Union[mmap.mmap, BinaryIO]]:
+    """
+    Abre un PDF para PdfReader sin cargarlo entero en memoria.
+    
+    Con una ruta, PdfReader lee el archivo completo a un BytesIO; con un
+    mmap lee directo de la page cache del sistema. Si el archivo no se puede
+    mapear (p. ej. está vacío) se usa el archivo abierto.
+    """
+    with open(file_path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            yield f
+            return
+        with mapped:
+            yield mapped
+
 def extract_text_from_pdf(file_path: str) -> List[Dict[str, any]]:
     """
     Extrae texto de un archivo PDF con manejo robusto de errores y metadatos.
@@ -26,43 +53,44 @@ def extract_text_from_pdf(file_path: str) -> List[Dict[str, any]]:
         if not file_path.lower().endswith('.pdf'):
             raise ValueError(f"El archivo {file_path} no es un PDF válido")
         
-        reader = PdfReader(file_path)
-        
-        # Verificar si el PDF está encriptado
-        if reader.is_encrypted:
-            raise ValueError("El PDF está encriptado y no se puede procesar")
-        
-        # Extraer metadatos
-        metadata = reader.metadata
-        title = metadata.get('/Title', 'Sin título') if metadata else 'Sin título'
-        author = metadata.get('/Author', 'Autor desconocido') if metadata else 'Autor desconocido'
-        
-        logger.info(f"Procesando PDF: {title} por {author} - {len(reader.pages)} páginas")
-        
-        text_by_page = []
-        for i, page in enumerate(reader.pages):
-            try:
-                text = page.extract_text()
-                if text and text.strip():
-                    # Limpiar y normalizar texto
-                    cleaned_text = clean_text(text)
-                    if cleaned_text:
-                        text_by_page.append({
-                            "page": i + 1,
-                            "text": cleaned_text,
-                            "title": title,
-                            "author": author,
-                            "char_count": len(cleaned_text)
-                        })
-                        logger.debug(f"Página {i + 1}: {len(cleaned_text)} caracteres")
-                else:
-                    logger.warning(f"Página {i + 1}: Sin texto extraíble")
-            except Exception as e:
-                logger.error(f"Error procesando página {i + 1}: {e}")
-                continue
-        
-        if not text_by_page:
-            raise ValueError("No se pudo extraer texto del PDF")
+        with open_pdf_stream(file_path) as stream:
+            reader = PdfReader(stream)
+        
+            # Verificar si el PDF está encriptado
+            if reader.is_encrypted:
+                raise ValueError("El PDF está encriptado y no se puede procesar")
+        
+            # Extraer metadatos
+            metadata = reader.metadata
+            title = metadata.get('/Title', 'Sin título') if metadata else 'Sin título'
+            author = metadata.get('/Author', 'Autor desconocido') if metadata else 'Autor desconocido'
+        
+            logger.info(f"Procesando PDF: {title} por {author} - {len(reader.pages)} páginas")
+        
+            text_by_page = []
+            for i, page in enumerate(reader.pages):
+                try:
+                    text = page.extract_text()
+                    if text and text.strip():
+                        # Limpiar y normalizar texto
+                        cleaned_text = clean_text(text)
+                        if cleaned_text:
+                            text_by_page.append({
+                                "page": i + 1,
+                                "text": cleaned_text,
+                                "title": title,
+                                "author": author,
+                                "char_count": len(cleaned_text)
+                            })
+                            logger.debug(f"Página {i + 1}: {len(cleaned_text)} caracteres")
+                    else:
+                        logger.warning(f"Página {i + 1}: Sin texto extraíble")
+                except Exception as e:
+                    logger.error(f"Error procesando página {i + 1}: {e}")
+                    continue
+        
+            if not text_by_page:
+                raise ValueError("No se pudo extraer texto del PDF")
         
         logger.info(f"Extracción completada: {len(text_by_page)} páginas con texto")
         return text_by_page
@@ -102,7 +130,7 @@ def clean_text(text: str) -> str:
     
     return text
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """
     Divide el texto en chunks inteligentes respetando la estructura natural.
     
@@ -196,6 +224,80 @@ def apply_overlap(chunks: List[str], overlap: int) -> List[str]:
     
     return overlapped_chunks
 
+def build_chunks(pages: List[Dict[str, any]], doc_name: str,
+                 chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Dict[str, any]]:
+    """
+    Divide las páginas extraídas en chunks listos para almacenar.
+    
+    Args:
+        pages: Páginas devueltas por extract_text_from_pdf
+        doc_name: Nombre del documento (se guarda en el campo "doc")
+        chunk_size: Tamaño máximo del chunk
+        overlap: Superposición entre chunks
+        
+    Returns:
+        Lista de diccionarios con doc, page y chunk
+    """
+    all_chunks = []
+    for page in pages:
+        for c in chunk_text(page["text"], chunk_size, overlap):
+            all_chunks.append({
+                "doc": doc_name,
+                "page": page["page"],
+                "chunk": c
+            })
+    return all_chunks
+
+def prepare_chunks(pages: List[Dict[str, any]], doc_name: str,
+                   dedup: bool = DEDUP_ENABLED) -> Tuple[List[Dict[str, any]], Optional[Dict[str, any]]]:
+    """
+    Divide las páginas en chunks quitando boilerplate y chunks casi duplicados.
+    
+    Los chunks representativos llevan en "pages" las páginas de todos los
+    chunks que reemplazan.
+    
+    Args:
+        pages: Páginas devueltas por extract_text_from_pdf
+        doc_name: Nombre del documento
+        dedup: False para dividir sin limpieza (igual que build_chunks)
+        
+    Returns:
+        Tupla (chunks, resumen de la reducción o None si no se deduplicó)
+    """
+    if not dedup:
+        return build_chunks(pages, doc_name), None
+    
+    chunks_before = sum(len(chunk_text(page["text"])) for page in pages)
+    cleaned, boilerplate_lines = strip_boilerplate(pages)
+    chunks, near_duplicates = dedupe_chunks(build_chunks(cleaned, doc_name))
+    report = dedup_report(chunks_before, len(chunks), boilerplate_lines, near_duplicates)
+    if report["chunks_after"] < chunks_before:
+        logger.info(f"{doc_name}: {chunks_before} -> {len(chunks)} chunks ({report['reduction_pct']}% menos)")
+    return chunks, report
+
+def process_pdf(file_path: str, doc_name: str) -> Dict[str, any]:
+    """
+    Extrae y divide en chunks un PDF. Pensada para ejecutarse en un pool de procesos.
+    
+    Args:
+        file_path: Ruta al archivo PDF
+        doc_name: Nombre del documento
+        
+    Returns:
+        Diccionario con número de páginas, chunks y duración de cada etapa
+    """
+    start = time.perf_counter()
+    pages = extract_text_from_pdf(file_path)
+    extracted = time.perf_counter()
+    chunks, dedup = prepare_chunks(pages, doc_name)
+    return {
+        "num_pages": len(pages),
+        "chunks": chunks,
+        "dedup": dedup,
+        "extraction_s": extracted - start,
+        "chunking_s": time.perf_counter() - extracted
+    }
+
 def get_pdf_metadata(file_path: str) -> Dict[str, any]:
     """
     Extrae metadatos del PDF sin procesar el contenido completo.
@@ -207,18 +309,19 @@ def get_pdf_metadata(file_path: str) -> Dict[str, any]:
         Diccionario con metadatos del PDF
     """
     try:
-        reader = PdfReader(file_path)
-        metadata = reader.metadata or {}
-        
-        return {
-            "title": metadata.get('/Title', 'Sin título'),
-            "author": metadata.get('/Author', 'Autor desconocido'),
-            "subject": metadata.get('/Subject', ''),
-            "creator": metadata.get('/Creator', ''),
-            "producer": metadata.get('/Producer', ''),
-            "pages": len(reader.pages),
-            "is_encrypted": reader.is_encrypted
-        }
+        with open_pdf_stream(file_path) as stream:
+            reader = PdfReader(stream)
+            metadata = reader.metadata or {}
+            
+            return {
+                "title": metadata.get('/Title', 'Sin título'),
+                "author": metadata.get('/Author', 'Autor desconocido'),
+                "subject": metadata.get('/Subject', ''),
+                "creator": metadata.get('/Creator', ''),
+                "producer": metadata.get('/Producer', ''),
+                "pages": len(reader.pages),
+                "is_encrypted": reader.is_encrypted
+            }
     except Exception as e:
         logger.error(f"Error obteniendo metadatos de {file_path}: {e}")
         return {}
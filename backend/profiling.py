@@ -0,0 +1,93 @@
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "copiloto_profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SamplingProfiler:
+    """
+    Profiler de muestreo para una sola petición.
+
+    Un thread en segundo plano toma el stack de los threads registrados cada
+    ``interval`` segundos y acumula los stacks en formato "folded" (compatible
+    con flamegraph.pl y speedscope).
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.threads: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, ident: int):
+        self.threads.add(ident)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    def folded(self) -> str:
+        """Perfil en formato folded: una línea 'f1;f2;f3 muestras' por stack."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def save_profile(profiler: SamplingProfiler) -> str:
+    """
+    Guarda el perfil en PROFILE_DIR.
+
+    Returns:
+        Identificador del perfil
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), "w") as f:
+        f.write(profiler.folded())
+    logger.info(f"Perfil {profile_id} guardado: {sum(profiler.samples.values())} muestras")
+    return profile_id
+
+
+def load_profile(profile_id: str) -> Optional[str]:
+    """Lee un perfil guardado; None si el id no es válido o no existe."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read()
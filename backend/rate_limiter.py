@@ -0,0 +1,234 @@
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+
+from metrics import QUEUE_DEPTH, observe_stage
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Convierte duraciones como las de ``x-ratelimit-reset-*`` ("1s", "6m0s", "20ms") a segundos.
+    """
+    if not value:
+        return None
+    matches = DURATION_RE.findall(value)
+    if not matches:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Lee el tiempo de espera indicado por el servidor en una respuesta 429.
+
+    Soporta ``retry-after-ms``, ``retry-after`` (segundos o fecha HTTP) y, como
+    último recurso, los ``x-ratelimit-reset-*`` de OpenAI.
+    """
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    resets = [
+        parse_duration(headers.get("x-ratelimit-reset-requests")),
+        parse_duration(headers.get("x-ratelimit-reset-tokens")),
+    ]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+def backoff_seconds(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Backoff exponencial con jitter completo, para no reintentar todos a la vez."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Token bucket que se rellena de forma continua a ``capacity`` unidades por ``period`` segundos.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.period = period
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """
+        Segundos a esperar hasta poder consumir ``amount``.
+
+        Args:
+            amount: Unidades a consumir
+            reserve: Fracción de la capacidad que debe quedar libre después
+        """
+        self._refill(time.monotonic())
+        # Una petición mayor que la capacidad nunca pasaría: se limita a la capacidad
+        needed = min(amount, self.capacity) + reserve * self.capacity
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: Optional[int], remaining: Optional[int]):
+        """Ajusta el bucket con los valores informados por el servidor."""
+        self._refill(time.monotonic())
+        if limit:
+            self.capacity = float(limit)
+            self.rate = self.capacity / self.period
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class RateLimitScheduler:
+    """
+    Planificador compartido de llamadas a OpenAI.
+
+    Mantiene por modelo un bucket de peticiones/minuto y otro de tokens/minuto,
+    se ajusta con las cabeceras ``x-ratelimit-*`` de cada respuesta y respeta
+    ``Retry-After`` bloqueando el modelo para todos los threads a la vez.
+    Las llamadas interactivas (chat, queries) tienen prioridad: las de ingesta
+    masiva esperan mientras haya interactivas en cola y no pueden consumir la
+    fracción ``interactive_reserve`` de la capacidad.
+
+    Args:
+        limits: Límites por modelo {modelo: (rpm, tpm)}
+        default_limits: Límites para modelos no configurados
+        interactive_reserve: Fracción de capacidad reservada para llamadas interactivas
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]], default_limits: Tuple[int, int],
+                 interactive_reserve: float = 0.1):
+        self.limits = dict(limits)
+        self.default_limits = default_limits
+        self.interactive_reserve = interactive_reserve
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._waiting: Dict[Tuple[str, str], int] = {}
+
+    def _get_buckets(self, model: str) -> Tuple[TokenBucket, TokenBucket]:
+        if model not in self._buckets:
+            rpm, tpm = self.limits.get(model, self.default_limits)
+            self._buckets[model] = (TokenBucket(rpm), TokenBucket(tpm))
+        return self._buckets[model]
+
+    def _set_waiting(self, model: str, priority: str, delta: int):
+        key = (model, priority)
+        self._waiting[key] = self._waiting.get(key, 0) + delta
+        QUEUE_DEPTH.labels(queue=f"openai_{priority}").set(
+            sum(n for (_, p), n in self._waiting.items() if p == priority)
+        )
+
+    def acquire(self, model: str, tokens: int, priority: str = INTERACTIVE) -> float:
+        """
+        Bloquea hasta que la llamada cabe en los límites del modelo.
+
+        Args:
+            model: Modelo de OpenAI
+            tokens: Tokens estimados de la llamada
+            priority: INTERACTIVE o BULK
+
+        Returns:
+            Segundos esperados
+        """
+        start = time.monotonic()
+        with observe_stage("rate_limit_wait"), self._cond:
+            self._set_waiting(model, priority, 1)
+            try:
+                requests_bucket, tokens_bucket = self._get_buckets(model)
+                while True:
+                    wait = self._blocked_until.get(model, 0.0) - time.monotonic()
+                    if wait <= 0:
+                        if priority == BULK and self._waiting.get((model, INTERACTIVE), 0):
+                            # Ceder el turno: se despierta con notify_all cuando la interactiva pasa
+                            wait = 0.05
+                        else:
+                            reserve = self.interactive_reserve if priority == BULK else 0.0
+                            wait = max(requests_bucket.wait_time(1, reserve),
+                                       tokens_bucket.wait_time(tokens, reserve))
+                            if wait <= 0:
+                                requests_bucket.consume(1)
+                                tokens_bucket.consume(tokens)
+                                return time.monotonic() - start
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._set_waiting(model, priority, -1)
+                self._cond.notify_all()
+
+    def update_from_headers(self, model: str, headers: Optional[Mapping[str, str]]):
+        """Sincroniza los buckets con las cabeceras x-ratelimit-* de una respuesta."""
+        if not headers:
+            return
+        with self._cond:
+            requests_bucket, tokens_bucket = self._get_buckets(model)
+            requests_bucket.sync(
+                _header_int(headers, "x-ratelimit-limit-requests"),
+                _header_int(headers, "x-ratelimit-remaining-requests"),
+            )
+            tokens_bucket.sync(
+                _header_int(headers, "x-ratelimit-limit-tokens"),
+                _header_int(headers, "x-ratelimit-remaining-tokens"),
+            )
+
+    def register(self, model: str, limits: Tuple[int, int]):
+        """Declara los límites (rpm, tpm) de un modelo que no estaba configurado."""
+        with self._cond:
+            if model not in self.limits:
+                self.limits[model] = limits
+                self._buckets.pop(model, None)
+
+    def penalize(self, model: str, seconds: float):
+        """Bloquea todas las llamadas al modelo durante ``seconds`` (p. ej. tras un 429)."""
+        with self._cond:
+            until = time.monotonic() + seconds
+            if until > self._blocked_until.get(model, 0.0):
+                self._blocked_until[model] = until
+                logger.warning(f"Rate limit en '{model}': pausando llamadas {seconds:.2f}s")
+            self._cond.notify_all()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)."""
+    return max(1, len(text) // 4)
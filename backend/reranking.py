@@ -0,0 +1,62 @@
+import logging
+from typing import List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(query_vector: Sequence[float], candidate_vectors: Sequence[Sequence[float]],
+               k: int, lambda_mult: float = 0.7, max_similarity: float = 1.0) -> List[int]:
+    """
+    Selección por Maximal Marginal Relevance.
+
+    En cada paso elige el candidato que maximiza
+    ``lambda_mult * sim(query, c) - (1 - lambda_mult) * max(sim(c, elegidos))``.
+    Las similitudes entre candidatos se calculan una sola vez como una matriz
+    y la redundancia de cada candidato se actualiza incrementalmente, así el
+    costo es O(n²·d) para la matriz más O(k·n) para la selección.
+
+    Args:
+        query_vector: Embedding de la consulta
+        candidate_vectors: Embeddings de los candidatos, ordenados por relevancia
+        k: Máximo de candidatos a elegir
+        lambda_mult: 1.0 = solo relevancia, 0.0 = solo diversidad
+        max_similarity: Candidatos con similitud mayor a esta con uno ya elegido
+            se descartan, aunque queden menos de ``k``
+
+    Returns:
+        Índices de los candidatos elegidos, en orden de selección
+    """
+    n = len(candidate_vectors)
+    if n == 0 or k <= 0:
+        return []
+
+    candidates = _normalize(np.asarray(candidate_vectors, dtype=np.float32))
+    query = _normalize(np.asarray(query_vector, dtype=np.float32))
+    relevance = candidates @ query
+    pairwise = candidates @ candidates.T
+
+    selected: List[int] = []
+    available = np.ones(n, dtype=bool)
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+
+    while len(selected) < min(k, n):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            break
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+        # Casi duplicados del elegido (p. ej. chunks solapados de la misma página)
+        available &= redundancy <= max_similarity
+
+    return selected
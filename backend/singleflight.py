@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, TypeVar
+
+from metrics import SINGLE_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return WHITESPACE_RE.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def flight_key(*parts: Any) -> str:
+    """
+    Clave de single-flight: hash de las entradas normalizadas.
+
+    Los textos se comparan sin espacios sobrantes, así dos peticiones que solo
+    difieren en espacios o saltos de línea comparten la llamada.
+    """
+    payload = json.dumps(_normalize(parts), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas idénticas concurrentes en una sola ejecución.
+
+    La primera llamada con una clave ejecuta la función; las que llegan
+    mientras sigue en curso esperan y reciben el mismo resultado (o la misma
+    excepción). Al terminar la clave se libera: no es un cache, las llamadas
+    posteriores vuelven a ejecutar.
+
+    Args:
+        name: Nombre del grupo en las métricas
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        for result in ("leader", "shared"):
+            SINGLE_FLIGHT.labels(group=name, result=result)
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        Ejecuta ``fn`` o espera a la ejecución en curso con la misma clave.
+
+        Args:
+            key: Clave de la llamada (ver flight_key)
+            fn: Función sin argumentos que hace el trabajo
+
+        Returns:
+            El resultado de ``fn``
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            SINGLE_FLIGHT.labels(group=self.name, result="shared").inc()
+            logger.debug(f"Single-flight '{self.name}': esperando llamada en curso")
+            return call.result()
+
+        SINGLE_FLIGHT.labels(group=self.name, result="leader").inc()
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        """Número de llamadas distintas en curso."""
+        with self._lock:
+            return len(self._calls)
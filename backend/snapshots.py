@@ -0,0 +1,432 @@
+"""
+Exportación e importación de snapshots portables del índice.
+
+Un snapshot es un directorio con:
+    manifest.json     modelo de embeddings, dimensión, formato y conteos
+    ids.bin           ids de los puntos (UUID, 16 bytes cada uno)
+    vectors.f32       vectores float32 contiguos (N x dimensión), o
+    vectors.i8        vectores cuantizados a int8 + scales.f32 (una escala por vector)
+    chunks.jsonl.gz   tenant, doc, página y texto de cada punto, en el mismo orden
+    documents.jsonl   metadatos de los documentos
+
+Restaurar un snapshot no llama a la API de embeddings: los vectores se suben
+tal cual en lotes paralelos.
+
+Uso:
+    python -m snapshots export DIRECTORIO [--tenant T] [--pdf NOMBRE] [--quantize int8]
+    python -m snapshots import DIRECTORIO [--tenant T]
+"""
+import argparse
+import contextvars
+import gzip
+import json
+import logging
+import os
+import sys
+import tarfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client.http.models import PointStruct
+
+from metrics import observe_stage
+from vector_utils import (
+    BULK_LOAD_MIN_CHUNKS,
+    _scroll_all,
+    _tenant_filter,
+    close_clients,
+    create_collection_if_not_exists,
+    embedding_indexes,
+    get_chunk_store,
+    get_qdrant,
+    qdrant_collections,
+    refresh_summaries,
+)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "1000"))
+SNAPSHOT_IMPORT_CONCURRENCY = int(os.getenv("SNAPSHOT_IMPORT_CONCURRENCY", "4"))
+
+MANIFEST = "manifest.json"
+IDS = "ids.bin"
+VECTORS_F32 = "vectors.f32"
+VECTORS_I8 = "vectors.i8"
+SCALES = "scales.f32"
+CHUNKS = "chunks.jsonl.gz"
+DOCUMENTS = "documents.jsonl"
+SNAPSHOT_FILES = (MANIFEST, IDS, VECTORS_F32, VECTORS_I8, SCALES, CHUNKS, DOCUMENTS)
+
+# Ids de los puntos importados en un tenant de destino (deterministas: reimportar no duplica)
+_TENANT_NAMESPACE = uuid.UUID("6f1c9f0e-3c57-4b8e-9a64-2f0d8f8f5b21")
+
+
+class SnapshotError(ValueError):
+    """Snapshot inválido o incompatible con la configuración actual."""
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Cuantización simétrica por vector: v ≈ q * escala, con q en [-127, 127]."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+# --- Exportación ---
+def _point_batches(collection_name: str, tenant: Optional[str],
+                   pdf_name: Optional[str]) -> Iterator[List[Any]]:
+    scroll_filter = _tenant_filter(tenant, pdf_name) if tenant else None
+    batch = []
+    for point in _scroll_all(collection_name, scroll_filter, with_payload=False, with_vectors=True):
+        batch.append(point)
+        if len(batch) >= SNAPSHOT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_snapshot(directory: str, collection_name: str = "pdf_chunks", tenant: Optional[str] = None,
+                    pdf_name: Optional[str] = None, quantize: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Escribe un snapshot de la colección, de un tenant o de un documento.
+
+    Args:
+        directory: Directorio de destino (se crea si no existe)
+        collection_name: Colección a exportar
+        tenant: Tenant a exportar (None = toda la colección)
+        pdf_name: Documento a exportar (requiere tenant)
+        quantize: None para float32 o "int8" (4 veces más chico, pérdida de precisión mínima)
+
+    Returns:
+        Manifest del snapshot
+    """
+    if pdf_name and not tenant:
+        raise ValueError("Exportar un documento requiere indicar el tenant")
+    if quantize not in (None, "int8"):
+        raise ValueError(f"Cuantización no soportada: {quantize}")
+    index = embedding_indexes.active(collection_name)
+    if not qdrant_collections.exists(index.collection):
+        raise SnapshotError(f"La colección '{index.collection}' no existe")
+
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    store = get_chunk_store()
+    count = skipped = 0
+    vector_size = None
+    documents = set()
+
+    vectors_name = VECTORS_I8 if quantize else VECTORS_F32
+    with open(os.path.join(directory, IDS), "wb") as ids_file, \
+            open(os.path.join(directory, vectors_name), "wb") as vectors_file, \
+            open(os.path.join(directory, SCALES), "wb") if quantize else nullcontext() as scales_file, \
+            gzip.open(os.path.join(directory, CHUNKS), "wt", encoding="utf-8") as chunks_file:
+        for points in _point_batches(index.collection, tenant, pdf_name):
+            rows = store.get_chunks([p.id for p in points])
+            kept = [p for p in points if str(p.id) in rows]
+            skipped += len(points) - len(kept)
+            if not kept:
+                continue
+
+            vectors = np.asarray([p.vector for p in kept], dtype=np.float32)
+            vector_size = vectors.shape[1]
+            ids_file.write(b"".join(uuid.UUID(str(p.id)).bytes for p in kept))
+            if quantize:
+                quantized, scales = quantize_int8(vectors)
+                quantized.tofile(vectors_file)
+                scales.tofile(scales_file)
+            else:
+                vectors.tofile(vectors_file)
+            for p in kept:
+                row_tenant, doc, page, text, pages = rows[str(p.id)]
+                documents.add((row_tenant, doc))
+                row = {"tenant": row_tenant, "doc": doc, "page": page, "text": text}
+                if len(pages) > 1:
+                    row["pages"] = pages
+                chunks_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += len(kept)
+
+    if not quantize and os.path.exists(os.path.join(directory, SCALES)):
+        os.unlink(os.path.join(directory, SCALES))
+    with open(os.path.join(directory, DOCUMENTS), "w", encoding="utf-8") as f:
+        for row in store.document_rows(sorted(documents)):
+            f.write(json.dumps(dict(zip(("tenant", "doc", "title", "author", "created_at"), row)),
+                               ensure_ascii=False) + "\n")
+
+    if skipped:
+        logger.warning(f"{skipped} puntos sin texto en el chunk store no se exportaron")
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "embedding_model": index.model,
+        "vector_size": vector_size or index.vector_size,
+        "dtype": "int8" if quantize else "float32",
+        "count": count,
+        "documents": len(documents),
+        "collection": collection_name,
+        "tenant": tenant,
+        "pdf_name": pdf_name,
+        "created_at": datetime.now().isoformat(),
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    logger.info(f"Snapshot exportado: {count} puntos, {len(documents)} documentos "
+                f"en {time.perf_counter() - start:.1f}s")
+    return manifest
+
+
+# --- Importación ---
+def read_manifest(directory: str, collection_name: str = "pdf_chunks") -> Dict[str, Any]:
+    """Lee el manifest y verifica que el snapshot sea compatible con el índice activo de la colección."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"Manifest ilegible: {e}")
+
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Versión de formato no soportada: {manifest.get('format_version')}")
+    index = embedding_indexes.active(collection_name)
+    if manifest.get("embedding_model") != index.model:
+        raise SnapshotError(
+            f"El snapshot usa el modelo '{manifest.get('embedding_model')}' y el servicio '{index.model}'"
+        )
+    if manifest.get("vector_size") != index.vector_size:
+        raise SnapshotError(
+            f"El snapshot tiene vectores de {manifest.get('vector_size')} dimensiones "
+            f"y el servicio {index.vector_size}"
+        )
+    if manifest.get("dtype") not in ("float32", "int8"):
+        raise SnapshotError(f"Tipo de vectores no soportado: {manifest.get('dtype')}")
+    return manifest
+
+
+def read_documents(directory: str) -> List[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, DOCUMENTS), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"{DOCUMENTS} ilegible: {e}")
+
+
+def _check_size(directory: str, filename: str, expected: int):
+    """Verifica el tamaño de un archivo antes de mapearlo (truncado o sobrante = snapshot inválido)."""
+    path = os.path.join(directory, filename)
+    try:
+        actual = os.path.getsize(path)
+    except OSError:
+        raise SnapshotError(f"Falta {filename}")
+    if actual != expected:
+        raise SnapshotError(f"{filename} tiene {actual} bytes y el manifest indica {expected}")
+    return path
+
+
+def _load_arrays(directory: str, manifest: Dict[str, Any]):
+    count, size = manifest.get("count"), manifest["vector_size"]
+    if not isinstance(count, int) or count < 0:
+        raise SnapshotError(f"Conteo inválido en el manifest: {count}")
+    int8 = manifest["dtype"] == "int8"
+    if count == 0:
+        # np.memmap no puede mapear archivos vacíos
+        return (np.empty((0, 16), dtype=np.uint8),
+                np.empty((0, size), dtype=np.int8 if int8 else np.float32),
+                np.empty(0, dtype=np.float32) if int8 else None)
+    ids = np.memmap(_check_size(directory, IDS, count * 16), dtype=np.uint8, mode="r", shape=(count, 16))
+    if int8:
+        vectors = np.memmap(_check_size(directory, VECTORS_I8, count * size), dtype=np.int8, mode="r",
+                            shape=(count, size))
+        scales = np.fromfile(_check_size(directory, SCALES, count * 4), dtype=np.float32)
+    else:
+        vectors = np.memmap(_check_size(directory, VECTORS_F32, count * size * 4), dtype=np.float32, mode="r",
+                            shape=(count, size))
+        scales = None
+    return ids, vectors, scales
+
+
+def _validate_chunks(directory: str, manifest: Dict[str, Any], keys: set, tenant: Optional[str]):
+    """
+    Recorre chunks.jsonl.gz antes de subir nada: filas legibles, una por vector
+    y cada una de un documento de documents.jsonl (los cupos y duplicados se
+    verifican sobre documents.jsonl, así que un chunk de otro documento los saltaría).
+    """
+    count = 0
+    try:
+        with gzip.open(os.path.join(directory, CHUNKS), "rt", encoding="utf-8") as chunks_file:
+            for line in chunks_file:
+                row = json.loads(line)
+                row["page"], row["text"]  # KeyError si faltan campos
+                if (tenant or row["tenant"], row["doc"]) not in keys:
+                    raise SnapshotError(f"{CHUNKS} tiene chunks de '{row['doc']}', que no está en {DOCUMENTS}")
+                count += 1
+    except SnapshotError:
+        raise
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # Archivo de chunks truncado, gzip corrupto o JSON inválido
+        raise SnapshotError(f"{CHUNKS} ilegible: {e}")
+    if count != manifest["count"]:
+        raise SnapshotError(f"El snapshot declara {manifest['count']} puntos pero contiene {count}")
+
+
+def import_snapshot(directory: str, collection_name: str = "pdf_chunks",
+                    tenant: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Restaura un snapshot sin generar embeddings.
+
+    Los lotes se suben en paralelo (``SNAPSHOT_IMPORT_CONCURRENCY``) y, en
+    restauraciones grandes, con el índice HNSW desactivado hasta el final.
+    El texto de cada lote se guarda antes de su upsert, como en la ingesta.
+    Solo se escribe el índice activo: si hay una migración de modelo en
+    curso, su pasada final genera los vectores que falten en el sombra.
+
+    El snapshot se valida completo antes de escribir. Con un tenant de
+    destino los ids se derivan de ese tenant y no de los del archivo, así
+    que un snapshot editado no puede pisar puntos de otro tenant.
+
+    Args:
+        directory: Directorio del snapshot
+        collection_name: Colección de destino
+        tenant: Tenant de destino (None = conservar los tenants del snapshot)
+
+    Returns:
+        Conteos y duración de la restauración
+    """
+    start = time.perf_counter()
+    manifest = read_manifest(directory, collection_name)
+    ids, vectors, scales = _load_arrays(directory, manifest)
+    documents = read_documents(directory)
+    keys = [(tenant or d["tenant"], d["doc"]) for d in documents]
+    _validate_chunks(directory, manifest, set(keys), tenant)
+
+    store = get_chunk_store()
+    index = embedding_indexes.active(collection_name)
+    create_collection_if_not_exists(index.collection, index.vector_size)
+    store.put_documents(
+        (tenant or d["tenant"], d["doc"], d.get("title", ""), d.get("author", ""), d["created_at"])
+        for d in documents
+    )
+
+    def upload(offset: int, rows: List[Dict[str, Any]]):
+        batch_vectors = np.asarray(vectors[offset:offset + len(rows)], dtype=np.float32)
+        if scales is not None:
+            batch_vectors *= scales[offset:offset + len(rows), None]
+        points, chunk_rows = [], []
+        for i, row in enumerate(rows):
+            point_id = str(uuid.UUID(bytes=ids[offset + i].tobytes()))
+            row_tenant = tenant or row["tenant"]
+            if tenant:
+                point_id = str(uuid.uuid5(_TENANT_NAMESPACE, f"{tenant}/{point_id}"))
+            points.append(PointStruct(
+                id=point_id,
+                vector=batch_vectors[i].tolist(),
+                payload={"tenant": row_tenant, "doc": row["doc"]}
+            ))
+            chunk_rows.append((point_id, row_tenant, row["doc"], row["page"], row["text"], row.get("pages")))
+        store.put_chunks(chunk_rows)
+        with observe_stage("qdrant_upsert"):
+            get_qdrant().upsert(collection_name=index.collection, points=points)
+
+    bulk = manifest["count"] >= BULK_LOAD_MIN_CHUNKS
+    imported = 0
+    try:
+        with qdrant_collections.bulk_load(index.collection, index.vector_size) if bulk else nullcontext(), \
+                ThreadPoolExecutor(max_workers=SNAPSHOT_IMPORT_CONCURRENCY) as pool, \
+                gzip.open(os.path.join(directory, CHUNKS), "rt", encoding="utf-8") as chunks_file:
+            pending = []
+            rows: List[Dict[str, Any]] = []
+            for line in chunks_file:
+                rows.append(json.loads(line))
+                if len(rows) == SNAPSHOT_BATCH_SIZE:
+                    pending.append(pool.submit(contextvars.copy_context().run, upload, imported, rows))
+                    imported += len(rows)
+                    rows = []
+                    # Acotar los lotes en memoria: esperar al más antiguo
+                    if len(pending) >= SNAPSHOT_IMPORT_CONCURRENCY * 2:
+                        pending.pop(0).result()
+            if rows:
+                pending.append(pool.submit(contextvars.copy_context().run, upload, imported, rows))
+                imported += len(rows)
+            for future in pending:
+                future.result()
+    except SnapshotError:
+        raise
+    except (OSError, ValueError) as e:
+        # Archivo de chunks truncado, gzip corrupto o JSON inválido
+        raise SnapshotError(f"{CHUNKS} ilegible: {e}")
+
+    store.refresh_document_stats(keys)
+    refresh_summaries(index, keys)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Snapshot importado: {imported} puntos, {len(documents)} documentos en {elapsed:.1f}s")
+    return {
+        "points": imported,
+        "documents": len(documents),
+        "collection": collection_name,
+        "seconds": round(elapsed, 2),
+    }
+
+
+# --- Empaquetado (para transferirlos por HTTP) ---
+def pack_snapshot(directory: str, archive_path: str):
+    """Empaqueta un snapshot en un tar sin compresión (los vectores no comprimen)."""
+    with tarfile.open(archive_path, "w") as archive:
+        for name in SNAPSHOT_FILES:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                archive.add(path, arcname=name)
+
+
+def unpack_snapshot(archive_path: str, directory: str):
+    """Extrae un snapshot empaquetado; solo acepta los archivos conocidos del formato."""
+    try:
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                if not member.isfile() or member.name not in SNAPSHOT_FILES:
+                    raise SnapshotError(f"Archivo inesperado en el snapshot: {member.name}")
+                with archive.extractfile(member) as source, open(os.path.join(directory, member.name), "wb") as dest:
+                    while True:
+                        block = source.read(1024 * 1024)
+                        if not block:
+                            break
+                        dest.write(block)
+    except tarfile.TarError as e:
+        raise SnapshotError(f"Snapshot inválido: {e}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Exportar o importar snapshots del índice")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="Exportar puntos, textos y metadatos")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--tenant", help="Tenant a exportar (por defecto, toda la colección)")
+    export_parser.add_argument("--pdf", help="Documento a exportar (requiere --tenant)")
+    export_parser.add_argument("--quantize", choices=("int8",), help="Cuantizar los vectores")
+    export_parser.add_argument("--collection", default="pdf_chunks")
+    import_parser = sub.add_parser("import", help="Restaurar un snapshot sin generar embeddings")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("--tenant", help="Tenant de destino (por defecto, los del snapshot)")
+    import_parser.add_argument("--collection", default="pdf_chunks")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        if args.command == "export":
+            result = export_snapshot(args.directory, args.collection, args.tenant, args.pdf, args.quantize)
+        else:
+            result = import_snapshot(args.directory, args.collection, args.tenant)
+    except SnapshotError as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        close_clients()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+
+class Trace:
+    """
+    Registro de spans de una petición.
+
+    Los spans pueden venir del event loop o de threads del threadpool, por lo
+    que el acceso a la lista está protegido por un lock.
+    """
+
+    def __init__(self, debug: bool = False, profiler=None):
+        self.start = time.perf_counter()
+        self.debug = debug
+        self.profiler = profiler
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self.start) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+            })
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Agrupa los spans por nombre: duración total y número de llamadas."""
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for span in self.spans:
+                entry = totals.setdefault(span["name"], {"duration_ms": 0.0, "count": 0})
+                entry["duration_ms"] = round(entry["duration_ms"] + span["duration_ms"], 3)
+                entry["count"] += 1
+        return totals
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000, 3)
+
+    def server_timing(self) -> str:
+        """Serializa el desglose como valor de la cabecera Server-Timing."""
+        parts = []
+        for name, entry in self.totals().items():
+            part = f"{name};dur={entry['duration_ms']}"
+            if entry["count"] > 1:
+                part += f';desc="x{entry["count"]}"'
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed_ms()}")
+        return ", ".join(parts)
+
+    def summary(self) -> Dict[str, Any]:
+        """Desglose completo para incluir en respuestas de debug."""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "total_ms": self.elapsed_ms(),
+            "stages": self.totals(),
+            "spans": spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def start_trace(debug: bool = False, profiler=None) -> Trace:
+    """Inicia un trace para la petición actual."""
+    trace = Trace(debug=debug, profiler=profiler)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Registra un span en el trace de la petición actual (si existe).
+
+    Si la petición se está perfilando, el thread que ejecuta el span se
+    agrega al profiler para que sus muestras queden en el perfil.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    if trace.profiler is not None:
+        trace.profiler.add_thread(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter() - start)
+
+
+def debug_timings() -> Optional[Dict[str, Any]]:
+    """Devuelve el desglose de tiempos si la petición lo solicitó."""
+    trace = _current_trace.get()
+    if trace is None or not trace.debug:
+        return None
+    return trace.summary()
@@ -1,44 +1,442 @@
 import os
+import contextvars
 import logging
+import threading
 import time
 import uuid
-from typing import List, Dict, Optional, Any
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterable, Iterator, Optional, Any, Tuple
 from datetime import datetime
 
-from openai import OpenAI
+import httpx
+from openai import (
+    OpenAI,
+    DefaultHttpxClient,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
 from openai.types import CreateEmbeddingResponse
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import PointStruct
 
+from chunk_store import ChunkStore, CHUNK_STORE_PATH
+from collection_manager import CollectionManager, CollectionSpec
+from corpus_stats import QueryStats
+from embedding_index import ACTIVE, EmbeddingIndex, IndexRegistry
+from embedding_providers import (
+    HASHING_MODEL,
+    LOCAL_EMBEDDING_MODEL,
+    LOCAL_PREFIX,
+    EmbeddingProvider,
+    create_offline_provider,
+)
+from hierarchy import (
+    DOCUMENT,
+    SECTION,
+    candidate_documents,
+    summary_collection_name,
+    summary_points,
+)
+from metrics import (
+    EMBEDDING_CACHE,
+    OPENAI_RATE_LIMITED,
+    OPENAI_RETRIES,
+    observe_duration,
+    observe_stage,
+    record_usage,
+)
+from reranking import mmr_select
+from singleflight import SingleFlight, flight_key
+from rate_limiter import (
+    BULK,
+    INTERACTIVE,
+    RateLimitScheduler,
+    backoff_seconds,
+    estimate_tokens,
+    retry_after_seconds,
+)
+
 logger = logging.getLogger(__name__)
 
 # Configuración desde variables de entorno
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()  # "openai", "local" o "hashing"
 EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
 CHAT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 VECTOR_SIZE = int(os.getenv("VECTOR_SIZE", "3072"))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))
 
-# Inicializar clientes
-client = OpenAI(api_key=OPENAI_API_KEY)
-qdrant = QdrantClient(url=f"http://{QDRANT_HOST}:{QDRANT_PORT}")
+# Transporte y pools de conexiones
+QDRANT_TRANSPORT = os.getenv("QDRANT_TRANSPORT", "rest").lower()  # "rest" o "grpc"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_MAX_CONNECTIONS = int(os.getenv("QDRANT_MAX_CONNECTIONS", "32"))
+QDRANT_KEEPALIVE_CONNECTIONS = int(os.getenv("QDRANT_KEEPALIVE_CONNECTIONS", "16"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", "32"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Timeouts por tipo de llamada (segundos)
+QDRANT_SEARCH_TIMEOUT = int(os.getenv("QDRANT_SEARCH_TIMEOUT", "5"))
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "60"))  # upserts, scrolls y administración
+OPENAI_QUERY_TIMEOUT = float(os.getenv("OPENAI_QUERY_TIMEOUT", "10"))  # embeddings de consultas
+OPENAI_BULK_TIMEOUT = float(os.getenv("OPENAI_BULK_TIMEOUT", "120"))  # lotes de embeddings de ingesta
+OPENAI_PROBE_TIMEOUT = float(os.getenv("OPENAI_PROBE_TIMEOUT", "2"))  # sondeo de /ready
+OPENAI_PROBE_TTL_S = float(os.getenv("OPENAI_PROBE_TTL_S", "30"))  # resultado del sondeo reutilizado
+
+# Límites de OpenAI por modelo (se ajustan con las cabeceras x-ratelimit-* de cada respuesta)
+EMBEDDING_RPM = int(os.getenv("OPENAI_EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))
+CHAT_RPM = int(os.getenv("OPENAI_CHAT_RPM", "500"))
+CHAT_TPM = int(os.getenv("OPENAI_CHAT_TPM", "200000"))
+INTERACTIVE_RESERVE = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.1"))
+
+# Lotes de ingesta: textos y tokens por llamada de embeddings, puntos por upsert y lotes en paralelo
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# Configuración de colecciones. ef_construct más alto que el default (100) mejora el recall
+# con vectores de 3072 dimensiones; el payload (texto de los chunks) va a disco porque solo
+# se lee para los resultados finales. Toda búsqueda se filtra por tenant, así que en vez de
+# un grafo HNSW global (m=0) se construye uno por tenant (payload_m): la latencia de un
+# tenant no depende del volumen de los demás
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "0"))
+QDRANT_HNSW_PAYLOAD_M = int(os.getenv("QDRANT_HNSW_PAYLOAD_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "200"))
+QDRANT_ON_DISK_VECTORS = os.getenv("QDRANT_ON_DISK_VECTORS", "false").lower() == "true"
+QDRANT_ON_DISK_PAYLOAD = os.getenv("QDRANT_ON_DISK_PAYLOAD", "true").lower() == "true"
+QDRANT_INDEXING_THRESHOLD = int(os.getenv("QDRANT_INDEXING_THRESHOLD", "20000"))  # KB por segmento
+QDRANT_DEFAULT_SEGMENTS = int(os.getenv("QDRANT_DEFAULT_SEGMENTS", "0"))  # 0 = automático
+BULK_LOAD_MIN_CHUNKS = int(os.getenv("BULK_LOAD_MIN_CHUNKS", "5000"))
+
+# Reranking MMR de los candidatos: MMR_LAMBDA=1 solo relevancia, 0 solo diversidad.
+# Candidatos con similitud mayor a MMR_MAX_SIMILARITY con uno ya elegido se descartan
+MMR_ENABLED = os.getenv("MMR_ENABLED", "true").lower() == "true"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_MAX_SIMILARITY = float(os.getenv("MMR_MAX_SIMILARITY", "0.95"))
+
+# Búsqueda jerárquica sin pdf_name: primero los vectores de resumen (documentos y secciones)
+# eligen HIERARCHICAL_DOCUMENTS documentos, después se buscan chunks solo dentro de ellos
+HIERARCHICAL_SEARCH = os.getenv("HIERARCHICAL_SEARCH", "false").lower() == "true"
+HIERARCHICAL_MIN_DOCUMENTS = int(os.getenv("HIERARCHICAL_MIN_DOCUMENTS", "20"))  # con menos, búsqueda plana
+HIERARCHICAL_DOCUMENTS = int(os.getenv("HIERARCHICAL_DOCUMENTS", "5"))
+HIERARCHICAL_SECTIONS = int(os.getenv("HIERARCHICAL_SECTIONS", "10"))
+
+# Multi-tenancy: cada punto lleva el tenant en el payload y toda operación filtra por él
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+# Cada cuánto se relee qué colección física está activa (ver migration.py)
+INDEX_REFRESH_S = float(os.getenv("INDEX_REFRESH_S", "5"))
+# Modelos que aceptan el parámetro "dimensions" (vectores recortados)
+DIMENSIONS_MODEL_PREFIXES = ("text-embedding-3",)
+# Dimensión nativa de los modelos de OpenAI, para migrar a ellos sin indicarla
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+SCROLL_PAGE_SIZE = int(os.getenv("SCROLL_PAGE_SIZE", "1000"))
+
+# Campos de payload indexados (los que se usan en filtros)
+PAYLOAD_INDEXES = {
+    "tenant": models.PayloadSchemaType.KEYWORD,
+    "doc": models.PayloadSchemaType.KEYWORD,
+}
+# Versión 2: los puntos llevan "tenant". Versión 3: el payload solo tiene los campos
+# de filtrado; texto y metadatos viven en el chunk store
+SCHEMA_VERSION = 3
+# Campos que antes vivían en el payload y ahora están en el chunk store
+LEGACY_PAYLOAD_FIELDS = ["text", "page", "title", "author", "char_count", "created_at"]
+
+# Errores transitorios de OpenAI que vale la pena reintentar
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# --- Clientes ---
+def _build_qdrant_client(timeout: int) -> QdrantClient:
+    """
+    Crea un cliente de Qdrant con el transporte y el pool de conexiones configurados.
+    
+    Con gRPC los vectores viajan en binario (protobuf) en vez de JSON, lo que
+    reduce CPU y ancho de banda con vectores de 3072 dimensiones.
+    """
+    return QdrantClient(
+        host=QDRANT_HOST,
+        port=QDRANT_PORT,
+        grpc_port=QDRANT_GRPC_PORT,
+        prefer_grpc=QDRANT_TRANSPORT == "grpc",
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=QDRANT_MAX_CONNECTIONS,
+            max_keepalive_connections=QDRANT_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+
+def _build_openai_client() -> OpenAI:
+    """Crea el cliente de OpenAI con pool de conexiones explícito y keep-alive."""
+    return OpenAI(
+        api_key=OPENAI_API_KEY,
+        max_retries=0,  # los reintentos los maneja openai_scheduler, no el SDK
+        timeout=REQUEST_TIMEOUT,
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+    )
+
+# Los clientes se crean al primer uso: importar el módulo no abre conexiones.
+# Las búsquedas usan su propio cliente con timeout corto
+# (qdrant-client 1.7 no aplica el timeout por llamada en REST)
+_clients_lock = threading.Lock()
+_openai_client: Optional[OpenAI] = None
+_qdrant: Optional[QdrantClient] = None
+_qdrant_search: Optional[QdrantClient] = None
+_chunk_store: Optional[ChunkStore] = None
+
+def get_openai_client() -> OpenAI:
+    global _openai_client
+    if _openai_client is None:
+        with _clients_lock:
+            if _openai_client is None:
+                _openai_client = _build_openai_client()
+    return _openai_client
+
+def get_qdrant() -> QdrantClient:
+    global _qdrant
+    if _qdrant is None:
+        with _clients_lock:
+            if _qdrant is None:
+                _qdrant = _build_qdrant_client(QDRANT_TIMEOUT)
+    return _qdrant
 
-# Cache simple para embeddings
+def get_qdrant_search() -> QdrantClient:
+    global _qdrant_search
+    if _qdrant_search is None:
+        with _clients_lock:
+            if _qdrant_search is None:
+                _qdrant_search = _build_qdrant_client(QDRANT_SEARCH_TIMEOUT)
+    return _qdrant_search
+
+def get_chunk_store() -> ChunkStore:
+    global _chunk_store
+    if _chunk_store is None:
+        with _clients_lock:
+            if _chunk_store is None:
+                _chunk_store = ChunkStore(CHUNK_STORE_PATH)
+    return _chunk_store
+
+# Búsquedas por tenant y documento, persistidas en el chunk store en lotes
+query_stats = QueryStats(get_chunk_store)
+
+def set_qdrant_clients(qdrant_client: QdrantClient, search_client: Optional[QdrantClient] = None):
+    """Reemplaza los clientes de Qdrant (p. ej. por uno en memoria en benchmarks)."""
+    global _qdrant, _qdrant_search
+    with _clients_lock:
+        _qdrant = qdrant_client
+        _qdrant_search = search_client or qdrant_client
+    qdrant_collections.invalidate()
+
+def close_clients():
+    """Cierra las conexiones abiertas; el siguiente uso vuelve a crear los clientes."""
+    global _openai_client, _qdrant, _qdrant_search
+    query_stats.flush()
+    with _clients_lock:
+        for c in {id(c): c for c in (_openai_client, _qdrant, _qdrant_search) if c is not None}.values():
+            try:
+                c.close()
+            except Exception as e:
+                logger.warning(f"Error cerrando cliente: {e}")
+        _openai_client = _qdrant = _qdrant_search = None
+    with _providers_lock:
+        for provider in {id(p): p for p in _providers.values()}.values():
+            provider.close()
+        _providers.clear()
+
+def _collection_spec(vector_size: int) -> CollectionSpec:
+    return CollectionSpec(
+        vector_size=vector_size,
+        hnsw_m=QDRANT_HNSW_M,
+        hnsw_ef_construct=QDRANT_HNSW_EF_CONSTRUCT,
+        hnsw_payload_m=QDRANT_HNSW_PAYLOAD_M or None,
+        on_disk_vectors=QDRANT_ON_DISK_VECTORS,
+        on_disk_payload=QDRANT_ON_DISK_PAYLOAD,
+        indexing_threshold=QDRANT_INDEXING_THRESHOLD,
+        default_segment_number=QDRANT_DEFAULT_SEGMENTS,
+        payload_indexes=PAYLOAD_INDEXES,
+        schema_version=SCHEMA_VERSION,
+    )
+
+# Estado cacheado de las colecciones (evita consultar metadatos en cada búsqueda)
+qdrant_collections = CollectionManager(get_qdrant, _collection_spec)
+
+class EmbeddingConfigError(RuntimeError):
+    """El modelo de embeddings configurado no es el del índice registrado."""
+
+def _load_indexes(name: str) -> Dict[str, EmbeddingIndex]:
+    return {role: EmbeddingIndex(*row) for role, row in get_chunk_store().get_indexes(name).items()}
+
+def _default_index(name: str) -> EmbeddingIndex:
+    # La dimensión la declara el proveedor configurado (p. ej. la del modelo local)
+    provider = embedding_provider_for(default_embedding_model())
+    return EmbeddingIndex(name, provider.model, provider.dimensions)
+
+# Colección física y modelo de embeddings de cada colección lógica (cambia al migrar de modelo)
+embedding_indexes = IndexRegistry(_load_indexes, _default_index, refresh_s=INDEX_REFRESH_S)
+
+# Planificador compartido de llamadas a OpenAI
+openai_scheduler = RateLimitScheduler(
+    {
+        EMBEDDING_MODEL: (EMBEDDING_RPM, EMBEDDING_TPM),
+        CHAT_MODEL: (CHAT_RPM, CHAT_TPM),
+    },
+    default_limits=(CHAT_RPM, CHAT_TPM),
+    interactive_reserve=INTERACTIVE_RESERVE,
+)
+
+# Cache simple para embeddings: {(modelo, dimensiones, texto): embedding}
 embedding_cache = {}
 
+# Llamadas idénticas en curso: las concurrentes esperan a la primera en vez de repetirla
+embedding_flights = SingleFlight("embedding")
+answer_flights = SingleFlight("answer")
+
+
+# --- Reintentos ---
+def _wait_before_retry(model: str, error: Exception, attempt: int):
+    """
+    Espera antes de reintentar una llamada fallida a OpenAI.
+    
+    Un 429 bloquea el modelo en el planificador durante el Retry-After indicado,
+    así todos los threads esperan juntos en vez de reintentar a ciegas. Otros
+    errores usan backoff exponencial con jitter.
+    """
+    if isinstance(error, RateLimitError):
+        delay = retry_after_seconds(error.response.headers) or backoff_seconds(attempt)
+        openai_scheduler.penalize(model, delay)
+    else:
+        time.sleep(backoff_seconds(attempt))
+
 
 # --- Embeddings ---
-def get_embedding(text: str, use_cache: bool = True) -> List[float]:
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings de la API de OpenAI, respetando rate limits y reintentos.
+    
+    Args:
+        model: Modelo de embeddings de OpenAI
+        dimensions: Dimensión de los vectores (los modelos text-embedding-3 la aceptan como parámetro)
+    """
+    
+    def __init__(self, model: str, dimensions: int):
+        super().__init__(model, dimensions)
+        self._options = {"dimensions": dimensions} if model.startswith(DIMENSIONS_MODEL_PREFIXES) else {}
+        openai_scheduler.register(model, (EMBEDDING_RPM, EMBEDDING_TPM))
+    
+    def embed(self, texts: List[str], priority: str = INTERACTIVE) -> List[List[float]]:
+        """Una sola llamada a la API con todos los textos."""
+        model = self.model
+        tokens = sum(estimate_tokens(t) for t in texts)
+        
+        for attempt in range(MAX_RETRIES):
+            try:
+                logger.debug(f"Generando {len(texts)} embeddings (intento {attempt + 1}), ~{tokens} tokens")
+                
+                openai_scheduler.acquire(model, tokens, priority)
+                with observe_stage("embedding"):
+                    raw = get_openai_client().embeddings.with_raw_response.create(
+                        model=model,
+                        input=texts,
+                        timeout=OPENAI_QUERY_TIMEOUT if priority == INTERACTIVE else OPENAI_BULK_TIMEOUT,
+                        **self._options
+                    )
+                openai_scheduler.update_from_headers(model, raw.headers)
+                response = raw.parse()
+                record_usage(model, response.usage)
+                
+                # La API devuelve un índice por embedding: no asumir el orden
+                return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+                
+            except Exception as e:
+                logger.warning(f"Error generando embedding (intento {attempt + 1}): {e}")
+                if isinstance(e, RateLimitError):
+                    OPENAI_RATE_LIMITED.labels(operation="embedding").inc()
+                if attempt == MAX_RETRIES - 1 or not isinstance(e, RETRYABLE_ERRORS):
+                    logger.error(f"Falló generación de embedding después de {attempt + 1} intentos")
+                    raise
+                OPENAI_RETRIES.labels(operation="embedding").inc()
+                _wait_before_retry(model, e, attempt)
+
+# Proveedores creados, por (modelo, dimensión pedida)
+_providers: Dict[Any, EmbeddingProvider] = {}
+_providers_lock = threading.Lock()
+
+def default_embedding_model() -> str:
+    """Modelo de embeddings configurado por EMBEDDING_PROVIDER, para colecciones sin migrar."""
+    if EMBEDDING_PROVIDER == "local":
+        return LOCAL_PREFIX + LOCAL_EMBEDDING_MODEL
+    if EMBEDDING_PROVIDER == "hashing":
+        return HASHING_MODEL
+    return EMBEDDING_MODEL
+
+def _create_provider(model: str, dimensions: Optional[int]) -> EmbeddingProvider:
+    if dimensions is None and model == default_embedding_model() and EMBEDDING_PROVIDER != "local":
+        dimensions = VECTOR_SIZE
+    provider = create_offline_provider(model, dimensions)
+    if provider is None:
+        dimensions = dimensions or OPENAI_EMBEDDING_DIMENSIONS.get(model)
+        if not dimensions:
+            raise ValueError(f"Dimensión desconocida para el modelo '{model}': hay que indicarla")
+        provider = OpenAIEmbeddingProvider(model, dimensions)
+    if dimensions and provider.dimensions != dimensions:
+        raise ValueError(
+            f"El modelo '{model}' produce vectores de {provider.dimensions} dimensiones, no de {dimensions}"
+        )
+    return provider
+
+def embedding_provider_for(model: str, dimensions: Optional[int] = None) -> EmbeddingProvider:
+    """
+    Proveedor de embeddings de un modelo, creado una vez por proceso.
+    
+    Args:
+        model: Modelo de OpenAI, "local:<modelo>" o "hashing"
+        dimensions: Dimensión de los vectores (None = la que declara el proveedor)
+    """
+    provider = _providers.get((model, dimensions)) or _providers.get((model, None))
+    if provider is not None and dimensions in (None, provider.dimensions):
+        return provider
+    with _providers_lock:
+        provider = _providers.get((model, dimensions))
+        if provider is None:
+            provider = _create_provider(model, dimensions)
+            _providers[(model, dimensions)] = provider
+            _providers.setdefault((model, None), provider)
+    return provider
+
+def get_embedding_provider(index: Optional[EmbeddingIndex] = None) -> EmbeddingProvider:
+    """Proveedor del índice indicado (por defecto, el activo)."""
+    index = index or embedding_indexes.active("pdf_chunks")
+    return embedding_provider_for(index.model, index.vector_size)
+
+def get_embedding(text: str, use_cache: bool = True, priority: str = INTERACTIVE,
+                  index: Optional[EmbeddingIndex] = None) -> List[float]:
     """
     Genera embeddings para un texto con cache y retry logic.
     
     Args:
         text: Texto para generar embedding
         use_cache: Si usar cache de embeddings
+        priority: Prioridad en el planificador (INTERACTIVE para queries, BULK para ingesta)
+        index: Índice cuyo modelo se usa (por defecto, el activo)
         
     Returns:
         Lista de floats representando el embedding
@@ -46,87 +444,96 @@ def get_embedding(text: str, use_cache: bool = True) -> List[float]:
     if not text or not text.strip():
         raise ValueError("El texto no puede estar vacío")
     
+    index = index or embedding_indexes.active("pdf_chunks")
+    key = (index.model, index.vector_size, text)
+    
     # Verificar cache
-    if use_cache and text in embedding_cache:
+    if use_cache and key in embedding_cache:
+        EMBEDDING_CACHE.labels(result="hit").inc()
         logger.debug(f"Embedding encontrado en cache para texto de {len(text)} caracteres")
-        return embedding_cache[text]
+        return embedding_cache[key]
+    if use_cache:
+        EMBEDDING_CACHE.labels(result="miss").inc()
     
-    # Retry logic
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.debug(f"Generando embedding (intento {attempt + 1}) para texto de {len(text)} caracteres")
-            
-            response = client.embeddings.create(
-                model=EMBEDDING_MODEL,
-                input=text
-            )
-            
-            embedding = response.data[0].embedding
-            
-            # Guardar en cache
-            if use_cache:
-                embedding_cache[text] = embedding
-            
-            logger.debug(f"Embedding generado exitosamente")
-            return embedding
-            
-        except Exception as e:
-            logger.warning(f"Error generando embedding (intento {attempt + 1}): {e}")
-            if attempt == MAX_RETRIES - 1:
-                logger.error(f"Falló generación de embedding después de {MAX_RETRIES} intentos")
-                raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+    provider = get_embedding_provider(index)
+    embedding = embedding_flights.do(
+        flight_key(index.model, index.vector_size, text),
+        lambda: provider.embed([text], priority)[0]
+    )
+    
+    # Guardar en cache
+    if use_cache:
+        embedding_cache[key] = embedding
+    
+    logger.debug(f"Embedding generado exitosamente")
+    return embedding
 
-def get_embeddings_batch(texts: List[str], batch_size: int = 10) -> List[List[float]]:
+def get_embeddings_batch(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE,
+                         priority: str = BULK, index: Optional[EmbeddingIndex] = None,
+                         use_cache: bool = True) -> List[List[float]]:
     """
-    Genera embeddings para múltiples textos en lotes.
+    Genera embeddings para múltiples textos en lotes (una llamada a la API por lote).
+    
+    Los textos repetidos o ya cacheados no se envían a la API.
     
     Args:
         texts: Lista de textos
-        batch_size: Tamaño del lote
+        batch_size: Máximo de textos por llamada
+        priority: Prioridad en el planificador
+        index: Índice cuyo modelo se usa (por defecto, el activo)
+        use_cache: Si consultar y llenar el cache de embeddings
         
     Returns:
         Lista de embeddings
     """
-    all_embeddings = []
+    index = index or embedding_indexes.active("pdf_chunks")
+    found = {}
+    pending = []
+    for text in dict.fromkeys(texts):
+        cached = embedding_cache.get((index.model, index.vector_size, text)) if use_cache else None
+        if cached is not None:
+            EMBEDDING_CACHE.labels(result="hit").inc()
+            found[text] = cached
+        else:
+            if use_cache:
+                EMBEDDING_CACHE.labels(result="miss").inc()
+            pending.append(text)
     
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        logger.info(f"Procesando lote {i//batch_size + 1}: {len(batch)} textos")
-        
-        for text in batch:
-            embedding = get_embedding(text)
-            all_embeddings.append(embedding)
-        
-        # Pausa entre lotes para evitar rate limiting
-        if i + batch_size < len(texts):
-            time.sleep(1)
+    # Lotes limitados por cantidad de textos y por tokens estimados
+    batches, current, current_tokens = [], [], 0
+    for text in pending:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
     
-    return all_embeddings
+    # El planificador de rate limits regula el ritmo: no hace falta pausar entre lotes
+    provider = get_embedding_provider(index)
+    for i, batch in enumerate(batches):
+        logger.info(f"Procesando lote {i + 1}/{len(batches)}: {len(batch)} textos")
+        for text, embedding in zip(batch, provider.embed(batch, priority)):
+            if use_cache:
+                embedding_cache[(index.model, index.vector_size, text)] = embedding
+            found[text] = embedding
+    
+    return [found[text] for text in texts]
 
 
 # --- Colección ---
 def create_collection_if_not_exists(collection_name: str, vector_size: int = VECTOR_SIZE):
     """
-    Crea una colección en Qdrant si no existe.
+    Crea una colección en Qdrant si no existe y aplica la configuración declarada.
     
     Args:
         collection_name: Nombre de la colección
         vector_size: Tamaño del vector
     """
     try:
-        existing = [c.name for c in qdrant.get_collections().collections]
-        if collection_name not in existing:
-            qdrant.create_collection(
-                collection_name=collection_name,
-                vectors_config=models.VectorParams(
-                    size=vector_size,
-                    distance=models.Distance.COSINE
-                )
-            )
-            logger.info(f"Colección '{collection_name}' creada con éxito.")
-        else:
-            logger.debug(f"Colección '{collection_name}' ya existe.")
+        qdrant_collections.ensure(collection_name, vector_size)
     except Exception as e:
         logger.error(f"Error creando colección '{collection_name}': {e}")
         raise
@@ -136,87 +543,452 @@ def get_collection_info(collection_name: str) -> Dict[str, Any]:
     Obtiene información de una colección.
     
     Args:
-        collection_name: Nombre de la colección
+        collection_name: Nombre de la colección (una colección lógica se resuelve a su índice activo)
         
     Returns:
         Diccionario con información de la colección
     """
+    index = embedding_indexes.active(collection_name)
     try:
-        info = qdrant.get_collection(collection_name)
+        with observe_stage("qdrant_metadata"):
+            info = get_qdrant().get_collection(index.collection)
         return {
-            "name": info.name,
+            "name": index.collection,
+            "embedding_model": index.model,
+            "vector_size": index.vector_size,
             "vectors_count": info.vectors_count,
             "points_count": info.points_count,
             "segments_count": info.segments_count,
             "status": info.status
         }
     except Exception as e:
-        logger.error(f"Error obteniendo información de colección '{collection_name}': {e}")
+        logger.error(f"Error obteniendo información de colección '{index.collection}': {e}")
         return {}
 
+# --- Tenants ---
+def _tenant_filter(tenant: str, pdf_name: Optional[str] = None) -> models.Filter:
+    """Filtro que limita una operación a un tenant (y opcionalmente a un documento)."""
+    conditions = [models.FieldCondition(key="tenant", match=models.MatchValue(value=tenant))]
+    if pdf_name:
+        conditions.append(models.FieldCondition(key="doc", match=models.MatchValue(value=pdf_name)))
+    return models.Filter(must=conditions)
+
+def _scroll_all(collection_name: str, scroll_filter: Optional[models.Filter], with_payload: Any = True,
+                with_vectors: bool = False):
+    """Recorre todos los puntos que cumplen el filtro, paginando del lado de Qdrant."""
+    offset = None
+    while True:
+        with observe_stage("qdrant_scroll"):
+            points, offset = get_qdrant().scroll(
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=with_vectors
+            )
+        yield from points
+        if offset is None:
+            return
+
+def assign_default_tenant(collection_name: str = "pdf_chunks", tenant: str = DEFAULT_TENANT):
+    """Asigna un tenant a los puntos creados antes de la multi-tenancy."""
+    without_tenant = models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key="tenant"))])
+    with observe_stage("qdrant_metadata"):
+        pending = get_qdrant().count(collection_name, count_filter=without_tenant, exact=True).count
+    if pending:
+        get_qdrant().set_payload(collection_name, payload={"tenant": tenant}, points=without_tenant)
+        logger.info(f"{pending} puntos sin tenant asignados a '{tenant}' en '{collection_name}'")
+
+def migrate_payloads_to_store(collection_name: str = "pdf_chunks"):
+    """
+    Mueve al chunk store el texto y los metadatos de puntos creados con el esquema anterior
+    y los quita del payload de Qdrant.
+    """
+    with_text = models.Filter(must_not=[models.IsEmptyCondition(is_empty=models.PayloadField(key="text"))])
+    migrated = 0
+    batch = []
+    store = get_chunk_store()
+    for point in _scroll_all(collection_name, with_text):
+        batch.append(point)
+        if len(batch) >= SCROLL_PAGE_SIZE:
+            migrated += _migrate_points(collection_name, batch, store)
+            batch = []
+    if batch:
+        migrated += _migrate_points(collection_name, batch, store)
+    if migrated:
+        logger.info(f"{migrated} puntos de '{collection_name}' migrados al chunk store")
+
+def _migrate_points(collection_name: str, points: List[Any], store: ChunkStore) -> int:
+    documents = {}
+    for p in points:
+        key = (p.payload.get("tenant", DEFAULT_TENANT), p.payload["doc"])
+        documents.setdefault(key, (
+            *key, p.payload.get("title", ""), p.payload.get("author", ""), p.payload.get("created_at", "")
+        ))
+    store.put_documents(documents.values())
+    store.put_chunks(
+        (p.id, p.payload.get("tenant", DEFAULT_TENANT), p.payload["doc"],
+         p.payload.get("page", 0), p.payload["text"])
+        for p in points
+    )
+    store.refresh_document_stats(documents)
+    get_qdrant().delete_payload(
+        collection_name=collection_name,
+        keys=LEGACY_PAYLOAD_FIELDS,
+        points=[p.id for p in points]
+    )
+    return len(points)
+
 # --- Guardar Chunks ---
-def store_chunks(chunks: List[Dict], collection_name: str = "pdf_chunks", vector_size: int = VECTOR_SIZE):
+def _upsert_points(collection_name: str, points: List[PointStruct]):
+    for i in range(0, len(points), UPSERT_BATCH_SIZE):
+        with observe_stage("qdrant_upsert"):
+            get_qdrant().upsert(collection_name=collection_name, points=points[i:i + UPSERT_BATCH_SIZE])
+
+def _store_batch(batch: List[Dict], targets: List[EmbeddingIndex], tenant: str,
+                 point_ids: Optional[List[str]] = None) -> int:
     """
-    Almacena chunks de texto en Qdrant con procesamiento por lotes.
+    Genera los embeddings de un lote de chunks, guarda el texto en el chunk store y sube los vectores a Qdrant.
+    
+    El texto se escribe antes del upsert para que un punto nunca sea
+    buscable sin su texto. Durante una migración de modelo los mismos puntos
+    se escriben también en el índice sombra; si esa escritura falla la
+    ingesta sigue adelante y la migración completa los puntos que falten.
     
     Args:
-        chunks: Lista de diccionarios con chunks
+        batch: Chunks a guardar
+        targets: Índice activo seguido de los índices sombra
+        tenant: Tenant dueño de los chunks
+        point_ids: Ids de los puntos (uno por chunk); reintentar con los mismos ids
+            sobrescribe lo que un intento fallido alcanzó a subir en vez de duplicarlo
+    
+    Returns:
+        Número de puntos almacenados
+    """
+    active, *shadows = targets
+    texts = [chunk["chunk"] for chunk in batch]
+    embeddings = get_embeddings_batch(texts, index=active)
+    
+    # Crear puntos: el payload solo lleva los campos usados en filtros
+    point_ids = point_ids or [str(uuid.uuid4()) for _ in batch]
+    payloads = [{"tenant": tenant, "doc": chunk["doc"]} for chunk in batch]
+    get_chunk_store().put_chunks(
+        (point_id, tenant, chunk["doc"], chunk["page"], chunk["chunk"], chunk.get("pages"))
+        for point_id, chunk in zip(point_ids, batch)
+    )
+    _upsert_points(active.collection, [
+        PointStruct(id=point_id, vector=embedding, payload=payload)
+        for point_id, embedding, payload in zip(point_ids, embeddings, payloads)
+    ])
+    
+    for shadow in shadows:
+        try:
+            shadow_embeddings = get_embeddings_batch(texts, index=shadow, use_cache=False)
+            _upsert_points(shadow.collection, [
+                PointStruct(id=point_id, vector=embedding, payload=payload)
+                for point_id, embedding, payload in zip(point_ids, shadow_embeddings, payloads)
+            ])
+        except Exception as e:
+            logger.warning(f"Error escribiendo en el índice sombra '{shadow.collection}': {e}")
+    
+    return len(point_ids)
+
+def store_chunks_multi(chunks: List[Dict], collection_name: str = "pdf_chunks",
+                       vector_size: int = VECTOR_SIZE, tenant: str = DEFAULT_TENANT,
+                       delete_failed: bool = True) -> Dict[str, str]:
+    """
+    Almacena chunks de uno o varios documentos compartiendo lotes de embeddings y upserts.
+    
+    Los chunks de todos los documentos se agrupan en lotes completos que se
+    procesan en paralelo. Si un lote falla, se reintenta por documento para
+    que un documento problemático no arrastre al resto; los documentos que
+    fallan se eliminan para no dejar puntos parciales. La fila de cada
+    documento se registra al final, solo para los que se guardaron completos.
+    
+    Args:
+        chunks: Lista de diccionarios con chunks (campo "doc" identifica el documento;
+            "point_id", si está, fija el id del punto y hace idempotente repetir la carga)
         collection_name: Nombre de la colección
-        vector_size: Tamaño del vector
+        vector_size: Sin efecto, se mantiene por compatibilidad (el tamaño lo define el índice de la colección)
+        tenant: Tenant dueño de los documentos
+        delete_failed: False deja los puntos de los documentos fallidos para que los limpie quien llama
+        
+    Returns:
+        Diccionario {documento: error} con los documentos que no se pudieron almacenar
     """
     if not chunks:
         logger.warning("No hay chunks para almacenar")
-        return
+        return {}
     
-    try:
-        create_collection_if_not_exists(collection_name, vector_size)
-        
-        # Procesar en lotes para mejor performance
-        batch_size = 50
-        total_points = []
-        
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]
-            logger.info(f"Procesando lote {i//batch_size + 1}: {len(batch)} chunks")
-            
-            # Generar embeddings en lote
-            texts = [chunk["chunk"] for chunk in batch]
-            embeddings = get_embeddings_batch(texts, batch_size=10)
-            
-            # Crear puntos
-            points = []
-            for j, (chunk, embedding) in enumerate(zip(batch, embeddings)):
-                point = PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding,
-                    payload={
-                        "text": chunk["chunk"],
-                        "doc": chunk["doc"],
-                        "page": chunk["page"],
-                        "title": chunk.get("title", ""),
-                        "author": chunk.get("author", ""),
-                        "char_count": chunk.get("char_count", 0),
-                        "created_at": datetime.now().isoformat()
-                    }
-                )
-                points.append(point)
-            
-            # Almacenar lote
-            qdrant.upsert(collection_name=collection_name, points=points)
-            total_points.extend(points)
-            
-            logger.info(f"Lote {i//batch_size + 1} almacenado: {len(points)} puntos")
-        
-        logger.info(f"Total de {len(total_points)} chunks almacenados en '{collection_name}'")
+    targets = embedding_indexes.targets(collection_name)
+    for index in targets:
+        create_collection_if_not_exists(index.collection, index.vector_size)
+    
+    # Metadatos por documento (una fila por documento, no por chunk)
+    created_at = datetime.now().isoformat()
+    documents = {}
+    for chunk in chunks:
+        documents.setdefault(chunk["doc"], (
+            tenant, chunk["doc"], chunk.get("title", ""), chunk.get("author", ""), created_at
+        ))
+    
+    batches = [chunks[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE)]
+    failed: Dict[str, str] = {}
+    failed_lock = threading.Lock()
+    
+    def process(batch: List[Dict]):
+        # Índices resueltos por lote: una migración que empieza durante una ingesta larga recibe el resto
+        targets = embedding_indexes.targets(collection_name)
+        point_ids = [chunk.get("point_id") or str(uuid.uuid4()) for chunk in batch]
+        try:
+            _store_batch(batch, targets, tenant, point_ids)
+            return
+        except Exception as e:
+            by_doc: Dict[str, List[Dict]] = {}
+            doc_ids: Dict[str, List[str]] = {}
+            for chunk, point_id in zip(batch, point_ids):
+                by_doc.setdefault(chunk["doc"], []).append(chunk)
+                doc_ids.setdefault(chunk["doc"], []).append(point_id)
+            if len(by_doc) == 1:
+                with failed_lock:
+                    failed.setdefault(batch[0]["doc"], str(e))
+                return
         
+        logger.warning(f"Lote compartido falló, reintentando por documento ({len(by_doc)} documentos)")
+        for doc, doc_chunks in by_doc.items():
+            try:
+                # Mismos ids que el intento compartido: los puntos que alcanzó a subir se sobrescriben
+                _store_batch(doc_chunks, targets, tenant, doc_ids[doc])
+            except Exception as e:
+                with failed_lock:
+                    failed.setdefault(doc, str(e))
+    
+    logger.info(f"Almacenando {len(chunks)} chunks en {len(batches)} lotes")
+    # Cargas grandes: sin indexar durante los upserts, el índice se construye una vez al final
+    bulk = len(chunks) >= BULK_LOAD_MIN_CHUNKS
+    with ExitStack() as stack:
+        if bulk:
+            # Solo el índice activo: el modo de carga del índice sombra lo maneja la migración,
+            # y al salir de aquí reactivaría el índice en plena migración
+            stack.enter_context(qdrant_collections.bulk_load(targets[0].collection, targets[0].vector_size))
+        # copy_context() por tarea para que los spans del trace de la petición sigan registrándose
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, process, batch) for batch in batches]
+            for future in futures:
+                future.result()
+    
+    for doc, error in failed.items():
+        logger.error(f"Error almacenando chunks de '{doc}': {error}")
+        if delete_failed:
+            delete_pdf(doc, collection_name, tenant)
+    # La fila del documento se escribe después de los upserts y solo si todos sus lotes se guardaron:
+    # un documento listado siempre es buscable
+    get_chunk_store().put_documents(row for doc, row in documents.items() if doc not in failed)
+    # Contadores del documento calculados una vez al terminar, no en cada lectura de estadísticas
+    stored_keys = [(tenant, doc) for doc in documents if doc not in failed]
+    get_chunk_store().refresh_document_stats(stored_keys)
+    for index in embedding_indexes.targets(collection_name):
+        try:
+            refresh_summaries(index, stored_keys)
+        except Exception as e:
+            # Sin resumen el documento sigue siendo buscable: el warmup completa los que falten
+            logger.warning(f"Error generando los vectores de resumen en '{index.collection}': {e}")
+    
+    stored = len(chunks) - sum(1 for c in chunks if c["doc"] in failed)
+    logger.info(f"Total de {stored} chunks almacenados en '{targets[0].collection}'")
+    return failed
+
+def store_chunks(chunks: List[Dict], collection_name: str = "pdf_chunks", vector_size: int = VECTOR_SIZE,
+                 tenant: str = DEFAULT_TENANT):
+    """
+    Almacena chunks de texto en Qdrant con procesamiento por lotes.
+    
+    Args:
+        chunks: Lista de diccionarios con chunks
+        collection_name: Nombre de la colección
+        vector_size: Tamaño del vector
+        tenant: Tenant dueño de los documentos
+    """
+    try:
+        failed = store_chunks_multi(chunks, collection_name, vector_size, tenant)
+        if failed:
+            raise RuntimeError("; ".join(f"{doc}: {error}" for doc, error in failed.items()))
     except Exception as e:
         logger.error(f"Error almacenando chunks: {e}")
         raise
 
 
+# --- Vectores de Resumen ---
+def refresh_summaries(index: EmbeddingIndex, keys: Iterable[Tuple[str, str]]) -> int:
+    """
+    Recalcula los vectores de resumen (documento y secciones) de los documentos indicados.
+    
+    Los resúmenes son centroides de los vectores de chunks ya almacenados, así
+    que no llaman a la API de embeddings. Se guardan en una colección aparte
+    (summary_collection_name) con el mismo modelo y dimensión que el índice.
+    
+    Args:
+        index: Índice (colección física) cuyos chunks se resumen
+        keys: Pares (tenant, doc)
+    
+    Returns:
+        Número de documentos con resumen
+    """
+    if not HIERARCHICAL_SEARCH:
+        return 0
+    summaries = summary_collection_name(index.collection)
+    create_collection_if_not_exists(summaries, index.vector_size)
+    store = get_chunk_store()
+    refreshed = 0
+    for tenant, doc in keys:
+        doc_filter = _tenant_filter(tenant, doc)
+        vectors = {
+            str(p.id): p.vector
+            for p in _scroll_all(index.collection, doc_filter, with_payload=False, with_vectors=True)
+        }
+        rows = store.get_chunks(list(vectors))
+        points = summary_points(tenant, doc, (
+            (row[2], vectors[point_id]) for point_id, row in rows.items()
+        ))
+        if points:
+            _upsert_points(summaries, [
+                PointStruct(id=point_id, vector=vector, payload=payload)
+                for point_id, vector, payload in points
+            ])
+            refreshed += 1
+        # Secciones que ya no existen (el documento se reemplazó por uno más corto)
+        with observe_stage("qdrant_delete"):
+            get_qdrant().delete(
+                collection_name=summaries,
+                points_selector=models.FilterSelector(filter=models.Filter(
+                    must=doc_filter.must,
+                    must_not=[models.HasIdCondition(has_id=[point_id for point_id, _, _ in points])]
+                ))
+            )
+    return refreshed
+
+def backfill_summaries(index: EmbeddingIndex) -> int:
+    """
+    Genera los resúmenes de los documentos que no tienen (corpus anteriores a la búsqueda jerárquica).
+    
+    Returns:
+        Número de documentos procesados
+    """
+    if not HIERARCHICAL_SEARCH:
+        return 0
+    summaries = summary_collection_name(index.collection)
+    existing = set()
+    if qdrant_collections.exists(summaries):
+        documents_only = models.Filter(must=[models.FieldCondition(key="level", match=models.MatchValue(value=DOCUMENT))])
+        existing = {
+            (p.payload["tenant"], p.payload["doc"])
+            for p in _scroll_all(summaries, documents_only, with_payload=["tenant", "doc"])
+        }
+    missing = [key for key in get_chunk_store().document_keys() if key not in existing]
+    if missing:
+        refreshed = refresh_summaries(index, missing)
+        logger.info(f"Vectores de resumen generados para {refreshed} documentos en '{summaries}'")
+    return len(missing)
+
+def _level_filter(tenant: str, level: str) -> models.Filter:
+    return models.Filter(must=_tenant_filter(tenant).must + [
+        models.FieldCondition(key="level", match=models.MatchValue(value=level))
+    ])
+
+def _search_filters(index: EmbeddingIndex, embeddings: List[List[float]], tenant: str,
+                    pdf_name: Optional[str]) -> List[models.Filter]:
+    """
+    Filtro de la búsqueda de chunks de cada consulta.
+    
+    Sin pdf_name y con al menos HIERARCHICAL_MIN_DOCUMENTS documentos, una
+    primera etapa busca en los vectores de resumen (documentos y secciones de
+    todas las consultas en una sola llamada a search_batch) y limita cada
+    consulta a sus documentos candidatos. Así el costo de la búsqueda de
+    chunks depende de los candidatos y no del total de chunks del tenant.
+    Si no hay resúmenes o la primera etapa falla, la búsqueda es plana.
+    """
+    flat = _tenant_filter(tenant, pdf_name)
+    if not HIERARCHICAL_SEARCH or pdf_name:
+        return [flat for _ in embeddings]
+    summaries = summary_collection_name(index.collection)
+    try:
+        if get_chunk_store().tenant_stats(tenant)["documents"] < HIERARCHICAL_MIN_DOCUMENTS \
+                or not qdrant_collections.exists(summaries):
+            return [flat for _ in embeddings]
+        requests = []
+        for embedding in embeddings:
+            requests.append(models.SearchRequest(
+                vector=embedding, filter=_level_filter(tenant, DOCUMENT),
+                limit=HIERARCHICAL_DOCUMENTS, with_payload=["doc"]
+            ))
+            requests.append(models.SearchRequest(
+                vector=embedding, filter=_level_filter(tenant, SECTION),
+                limit=HIERARCHICAL_SECTIONS, with_payload=["doc"]
+            ))
+        with observe_stage("qdrant_summary_search"):
+            results = get_qdrant_search().search_batch(collection_name=summaries, requests=requests)
+    except Exception as e:
+        logger.warning(f"Búsqueda en los resúmenes falló, se busca en todos los documentos: {e}")
+        qdrant_collections.invalidate(summaries)
+        return [flat for _ in embeddings]
+    
+    filters = []
+    for documents, sections in zip(results[0::2], results[1::2]):
+        docs = candidate_documents(
+            ((r.payload["doc"], r.score) for r in documents + sections), HIERARCHICAL_DOCUMENTS
+        )
+        if not docs:
+            filters.append(flat)
+            continue
+        filters.append(models.Filter(must=flat.must + [
+            models.FieldCondition(key="doc", match=models.MatchAny(any=docs))
+        ]))
+    logger.info(f"Búsqueda jerárquica: {len(embeddings)} consultas limitadas a sus documentos candidatos")
+    return filters
+
+
 # --- Buscar Chunks ---
+def _select_results(embedding: List[float], results: List[Any], top_k: int, min_score: float) -> List[Any]:
+    """Filtra por score mínimo (bajándolo si no queda nada) y elige los top_k, con MMR si está activo."""
+    # Filtrar por score mínimo
+    filtered_results = [r for r in results if r.score >= min_score]
+    
+    # Si no hay resultados con el score mínimo, usar un score más bajo
+    if not filtered_results and results:
+        logger.info(f"No se encontraron resultados con score >= {min_score}, usando score más bajo")
+        lower_score = min_score * 0.7  # Reducir el score en 30%
+        filtered_results = [r for r in results if r.score >= lower_score]
+    
+    # Tomar los top_k mejores; con MMR se evitan casi duplicados (chunks solapados)
+    if MMR_ENABLED and len(filtered_results) > 1:
+        with observe_stage("rerank"):
+            selected = mmr_select(
+                embedding,
+                [r.vector for r in filtered_results],
+                top_k,
+                lambda_mult=MMR_LAMBDA,
+                max_similarity=MMR_MAX_SIMILARITY
+            )
+        return [filtered_results[i] for i in selected]
+    return filtered_results[:top_k]
+
+def _fetch_texts(point_ids: List[Any], tenant: str) -> Dict[str, str]:
+    """Textos de los resultados de una búsqueda; cuenta la búsqueda en las estadísticas de sus documentos."""
+    rows = get_chunk_store().get_chunks(point_ids)
+    query_stats.record(tenant, (doc for _, doc, *_ in rows.values()))
+    return {point_id: row[3] for point_id, row in rows.items()}
+
+def _result_texts(results: List[Any], texts: Dict[str, str]) -> List[str]:
+    valid_results = []
+    for r in results:
+        text = texts.get(str(r.id), "")
+        if text and text.strip():
+            valid_results.append(text)
+    return valid_results
+
 def search_chunks(query: str, top_k: int = 5, collection_name: str = "pdf_chunks", 
-                 pdf_name: str = None, min_score: float = 0.7) -> List[str]:
+                 pdf_name: str = None, min_score: float = 0.7, tenant: str = DEFAULT_TENANT) -> List[str]:
     """
     Busca chunks similares usando embeddings.
     
@@ -226,6 +998,7 @@ def search_chunks(query: str, top_k: int = 5, collection_name: str = "pdf_chunks
         collection_name: Nombre de la colección
         pdf_name: Filtrar por PDF específico
         min_score: Score mínimo de similitud
+        tenant: Tenant al que se limita la búsqueda
         
     Returns:
         Lista de textos de chunks encontrados
@@ -234,11 +1007,13 @@ def search_chunks(query: str, top_k: int = 5, collection_name: str = "pdf_chunks
         logger.warning("Query de búsqueda vacía")
         return []
     
-    # Verificar que la colección existe
+    # Índice activo resuelto una vez: la consulta y la búsqueda usan el mismo modelo aunque haya un cambio en curso
+    index = embedding_indexes.active(collection_name)
+    
+    # Verificar que la colección existe (cacheado: sin round trip una vez conocida)
     try:
-        existing = [c.name for c in qdrant.get_collections().collections]
-        if collection_name not in existing:
-            logger.warning(f"Colección '{collection_name}' no existe")
+        if not qdrant_collections.exists(index.collection):
+            logger.warning(f"Colección '{index.collection}' no existe")
             return []
     except Exception as e:
         logger.error(f"Error verificando colección: {e}")
@@ -248,16 +1023,10 @@ def search_chunks(query: str, top_k: int = 5, collection_name: str = "pdf_chunks
     if not query.strip() and pdf_name:
         logger.info(f"Obteniendo chunks aleatorios del PDF: {pdf_name}")
         try:
-            points, _ = qdrant.scroll(collection_name=collection_name, limit=10000)
-            pdf_points = [p for p in points if p.payload.get("doc") == pdf_name]
-            
-            if not pdf_points:
+            chunks = get_chunk_store().document_chunks(tenant, pdf_name, limit=top_k)
+            if not chunks:
                 logger.warning(f"No se encontraron puntos para el PDF: {pdf_name}")
-                return []
-            
-            # Tomar los primeros top_k chunks
-            selected_points = pdf_points[:top_k]
-            return [p.payload["text"] for p in selected_points]
+            return chunks
             
         except Exception as e:
             logger.error(f"Error obteniendo chunks del PDF {pdf_name}: {e}")
@@ -266,63 +1035,100 @@ def search_chunks(query: str, top_k: int = 5, collection_name: str = "pdf_chunks
     try:
         # Generar embedding para la query
         logger.info(f"Generando embedding para query: '{query[:50]}...'")
-        embedding = get_embedding(query.strip())
+        embedding = get_embedding(query.strip(), index=index)
         
-        # Crear filtro si se especifica pdf_name
-        qdrant_filter = None
+        # Filtrar siempre por tenant (del lado del servidor) y por PDF o documentos candidatos
+        qdrant_filter = _search_filters(index, [embedding], tenant, pdf_name)[0]
         if pdf_name:
-            qdrant_filter = models.Filter(
-                must=[models.FieldCondition(
-                    key="doc",
-                    match=models.MatchValue(value=pdf_name)
-                )]
-            )
             logger.info(f"Buscando en PDF específico: {pdf_name}")
         
         # Buscar en Qdrant con más resultados para tener opciones de filtrado
         search_limit = max(top_k * 3, 20)  # Buscar al menos 20 resultados
-        results = qdrant.search(
-            collection_name=collection_name,
-            query_vector=embedding,
-            limit=search_limit,
-            query_filter=qdrant_filter,
-            with_payload=True,
-            with_vectors=False
-        )
+        with observe_stage("qdrant_search"):
+            results = get_qdrant_search().search(
+                collection_name=index.collection,
+                query_vector=embedding,
+                limit=search_limit,
+                query_filter=qdrant_filter,
+                with_payload=False,
+                with_vectors=MMR_ENABLED  # el reranking necesita los vectores de los candidatos
+            )
         
         if not results:
             logger.warning("No se encontraron resultados en la búsqueda vectorial")
+            query_stats.record(tenant)
             return []
         
-        # Filtrar por score mínimo
-        filtered_results = [r for r in results if r.score >= min_score]
-        
-        # Si no hay resultados con el score mínimo, usar un score más bajo
-        if not filtered_results and results:
-            logger.info(f"No se encontraron resultados con score >= {min_score}, usando score más bajo")
-            lower_score = min_score * 0.7  # Reducir el score en 30%
-            filtered_results = [r for r in results if r.score >= lower_score]
-        
-        # Tomar solo los top_k mejores
-        final_results = filtered_results[:top_k]
-        
+        final_results = _select_results(embedding, results, top_k, min_score)
         logger.info(f"Búsqueda completada: {len(final_results)} resultados (score >= {min_score})")
         
-        # Verificar que los resultados tienen texto válido
-        valid_results = []
-        for r in final_results:
-            text = r.payload.get("text", "")
-            if text and text.strip():
-                valid_results.append(text)
-        
-        return valid_results
+        # Traer el texto solo de los resultados finales, en una consulta al chunk store
+        texts = _fetch_texts([r.id for r in final_results], tenant)
+        return _result_texts(final_results, texts)
         
     except Exception as e:
         logger.error(f"Error en búsqueda: {e}")
+        # La colección pudo haber sido borrada desde fuera: volver a verificarla en la próxima búsqueda
+        qdrant_collections.invalidate(index.collection)
+        return []
+
+def search_chunks_batch(queries: List[str], top_k: int = 5, collection_name: str = "pdf_chunks",
+                        pdf_name: str = None, min_score: float = 0.7, tenant: str = DEFAULT_TENANT,
+                        priority: str = BULK) -> List[List[str]]:
+    """
+    Igual que search_chunks para muchas consultas a la vez.
+    
+    Los embeddings se piden en lotes (get_embeddings_batch), las búsquedas van
+    a Qdrant en una sola llamada a search_batch (dos con la búsqueda
+    jerárquica: resúmenes y chunks) y los textos de todos los resultados se
+    leen del chunk store en una consulta.
+    
+    Returns:
+        Una lista de textos por consulta, en el mismo orden
+    """
+    if not queries:
         return []
+    index = embedding_indexes.active(collection_name)
+    if not qdrant_collections.exists(index.collection):
+        logger.warning(f"Colección '{index.collection}' no existe")
+        return [[] for _ in queries]
+    
+    embeddings = get_embeddings_batch([q.strip() for q in queries], priority=priority, index=index)
+    filters = _search_filters(index, embeddings, tenant, pdf_name)
+    search_limit = max(top_k * 3, 20)
+    try:
+        with observe_stage("qdrant_search"):
+            batch_results = get_qdrant_search().search_batch(
+                collection_name=index.collection,
+                requests=[
+                    models.SearchRequest(
+                        vector=embedding,
+                        filter=qdrant_filter,
+                        limit=search_limit,
+                        with_payload=False,
+                        with_vector=MMR_ENABLED
+                    )
+                    for embedding, qdrant_filter in zip(embeddings, filters)
+                ]
+            )
+    except Exception:
+        qdrant_collections.invalidate(index.collection)
+        raise
+    
+    selected = [
+        _select_results(embedding, results, top_k, min_score)
+        for embedding, results in zip(embeddings, batch_results)
+    ]
+    rows = get_chunk_store().get_chunks([r.id for results in selected for r in results])
+    texts = {point_id: row[3] for point_id, row in rows.items()}
+    for results in selected:
+        query_stats.record(tenant, (rows[str(r.id)][1] for r in results if str(r.id) in rows))
+    logger.info(f"Búsqueda por lote completada: {len(queries)} consultas")
+    return [_result_texts(results, texts) for results in selected]
 
 def search_chunks_hybrid(query: str, top_k: int = 5, collection_name: str = "pdf_chunks",
-                        pdf_name: str = None, text_weight: float = 0.3) -> List[Dict[str, Any]]:
+                        pdf_name: str = None, text_weight: float = 0.3,
+                        tenant: str = DEFAULT_TENANT) -> List[Dict[str, Any]]:
     """
     Búsqueda híbrida combinando embeddings y búsqueda de texto.
     
@@ -332,16 +1138,17 @@ def search_chunks_hybrid(query: str, top_k: int = 5, collection_name: str = "pdf
         collection_name: Nombre de la colección
         pdf_name: Filtrar por PDF específico
         text_weight: Peso para búsqueda de texto (0-1)
+        tenant: Tenant al que se limita la búsqueda
         
     Returns:
         Lista de diccionarios con resultados y metadatos
     """
     try:
         # Búsqueda por embeddings
-        embedding_results = search_chunks(query, top_k, collection_name, pdf_name)
+        embedding_results = search_chunks(query, top_k, collection_name, pdf_name, tenant=tenant)
         
         # Búsqueda por texto (simulada - en una implementación real usarías un índice de texto)
-        text_results = search_by_text(query, top_k, collection_name, pdf_name)
+        text_results = search_by_text(query, top_k, collection_name, pdf_name, tenant)
         
         # Combinar resultados
         combined_results = []
@@ -374,7 +1181,8 @@ def search_chunks_hybrid(query: str, top_k: int = 5, collection_name: str = "pdf
         logger.error(f"Error en búsqueda híbrida: {e}")
         return []
 
-def search_by_text(query: str, top_k: int, collection_name: str, pdf_name: str = None) -> List[str]:
+def search_by_text(query: str, top_k: int, collection_name: str, pdf_name: str = None,
+                   tenant: str = DEFAULT_TENANT) -> List[str]:
     """
     Búsqueda simple por texto (placeholder para implementación futura).
     """
@@ -383,22 +1191,18 @@ def search_by_text(query: str, top_k: int, collection_name: str, pdf_name: str =
     # - PostgreSQL con full-text search
     # - Qdrant con payload index
     try:
-        # Obtener todos los puntos y filtrar por texto
-        points, _ = qdrant.scroll(collection_name=collection_name, limit=10000)
-        
-        # Filtrar por PDF si se especifica
-        if pdf_name:
-            points = [p for p in points if p.payload.get("doc") == pdf_name]
+        # Recorrer los textos del tenant (y del PDF si se especifica) en el chunk store local
+        texts = get_chunk_store().iter_texts(tenant, pdf_name)
         
         # Búsqueda simple por palabras clave
         query_words = query.lower().split()
         results = []
         
-        for point in points:
-            text = point.payload.get("text", "").lower()
+        for original in texts:
+            text = original.lower()
             score = sum(1 for word in query_words if word in text)
             if score > 0:
-                results.append((point.payload["text"], score))
+                results.append((original, score))
         
         # Ordenar por score y tomar top_k
         results.sort(key=lambda x: x[1], reverse=True)
@@ -408,7 +1212,8 @@ def search_by_text(query: str, top_k: int, collection_name: str, pdf_name: str =
         logger.error(f"Error en búsqueda por texto: {e}")
         return []
 
-def get_pdf_chunks(pdf_name: str, top_k: int = 10, collection_name: str = "pdf_chunks") -> List[str]:
+def get_pdf_chunks(pdf_name: str, top_k: int = 10, collection_name: str = "pdf_chunks",
+                   tenant: str = DEFAULT_TENANT) -> List[str]:
     """
     Obtiene chunks de un PDF específico sin necesidad de query.
     
@@ -416,25 +1221,19 @@ def get_pdf_chunks(pdf_name: str, top_k: int = 10, collection_name: str = "pdf_c
         pdf_name: Nombre del PDF
         top_k: Número máximo de chunks a retornar
         collection_name: Nombre de la colección
+        tenant: Tenant dueño del PDF
         
     Returns:
         Lista de chunks del PDF
     """
     try:
-        points, _ = qdrant.scroll(collection_name=collection_name, limit=10000)
-        pdf_points = [p for p in points if p.payload.get("doc") == pdf_name]
+        # Ordenados por página para mantener orden lógico
+        chunks = get_chunk_store().document_chunks(tenant, pdf_name, limit=top_k)
         
-        if not pdf_points:
+        if not chunks:
             logger.warning(f"No se encontraron chunks para el PDF: {pdf_name}")
             return []
         
-        # Ordenar por página para mantener orden lógico
-        pdf_points.sort(key=lambda p: p.payload.get("page", 0))
-        
-        # Tomar los primeros top_k chunks
-        selected_points = pdf_points[:top_k]
-        chunks = [p.payload["text"] for p in selected_points]
-        
         logger.info(f"Obtenidos {len(chunks)} chunks del PDF: {pdf_name}")
         return chunks
         
@@ -445,8 +1244,182 @@ def get_pdf_chunks(pdf_name: str, top_k: int = 10, collection_name: str = "pdf_c
 
 
 # --- Generar Respuesta ---
+def create_chat_completion(messages: List[Dict[str, str]], model: str = CHAT_MODEL,
+                           temperature: float = 0.2, max_tokens: int = 1000,
+                           priority: str = INTERACTIVE):
+    """
+    Llama al endpoint de chat respetando los rate limits y reintentando errores transitorios.
+    
+    Args:
+        messages: Mensajes de la conversación
+        model: Modelo de IA a usar
+        temperature: Temperatura para la generación
+        max_tokens: Máximo de tokens de la respuesta
+        priority: Prioridad en el planificador
+        
+    Returns:
+        Respuesta de la API de chat
+    """
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    tokens = prompt_chars // 4 + max_tokens
+    
+    for attempt in range(MAX_RETRIES):
+        try:
+            openai_scheduler.acquire(model, tokens, priority)
+            with observe_stage("chat_completion"):
+                raw = get_openai_client().chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=REQUEST_TIMEOUT
+                )
+            openai_scheduler.update_from_headers(model, raw.headers)
+            response = raw.parse()
+            record_usage(model, response.usage)
+            return response
+        
+        except Exception as e:
+            logger.warning(f"Error en chat completion (intento {attempt + 1}): {e}")
+            if isinstance(e, RateLimitError):
+                OPENAI_RATE_LIMITED.labels(operation="chat").inc()
+            if attempt == MAX_RETRIES - 1 or not isinstance(e, RETRYABLE_ERRORS):
+                raise
+            OPENAI_RETRIES.labels(operation="chat").inc()
+            _wait_before_retry(model, e, attempt)
+
+def stream_chat_completion(messages: List[Dict[str, str]], model: str = CHAT_MODEL,
+                           temperature: float = 0.2, max_tokens: int = 1000,
+                           priority: str = INTERACTIVE) -> Iterator[str]:
+    """
+    Llama al endpoint de chat en streaming y entrega el texto por fragmentos.
+
+    Registra el tiempo hasta el primer token en la etapa "chat_first_token".
+    Los errores transitorios se reintentan solo antes de recibir el primer
+    fragmento; después se propagan para no duplicar texto ya entregado.
+
+    Yields:
+        Fragmentos de la respuesta
+    """
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    tokens = prompt_chars // 4 + max_tokens
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            openai_scheduler.acquire(model, tokens, priority)
+            start = time.perf_counter()
+            raw = get_openai_client().chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=REQUEST_TIMEOUT
+            )
+            openai_scheduler.update_from_headers(model, raw.headers)
+            stream = raw.parse()
+            break
+        except Exception as e:
+            logger.warning(f"Error en chat completion en streaming (intento {attempt + 1}): {e}")
+            if isinstance(e, RateLimitError):
+                OPENAI_RATE_LIMITED.labels(operation="chat").inc()
+            if attempt == MAX_RETRIES - 1 or not isinstance(e, RETRYABLE_ERRORS):
+                raise
+            OPENAI_RETRIES.labels(operation="chat").inc()
+            _wait_before_retry(model, e, attempt)
+
+    # Sin span: el cuerpo se consume después de enviar las cabeceras (y Server-Timing)
+    first_token = True
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                record_usage(model, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token:
+                observe_duration("chat_first_token", time.perf_counter() - start)
+                first_token = False
+            yield delta
+    finally:
+        stream.close()
+        observe_duration("chat_completion", time.perf_counter() - start)
+
+# Prompt de sistema fijo: el prefijo (sistema + contexto) es idéntico entre
+# turnos de una sesión y el proveedor puede reutilizarlo desde su cache
+SYSTEM_PROMPT = (
+    "Eres un asistente experto en análisis de documentos. Responde de manera clara, "
+    "precisa y basada únicamente en el contexto proporcionado. Si el contexto no "
+    "contiene la respuesta, dilo."
+)
+MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "8000"))  # Aproximadamente 2000 palabras
+
+# Indicaciones según el tipo de tarea: van al final del último mensaje para no alterar el prefijo
+TASK_HINTS = (
+    (("resumen", "resume"), "Crea un resumen claro y conciso, estructurado y fácil de entender."),
+    (("comparar", "diferencias"), "Identifica similitudes y diferencias de manera clara y estructurada."),
+    (("clasificar", "temas"), "Organiza la información en temas claros y específicos."),
+)
+
+def _task_hint(question: str) -> str:
+    lowered = question.lower()
+    for keywords, hint in TASK_HINTS:
+        if any(k in lowered for k in keywords):
+            return hint
+    return ""
+
+def build_answer_messages(question: str, context_chunks: List[str],
+                          history: Optional[List[Dict[str, str]]] = None,
+                          max_context_chars: int = MAX_CONTEXT_CHARS) -> Optional[List[Dict[str, str]]]:
+    """
+    Arma los mensajes del chat con el contenido estable primero.
+
+    Orden: prompt de sistema fijo, contexto de los documentos, historial de la
+    sesión y, al final, la pregunta nueva con la indicación de la tarea. Así
+    los turnos siguientes de una sesión comparten el prefijo completo y solo
+    agregan mensajes al final.
+
+    Returns:
+        Lista de mensajes, o None si no hay contexto útil
+    """
+    # Filtrar chunks vacíos o muy cortos
+    valid_chunks = [chunk for chunk in context_chunks if chunk and len(chunk.strip()) > 10]
+    if not valid_chunks:
+        return None
+
+    context_text = "\n".join(valid_chunks)
+    if len(context_text) > max_context_chars:
+        # Truncar contexto manteniendo los chunks más relevantes
+        context_text = context_text[:max_context_chars] + "..."
+        logger.warning(f"Contexto truncado a {max_context_chars} caracteres")
+
+    hint = _task_hint(question)
+    instructions = f"{hint} Responde de manera clara y estructurada:" if hint else "Responde de manera clara y estructurada:"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": f"Contexto:\n{context_text}"},
+        *(history or []),
+        {"role": "user", "content": f"Pregunta: {question}\n\n{instructions}"}
+    ]
+
+def _answer_messages_or_reason(question: str, context_chunks: List[str],
+                               history: Optional[List[Dict[str, str]]]):
+    if not question or not question.strip():
+        raise ValueError("La pregunta no puede estar vacía")
+    if not context_chunks:
+        return None, "No tengo suficiente información para responder tu pregunta."
+    messages = build_answer_messages(question, context_chunks, history)
+    if messages is None:
+        return None, "No encontré información útil en los documentos para responder tu pregunta."
+    return messages, None
+
 def generate_answer(question: str, context_chunks: List[str], 
-                   model: str = CHAT_MODEL, temperature: float = 0.2) -> str:
+                   model: str = CHAT_MODEL, temperature: float = 0.2,
+                   history: Optional[List[Dict[str, str]]] = None,
+                   priority: str = INTERACTIVE) -> str:
     """
     Genera una respuesta usando IA basada en chunks de contexto.
     
@@ -455,56 +1428,25 @@ def generate_answer(question: str, context_chunks: List[str],
         context_chunks: Lista de chunks de contexto
         model: Modelo de IA a usar
         temperature: Temperatura para la generación
+        history: Turnos anteriores de la sesión ({"role", "content"})
+        priority: Prioridad en el planificador
         
     Returns:
         Respuesta generada por la IA
     """
-    if not question or not question.strip():
-        raise ValueError("La pregunta no puede estar vacía")
-    
-    if not context_chunks:
-        return "No tengo suficiente información para responder tu pregunta."
-    
-    # Filtrar chunks vacíos o muy cortos
-    valid_chunks = [chunk for chunk in context_chunks if chunk and len(chunk.strip()) > 10]
-    if not valid_chunks:
-        return "No encontré información útil en los documentos para responder tu pregunta."
+    messages, reason = _answer_messages_or_reason(question, context_chunks, history)
+    if messages is None:
+        return reason
     
     try:
-        # Limitar el contexto para evitar tokens excesivos
-        max_context_length = 8000  # Aproximadamente 2000 palabras
-        context_text = "\n".join(valid_chunks)
-        
-        if len(context_text) > max_context_length:
-            # Truncar contexto manteniendo los chunks más relevantes
-            context_text = context_text[:max_context_length] + "..."
-            logger.warning(f"Contexto truncado a {max_context_length} caracteres")
-        
-        # Prompts optimizados según el tipo de pregunta
-        if "resumen" in question.lower() or "resume" in question.lower():
-            system_prompt = "Eres un asistente experto en crear resúmenes claros y concisos. Responde de manera estructurada y fácil de entender."
-        elif "comparar" in question.lower() or "diferencias" in question.lower():
-            system_prompt = "Eres un asistente experto en análisis comparativo. Identifica similitudes y diferencias de manera clara y estructurada."
-        elif "clasificar" in question.lower() or "temas" in question.lower():
-            system_prompt = "Eres un asistente experto en clasificación y categorización. Organiza la información en temas claros y específicos."
-        else:
-            system_prompt = "Eres un asistente experto en análisis de documentos. Responde de manera clara, precisa y basada en el contexto proporcionado."
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Contexto:\n{context_text}\n\nPregunta: {question}\n\nResponde de manera clara y estructurada:"}
-        ]
-        
         logger.info(f"Generando respuesta con modelo {model} para pregunta de {len(question)} caracteres")
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=1000
+        # Preguntas idénticas en curso (p. ej. varios "Resumen" del mismo documento) comparten la llamada
+        answer = answer_flights.do(
+            flight_key(model, temperature, messages),
+            lambda: create_chat_completion(messages, model=model, temperature=temperature,
+                                           max_tokens=1000, priority=priority).choices[0].message.content
         )
-        
-        answer = response.choices[0].message.content
         logger.info(f"Respuesta generada exitosamente: {len(answer)} caracteres")
         
         return answer
@@ -514,36 +1456,46 @@ def generate_answer(question: str, context_chunks: List[str],
         return "Lo siento, hubo un error generando la respuesta. Por favor, intenta de nuevo."
 
 def generate_answer_stream(question: str, context_chunks: List[str], 
-                          model: str = CHAT_MODEL, temperature: float = 0.2):
+                          model: str = CHAT_MODEL, temperature: float = 0.2,
+                          history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
     """
-    Genera una respuesta en streaming (para implementación futura).
+    Igual que generate_answer, pero entrega la respuesta por fragmentos a medida que llega.
     """
-    # Placeholder para implementación de streaming
-    answer = generate_answer(question, context_chunks, model, temperature)
-    yield answer
+    messages, reason = _answer_messages_or_reason(question, context_chunks, history)
+    if messages is None:
+        yield reason
+        return
+    
+    produced = False
+    try:
+        for delta in stream_chat_completion(messages, model=model, temperature=temperature, max_tokens=1000):
+            produced = True
+            yield delta
+    except Exception as e:
+        logger.error(f"Error generando respuesta en streaming: {e}")
+        if not produced:
+            yield "Lo siento, hubo un error generando la respuesta. Por favor, intenta de nuevo."
 
 
 # --- Listar PDFs ---
-def list_pdfs(collection_name: str = "pdf_chunks") -> List[str]:
+def list_pdfs(collection_name: str = "pdf_chunks", tenant: str = DEFAULT_TENANT) -> List[str]:
     """
-    Lista todos los PDFs disponibles en la colección.
+    Lista los PDFs de un tenant.
     
     Args:
         collection_name: Nombre de la colección
+        tenant: Tenant dueño de los PDFs
         
     Returns:
         Lista de nombres de PDFs
     """
     try:
-        existing = [c.name for c in qdrant.get_collections().collections]
-        if collection_name not in existing:
-            logger.warning(f"Colección '{collection_name}' no existe")
+        collection = embedding_indexes.active(collection_name).collection
+        if not qdrant_collections.exists(collection):
+            logger.warning(f"Colección '{collection}' no existe")
             return []
 
-        points, _ = qdrant.scroll(collection_name=collection_name, limit=10000)
-        pdfs = set(p.payload["doc"] for p in points if "doc" in p.payload)
-        
-        pdf_list = list(pdfs)
+        pdf_list = get_chunk_store().list_documents(tenant)
         logger.info(f"PDFs encontrados: {len(pdf_list)}")
         return pdf_list
         
@@ -551,55 +1503,41 @@ def list_pdfs(collection_name: str = "pdf_chunks") -> List[str]:
         logger.error(f"Error listando PDFs: {e}")
         return []
 
-def get_pdf_info(pdf_name: str, collection_name: str = "pdf_chunks") -> Dict[str, Any]:
+def pdf_exists(pdf_name: str, collection_name: str = "pdf_chunks", tenant: str = DEFAULT_TENANT) -> bool:
+    """Indica si el tenant tiene un PDF con ese nombre."""
+    if not qdrant_collections.exists(embedding_indexes.active(collection_name).collection):
+        return False
+    return get_chunk_store().has_document(tenant, pdf_name)
+
+def get_pdf_info(pdf_name: str, collection_name: str = "pdf_chunks",
+                 tenant: str = DEFAULT_TENANT) -> Dict[str, Any]:
     """
     Obtiene información detallada de un PDF específico.
     
     Args:
         pdf_name: Nombre del PDF
         collection_name: Nombre de la colección
+        tenant: Tenant dueño del PDF
         
     Returns:
         Diccionario con información del PDF
     """
     try:
-        points, _ = qdrant.scroll(collection_name=collection_name, limit=10000)
-        pdf_points = [p for p in points if p.payload.get("doc") == pdf_name]
-        
-        if not pdf_points:
-            return {}
-        
-        # Calcular estadísticas
-        total_chunks = len(pdf_points)
-        total_chars = sum(p.payload.get("char_count", 0) for p in pdf_points)
-        pages = set(p.payload.get("page", 0) for p in pdf_points)
-        
-        # Obtener metadatos del primer punto
-        first_point = pdf_points[0]
-        
-        return {
-            "name": pdf_name,
-            "title": first_point.payload.get("title", ""),
-            "author": first_point.payload.get("author", ""),
-            "total_chunks": total_chunks,
-            "total_pages": len(pages),
-            "total_characters": total_chars,
-            "created_at": first_point.payload.get("created_at", ""),
-            "pages": sorted(list(pages))
-        }
+        return get_chunk_store().document_info(tenant, pdf_name)
         
     except Exception as e:
         logger.error(f"Error obteniendo información de PDF {pdf_name}: {e}")
         return {}
 
 # --- Eliminar un PDF completo ---
-def delete_pdf(pdf_name: str, collection_name: str = "pdf_chunks") -> bool:
+def delete_pdf(pdf_name: str, collection_name: str = "pdf_chunks", tenant: str = DEFAULT_TENANT) -> bool:
     """
     Elimina un PDF completo de la colección.
     
     Args:
         pdf_name: Nombre del PDF a eliminar
         collection_name: Nombre de la colección
+        tenant: Tenant dueño del PDF
         
     Returns:
         True si se eliminó exitosamente, False si no se encontró
@@ -609,13 +1547,32 @@ def delete_pdf(pdf_name: str, collection_name: str = "pdf_chunks") -> bool:
         return False
     
     try:
-        points, _ = qdrant.scroll(collection_name=collection_name, limit=10000)
-        ids_to_delete = [p.id for p in points if p.payload.get("doc") == pdf_name]
+        # Borrado por filtro del lado del servidor, sin traer los puntos
+        doc_filter = _tenant_filter(tenant, pdf_name)
+        active, *shadows = embedding_indexes.targets(collection_name)
+        with observe_stage("qdrant_metadata"):
+            count = get_qdrant().count(active.collection, count_filter=doc_filter, exact=True).count
 
-        if ids_to_delete:
-            selector = models.PointIdsList(points=ids_to_delete)
-            qdrant.delete(collection_name=collection_name, points_selector=selector)
-            logger.info(f"PDF '{pdf_name}' eliminado con {len(ids_to_delete)} chunks")
+        # El índice sombra de una migración en curso también tiene los puntos
+        for index in ([active] if count else []) + shadows:
+            with observe_stage("qdrant_delete"):
+                get_qdrant().delete(
+                    collection_name=index.collection,
+                    points_selector=models.FilterSelector(filter=doc_filter)
+                )
+        for index in [active] + shadows:
+            summaries = summary_collection_name(index.collection)
+            if qdrant_collections.exists(summaries):
+                with observe_stage("qdrant_delete"):
+                    get_qdrant().delete(
+                        collection_name=summaries,
+                        points_selector=models.FilterSelector(filter=doc_filter)
+                    )
+        # Borrar el texto después de los puntos: nunca queda un punto buscable sin texto
+        stored = get_chunk_store().delete_document(tenant, pdf_name)
+        
+        if count or stored:
+            logger.info(f"PDF '{pdf_name}' eliminado con {count} chunks")
             return True
         else:
             logger.warning(f"No se encontró PDF '{pdf_name}' en la colección")
@@ -626,45 +1583,195 @@ def delete_pdf(pdf_name: str, collection_name: str = "pdf_chunks") -> bool:
         return False
 
 # --- Métricas y Analytics ---
-def get_usage_metrics(collection_name: str = "pdf_chunks") -> Dict[str, Any]:
+def record_ingest(pdf_name: str, file_size: int, ingest_s: float, tenant: str = DEFAULT_TENANT):
+    """Suma a las estadísticas del documento el tamaño del PDF y la duración de su ingesta."""
+    try:
+        get_chunk_store().record_ingest(tenant, pdf_name, file_size, ingest_s)
+    except Exception as e:
+        logger.warning(f"No se pudieron guardar las estadísticas de ingesta de {pdf_name}: {e}")
+
+def get_usage_metrics(collection_name: str = "pdf_chunks", tenant: str = DEFAULT_TENANT) -> Dict[str, Any]:
     """
-    Obtiene métricas de uso del sistema.
+    Obtiene métricas de uso de un tenant.
+    
+    Lee los contadores que se actualizan al ingestar, eliminar y buscar:
+    no recorre chunks ni consulta a Qdrant, así se puede consultar seguido.
     
     Args:
         collection_name: Nombre de la colección
+        tenant: Tenant a consultar
         
     Returns:
         Diccionario con métricas
     """
     try:
-        info = get_collection_info(collection_name)
-        pdfs = list_pdfs(collection_name)
-        
-        # Calcular estadísticas por PDF
-        pdf_stats = []
-        total_chunks = 0
-        total_chars = 0
-        
-        for pdf_name in pdfs:
-            pdf_info = get_pdf_info(pdf_name, collection_name)
-            if pdf_info:
-                pdf_stats.append(pdf_info)
-                total_chunks += pdf_info.get("total_chunks", 0)
-                total_chars += pdf_info.get("total_characters", 0)
-        
+        query_stats.flush()
+        store = get_chunk_store()
+        totals = store.tenant_stats(tenant)
+        documents = totals["documents"]
         return {
-            "collection_info": info,
-            "total_pdfs": len(pdfs),
-            "total_chunks": total_chunks,
-            "total_characters": total_chars,
-            "average_chunks_per_pdf": total_chunks / len(pdfs) if pdfs else 0,
-            "pdfs": pdf_stats
+            "tenant": tenant,
+            "total_pdfs": documents,
+            "total_chunks": totals["chunks"],
+            "total_characters": totals["characters"],
+            "total_pages": totals["pages"],
+            "total_bytes": totals["bytes"],
+            "total_queries": totals["queries"],
+            "last_query_at": totals["last_query_at"] or None,
+            "average_chunks_per_pdf": totals["chunks"] / documents if documents else 0,
+            "average_ingest_s": round(totals["ingest_s"] / documents, 3) if documents else 0,
+            "pdfs": store.document_stats(tenant)
         }
         
     except Exception as e:
         logger.error(f"Error obteniendo métricas: {e}")
         return {}
 
+def get_corpus_summary(collection_name: str = "pdf_chunks", tenant: str = DEFAULT_TENANT) -> Dict[str, Any]:
+    """
+    Totales del tenant y de toda la colección para /status, sin consultar a Qdrant.
+    
+    Returns:
+        Diccionario con los totales del tenant ("tenant") y globales ("global")
+    """
+    query_stats.flush()
+    store = get_chunk_store()
+    index = embedding_indexes.active(collection_name)
+    totals = store.global_stats()
+    return {
+        "tenant": store.tenant_stats(tenant),
+        "global": totals,
+        "collection_info": {
+            "name": index.collection,
+            "embedding_model": index.model,
+            "vector_size": index.vector_size,
+            "points_count": totals["chunks"],
+        }
+    }
+
+# --- Arranque ---
+def warmup(collection_name: str = "pdf_chunks", vector_size: int = VECTOR_SIZE,
+           openai: bool = False, queries: Optional[List[str]] = None):
+    """
+    Prepara el backend antes de recibir tráfico.
+    
+    Abre las conexiones a Qdrant, asegura la colección y sus índices de payload
+    y, opcionalmente, abre la conexión a OpenAI y precalcula embeddings de
+    consultas frecuentes.
+    
+    Args:
+        collection_name: Colección a preparar (se prepara su índice activo)
+        vector_size: Sin efecto, se mantiene por compatibilidad (el tamaño lo define el índice)
+        openai: Si True, abre la conexión a OpenAI (listar modelos no consume tokens)
+        queries: Consultas cuyo embedding se deja en cache
+    """
+    start = time.perf_counter()
+    with observe_stage("qdrant_metadata"):
+        get_qdrant_search().get_collections()
+    index = embedding_indexes.active(collection_name)
+    get_embedding_provider(index)  # un modelo local se carga aquí y no en la primera consulta
+    create_collection_if_not_exists(index.collection, index.vector_size)
+    
+    if openai:
+        get_openai_client().models.list()
+    if queries:
+        get_embeddings_batch(queries, priority=INTERACTIVE)
+    
+    logger.info(f"Warmup completado en {time.perf_counter() - start:.2f}s")
+
+def check_embedding_config(collection_name: str = "pdf_chunks"):
+    """
+    Verifica que el modelo configurado sea el del índice registrado de la colección.
+
+    Una colección sin registro se registra con el modelo configurado: desde
+    ahí, cambiar EMBEDDING_PROVIDER u OPENAI_EMBEDDING_MODEL (aunque la
+    dimensión no cambie) ya no mezcla en silencio vectores de dos modelos en
+    la misma colección. Con chunks guardados, la configuración tiene que
+    coincidir con el índice activo o con el sombra de una migración en curso.
+
+    Raises:
+        EmbeddingConfigError: Si la configuración no coincide con el índice registrado
+    """
+    configured = _default_index(collection_name)
+    indexes = _load_indexes(collection_name)
+    store = get_chunk_store()
+    if ACTIVE not in indexes or (
+            indexes[ACTIVE].collection == collection_name and not store.count_chunks()):
+        # Sin registro (o sin datos todavía): el modelo configurado pasa a ser el de la colección
+        store.set_index(collection_name, ACTIVE, collection_name, configured.model, configured.vector_size)
+        embedding_indexes.invalidate(collection_name)
+        return
+    if any((index.model, index.vector_size) == (configured.model, configured.vector_size)
+           for index in indexes.values()):
+        return
+    active = indexes[ACTIVE]
+    raise EmbeddingConfigError(
+        f"La colección '{collection_name}' está indexada con {active.model} ({active.vector_size}) y la "
+        f"configuración indica {configured.model} ({configured.vector_size}): ajustar EMBEDDING_PROVIDER, "
+        "OPENAI_EMBEDDING_MODEL y VECTOR_SIZE al índice o cambiar de modelo con POST /admin/migration"
+    )
+
+def upgrade_legacy_points(collection_name: str = "pdf_chunks"):
+    """
+    Lleva los puntos de esquemas anteriores al actual.
+    
+    Asigna DEFAULT_TENANT a los puntos sin tenant, mueve su texto al chunk
+    store y genera los vectores de resumen que falten. Corre en cada arranque,
+    haya warmup o no: sin ella los puntos anteriores a la multi-tenancy no
+    aparecen en ningún tenant.
+    
+    Args:
+        collection_name: Colección lógica (se actualiza su índice activo)
+    """
+    index = embedding_indexes.active(collection_name)
+    create_collection_if_not_exists(index.collection, index.vector_size)
+    assign_default_tenant(index.collection)
+    migrate_payloads_to_store(index.collection)
+    backfill_summaries(index)
+
+# Último sondeo a OpenAI: (momento, resultado)
+_openai_probe: Optional[Tuple[float, str]] = None
+_openai_probe_lock = threading.Lock()
+
+def _probe_openai() -> str:
+    """
+    Consulta barata a OpenAI (models.list) con un timeout corto y sin reintentos.
+
+    Un 429 cuenta como disponible: la API responde y el planificador de
+    rate limits ya lo maneja. El resultado se reutiliza OPENAI_PROBE_TTL_S
+    segundos para que los sondeos de readiness no lleguen a OpenAI cada vez.
+    """
+    global _openai_probe
+    with _openai_probe_lock:
+        if _openai_probe is not None and time.monotonic() - _openai_probe[0] < OPENAI_PROBE_TTL_S:
+            return _openai_probe[1]
+        try:
+            get_openai_client().with_options(timeout=OPENAI_PROBE_TIMEOUT, max_retries=0).models.list()
+            result = "ok"
+        except RateLimitError:
+            result = "ok"
+        except Exception as e:
+            result = str(e) or type(e).__name__
+        _openai_probe = (time.monotonic(), result)
+        return result
+
+def check_readiness() -> Dict[str, Any]:
+    """
+    Verifica que las dependencias respondan.
+    
+    Returns:
+        Diccionario {dependencia: "ok" o mensaje de error}
+    """
+    checks = {}
+    try:
+        with observe_stage("qdrant_metadata"):
+            get_qdrant_search().get_collections()
+        checks["qdrant"] = "ok"
+    except Exception as e:
+        checks["qdrant"] = str(e) or type(e).__name__
+    checks["openai"] = _probe_openai()
+    return checks
+
 def clear_cache():
     """Limpia el cache de embeddings."""
     global embedding_cache
@@ -0,0 +1,239 @@
+"""
+Worker de ingesta: toma trabajos de la cola durable y los procesa fuera del API.
+
+Ejemplo:
+    python -m worker --concurrency 2 --metrics-port 9100
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from job_queue import JOB_RETENTION_S, Job, JobQueue, get_job_queue
+from metrics import JOBS, observe_duration, observe_stage
+from pdf_utils import process_pdf
+from vector_utils import (
+    EmbeddingConfigError,
+    check_embedding_config,
+    close_clients,
+    delete_pdf,
+    record_ingest,
+    store_chunks_multi,
+)
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "60"))  # sin heartbeat durante este tiempo, otro worker lo retoma
+JOB_POLL_INTERVAL_S = float(os.getenv("JOB_POLL_INTERVAL_S", "1"))
+PURGE_INTERVAL_S = 3600
+
+# Ids de punto de un trabajo: uuid5(namespace, "<job_id>/<índice del chunk>")
+_POINT_NAMESPACE = uuid.UUID("3b1d7f0e-9a4c-4d2b-8e61-5c7a2f9d0b14")
+
+
+class PermanentJobError(Exception):
+    """Error que no se arregla reintentando (p. ej. un PDF corrupto)."""
+
+
+def handle_ingest(job: Job, queue: JobQueue, lease_s: float) -> Dict[str, Any]:
+    """
+    Extrae, divide en chunks y almacena un PDF subido por /ingest.
+
+    Los ids de punto son los mismos en todos los intentos del trabajo: un
+    reintento sobrescribe lo que un intento anterior alcanzó a subir, aunque
+    ese worker siga colgado escribiendo, en vez de borrarlo mientras escribe.
+
+    Args:
+        job: Trabajo tomado de la cola
+        queue: Cola de la que se tomó (para comprobar el lease antes de escribir)
+        lease_s: Duración del lease del worker
+    """
+    def owns_lease() -> bool:
+        # Renueva el lease; False si ya lo retomó otro worker
+        return queue.heartbeat(job.id, job.lease_owner, lease_s)
+
+    path, filename = job.payload["path"], job.payload["filename"]
+    start = time.perf_counter()
+    try:
+        result = process_pdf(path, filename)
+    except (ValueError, FileNotFoundError) as e:
+        raise PermanentJobError(str(e) or "No se pudo extraer texto del PDF") from e
+    observe_duration("pdf_extraction", result["extraction_s"])
+    observe_duration("chunking", result["chunking_s"])
+
+    for i, chunk in enumerate(result["chunks"]):
+        chunk["point_id"] = str(uuid.uuid5(_POINT_NAMESPACE, f"{job.id}/{i}"))
+    # La extracción puede tardar más que el lease: no escribir si el trabajo ya es de otro
+    if not owns_lease():
+        raise RuntimeError("El worker perdió el lease del trabajo")
+    failed = store_chunks_multi(result["chunks"], tenant=job.tenant, delete_failed=False)
+    if failed:
+        # Solo el dueño del lease limpia: un intento colgado no borra lo que guardó quien lo retomó
+        if owns_lease():
+            delete_pdf(filename, tenant=job.tenant)
+        raise RuntimeError(failed.get(filename) or "Error almacenando los chunks")
+    record_ingest(filename, os.path.getsize(path), time.perf_counter() - start, job.tenant)
+    return {"num_pages": result["num_pages"], "num_chunks": len(result["chunks"]), "dedup": result["dedup"]}
+
+
+HANDLERS: Dict[str, Callable[[Job, JobQueue, float], Dict[str, Any]]] = {"ingest": handle_ingest}
+
+
+def _remove_spool_file(job: Job):
+    path = job.payload.get("path")
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar {path}: {e}")
+
+
+class Worker:
+    """
+    Procesa trabajos de la cola de a uno, renovando el lease mientras trabaja.
+
+    Varios workers (threads o procesos, en uno o varios hosts que compartan
+    la cola) reparten los trabajos entre sí: la cola garantiza que cada
+    trabajo tenga un solo dueño a la vez.
+
+    Args:
+        queue: Cola de trabajos
+        handlers: Función que procesa cada tipo de trabajo (recibe el trabajo, la cola y el lease)
+        worker_id: Identificador del worker en los leases
+        lease_s: Duración del lease (se renueva cada tercio)
+        poll_interval_s: Espera entre consultas con la cola vacía
+    """
+
+    def __init__(self, queue: JobQueue, handlers: Optional[Dict[str, Callable[[Job, JobQueue, float], Dict[str, Any]]]] = None,
+                 worker_id: Optional[str] = None, lease_s: float = JOB_LEASE_S,
+                 poll_interval_s: float = JOB_POLL_INTERVAL_S):
+        self.queue = queue
+        self.handlers = handlers or HANDLERS
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_s = lease_s
+        self.poll_interval_s = poll_interval_s
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+
+    def _heartbeat(self, job: Job, done: threading.Event):
+        while not done.wait(self.lease_s / 3):
+            if not self.queue.heartbeat(job.id, self.worker_id, self.lease_s):
+                logger.warning(f"Worker {self.worker_id} perdió el lease del trabajo {job.id}")
+                return
+
+    def run_once(self) -> bool:
+        """
+        Procesa un trabajo si hay alguno disponible.
+
+        Returns:
+            True si procesó un trabajo
+        """
+        job = self.queue.lease(self.worker_id, self.lease_s, kinds=list(self.handlers))
+        if job is None:
+            return False
+
+        logger.info(f"Trabajo {job.id} ({job.kind}, intento {job.attempts}/{job.max_attempts})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        heartbeat.start()
+        try:
+            with observe_stage("job"):
+                result = self.handlers[job.kind](job, self.queue, self.lease_s)
+        except Exception as e:
+            retry = not isinstance(e, PermanentJobError)
+            final = not retry or job.attempts >= job.max_attempts
+            logger.error(f"Trabajo {job.id} falló (intento {job.attempts}): {e}")
+            self.queue.fail(job.id, self.worker_id, str(e) or type(e).__name__, retry=retry)
+            JOBS.labels(kind=job.kind, result="failed" if final else "retried").inc()
+            if final:
+                _remove_spool_file(job)
+        else:
+            if self.queue.complete(job.id, self.worker_id, result):
+                JOBS.labels(kind=job.kind, result="succeeded").inc()
+                _remove_spool_file(job)
+            else:
+                logger.warning(f"Trabajo {job.id} terminado sin lease: lo retomó otro worker")
+        finally:
+            done.set()
+            heartbeat.join()
+        return True
+
+    def run(self):
+        """Procesa trabajos hasta que se llame a ``stop``."""
+        logger.info(f"Worker {self.worker_id} esperando trabajos")
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+                if time.time() - self._last_purge > PURGE_INTERVAL_S:
+                    self._last_purge = time.time()
+                    purged = self.queue.purge(JOB_RETENTION_S)
+                    if purged:
+                        logger.info(f"{purged} trabajos terminados eliminados de la cola")
+            except Exception as e:
+                # La cola no respondió (p. ej. base bloqueada): reintentar en la próxima vuelta
+                logger.error(f"Error consultando la cola de trabajos: {e}")
+            self._stop.wait(self.poll_interval_s)
+
+    def drain(self) -> int:
+        """Procesa trabajos hasta vaciar la cola. Devuelve cuántos procesó."""
+        processed = 0
+        while not self._stop.is_set() and self.run_once():
+            processed += 1
+        return processed
+
+    def stop(self):
+        """Termina después del trabajo en curso."""
+        self._stop.set()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Worker de ingesta de PDFs")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY,
+                        help="Trabajos en paralelo en este proceso (para CPU, mejor más procesos)")
+    parser.add_argument("--drain", action="store_true", help="Procesar los trabajos pendientes y salir")
+    parser.add_argument("--metrics-port", type=int, help="Exponer métricas de Prometheus en este puerto")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    if args.metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(args.metrics_port)
+
+    try:
+        check_embedding_config()
+    except EmbeddingConfigError as e:
+        logger.error(str(e))
+        return 1
+    queue = get_job_queue()
+    workers = [Worker(queue) for _ in range(max(1, args.concurrency))]
+
+    def shutdown(signum, frame):
+        logger.info("Deteniendo workers después de los trabajos en curso")
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    target = (lambda w: w.drain()) if args.drain else (lambda w: w.run())
+    threads = [threading.Thread(target=target, args=(w,), name=f"worker-{i}") for i, w in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    # join con timeout para que las señales lleguen al thread principal
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(0.5)
+    close_clients()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())